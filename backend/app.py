@@ -5,16 +5,35 @@ import os
 import shutil
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit
-from video_caption_grabber import grab_post
-from separate_frames import video_to_frames
-from classify_frames import classify_and_move_images
-from parse_gemini import parse_content
-from transcribe_video import transcribe_video
+from flask_socketio import SocketIO, emit, join_room, leave_room
+from pipeline import (
+    PostJob,
+    TEMP_PROCESSING_DIR,
+    DATA_TTL_SECONDS,
+    result_cache,
+    expiry_registry,
+    artifact_cache,
+    cleanup_request_dir,
+    cached_result,
+    open_request_dir,
+    remaining_ttl_seconds,
+)
+from job_queue import get_job_backend, MemoryJobBackend
+from product_jobs import (
+    ProductJob,
+    PRODUCT_BATCH_MAX_SIZE,
+    get_product_job_store,
+    create_product_job,
+    create_product_batch,
+    product_job_status,
+    product_batch_status,
+)
+from expiry import REAPER_INTERVAL_SECONDS, reap_expired
+from worker import start_local_workers
+from workers import job_slots, MAX_CONCURRENT_JOBS
 import re
 from flask import send_from_directory
 import time
-import uuid
 import json
 import threading
 from datetime import datetime, timedelta
@@ -26,111 +45,45 @@ app.config['SECRET_KEY'] = 'secret!'
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
 CORS(app)
 
-# Base directory for all temporary processing
-TEMP_PROCESSING_DIR = "temp_processing"
-# How long to keep generated artifacts accessible to the frontend
-DATA_TTL_SECONDS = 600  # 10 minutes
-# Index file to map shortcode -> request_id for reuse
-INDEX_PATH = os.path.join(TEMP_PROCESSING_DIR, "index.json")
-os.makedirs(TEMP_PROCESSING_DIR, exist_ok=True)
-
 # Track active requests by WebSocket session and allow graceful cancellation/cleanup
 sid_to_request = {}
-canceled_sids = set()
-
-
-def _read_index():
-    try:
-        if os.path.exists(INDEX_PATH):
-            with open(INDEX_PATH, "r", encoding="utf-8") as f:
-                return json.load(f)
-    except Exception:
-        pass
-    return {}
-
-
-def _write_index(index_data):
-    try:
-        os.makedirs(TEMP_PROCESSING_DIR, exist_ok=True)
-        with open(INDEX_PATH, "w", encoding="utf-8") as f:
-            json.dump(index_data, f)
-    except Exception:
-        pass
-
-
-def _remaining_ttl_seconds(request_dir):
-    now_ts = time.time()
-    try:
-        last_mtime = os.path.getmtime(request_dir)
-    except Exception:
-        return 0
-    for root, _, files in os.walk(request_dir):
-        for fname in files:
-            try:
-                last_mtime = max(last_mtime, os.path.getmtime(os.path.join(root, fname)))
-            except Exception:
-                pass
-    spent = now_ts - last_mtime
-    remain = int(max(0, DATA_TTL_SECONDS - spent))
-    return remain
-
-
-def _cleanup_request_dir(request_dir):
-    try:
-        if os.path.exists(request_dir):
-            shutil.rmtree(request_dir)
-    except Exception:
-        pass
-
-
-def _placeholder_result(caption_text, transcript_text):
-    base_desc = caption_text or transcript_text or ""
-    return {
-        "product_name": "Generated Listing",
-        "description": base_desc,
-        "key_features": [],
-        "target_audience": "",
-        "seo_keywords": [],
-        "technical_details": {},
-        "technical_details_schema": {"category": "", "properties": {}}
-    }
+# Clients following each request (request_id -> set of sids); the request's
+# Socket.IO room has the same name
+request_subscribers = {}
+# Requests whose last subscriber disconnected
+canceled_requests = set()
+# Runs still in progress, keyed by shortcode, so concurrent requests for the
+# same post join one run instead of starting another
+inflight_jobs = {}
+
+# Queue backend for out-of-process workers (None when jobs run inline)
+job_backend = get_job_backend()
+_relay_started = False
+# Progress and results of product-name searches
+product_job_store = get_product_job_store()
+
+
+def _reap_expired_requests():
+    """Deletes expired request directories on a fixed schedule."""
+    while True:
+        socketio.sleep(REAPER_INTERVAL_SECONDS)
+        try:
+            reaped = reap_expired(expiry_registry, TEMP_PROCESSING_DIR, cleanup_request_dir)
+            result_cache.evict_expired()
+            vcg.post_metadata_cache.evict_expired()
+            if artifact_cache is not None:
+                artifact_cache.evict()
+            if reaped:
+                print(f"Reaped {len(reaped)} expired request directories")
+        except Exception as e:
+            print(f"Error while reaping expired requests: {e}")
 
 
 def _emit_cached_result(sid, shortcode):
-    index = _read_index()
-    entry = index.get(shortcode)
-    if not entry:
-        return False
-    request_id = entry.get("request_id")
-    if not request_id:
-        return False
-    request_dir = os.path.join(TEMP_PROCESSING_DIR, request_id)
-    result_path = os.path.join(request_dir, "result.json")
-    final_images_dir = os.path.join(request_dir, "relevant_final")
-    if not (os.path.exists(result_path) and os.path.isdir(final_images_dir)):
-        return False
-
-    remaining = _remaining_ttl_seconds(request_dir)
-    if remaining <= 0:
-        return False
-
-    try:
-        with open(result_path, 'r', encoding='utf-8') as f:
-            structured_content = json.load(f)
-    except Exception:
+    result = cached_result(shortcode)
+    if result is None:
         return False
-
-    image_files = sorted(os.listdir(final_images_dir))
-    final_images = [f"/image/{request_id}/{filename}" for filename in image_files[:30]]
-
-    expiration_time = datetime.utcnow() + timedelta(seconds=remaining)
-    socketio.emit('result', {
-        'structured_content': structured_content,
-        'images': final_images,
-        'request_id': request_id,
-        'expiration_timestamp': expiration_time.isoformat() + 'Z',
-        'expires_in_seconds': remaining
-    }, room=sid)
+    socketio.emit('result', result, room=sid)
     socketio.sleep(0.05)
     return True
 @app.route('/')
@@ -199,29 +152,26 @@ def cleanup_request(request_id):
 def cleanup_all():
     try:
         if os.path.exists(TEMP_PROCESSING_DIR):
-            now_ts = time.time()
-            deleted = []
+            deleted = reap_expired(expiry_registry, TEMP_PROCESSING_DIR, cleanup_request_dir)
             kept = []
+            active = set(request_subscribers) | {job["request_id"] for job in inflight_jobs.values()}
             for entry in os.listdir(TEMP_PROCESSING_DIR):
                 entry_path = os.path.join(TEMP_PROCESSING_DIR, entry)
                 if not os.path.isdir(entry_path):
                     continue
-
-                # Determine last modification time inside the request dir
-                last_mtime = os.path.getmtime(entry_path)
-                for root, _, files in os.walk(entry_path):
-                    for fname in files:
-                        try:
-                            last_mtime = max(last_mtime, os.path.getmtime(os.path.join(root, fname)))
-                        except Exception:
-                            pass
-
-                if (now_ts - last_mtime) > DATA_TTL_SECONDS:
+                # Unregistered, idle directories (e.g. abandoned runs) expire by their own mtime
+                if (
+                    entry not in active
+                    and expiry_registry.expires_at(entry) is None
+                    and remaining_ttl_seconds(entry) <= 0
+                ):
                     shutil.rmtree(entry_path)
                     deleted.append(entry)
                 else:
                     kept.append(entry)
 
+            result_cache.evict_expired()
+            vcg.post_metadata_cache.evict_expired()
             return jsonify({"message": "Cleanup completed.", "deleted": deleted, "kept": kept}), 200
         else:
             return jsonify({"message": "No temp directory found."}), 200
@@ -239,9 +189,9 @@ def update_session():
             return jsonify({"error": "Missing sessionId in body"}), 400
         # Update the module-level variable used for cookie-based login
         vcg.INSTAGRAM_SESSIONID = session_id
-        # Bust the cached Instaloader session so the next call re-initializes with new cookie
+        # Bust the cached Instaloader sessions so the next call re-initializes with new cookie
         try:
-            vcg.get_instaloader_session.cache_clear()
+            vcg.reset_sessions()
         except Exception:
             pass
         # Also persist the session id into the source file so it's visible and survives restarts
@@ -262,167 +212,230 @@ def update_session():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-def process_instagram_post_sync(sid, shortcode, request_id, request_dir):
-    try:
-        print(f"Starting processing for sid: {sid}, shortcode: {shortcode}")
-        socketio.emit('progress', {'data': 'Downloading media and caption...', 'progress': 20}, room=sid)
-        socketio.sleep(0.1)
-        post_info = grab_post(shortcode, request_dir)
-        if not post_info:
-            raise Exception("Failed to get post information")
-        print(f"Post info retrieved: {post_info}")
-
-        # Emit the freshly downloaded original caption as early as possible
-        try:
-            caption_path_early = os.path.join(request_dir, 'caption.txt')
-            if os.path.exists(caption_path_early):
-                with open(caption_path_early, 'r', encoding='utf-8') as cf:
-                    early_caption = cf.read()
-                socketio.emit('caption_update', {'caption': early_caption}, room=sid)
-                socketio.sleep(0.01)
-        except Exception:
-            pass
+def _run_product_job(job_id, product_name):
+    """Runs a product job's search inline once one of the MAX_CONCURRENT_JOBS slots is free."""
+    with job_slots.slot():
+        ProductJob(job_id, product_name, product_job_store, process_post=_process_product_post).run()
+
+
+def _process_product_post(product_job, shortcode):
+    """
+    ProductJob.process_post for the web process: the product's post joins a
+    run of the same shortcode already in progress, or starts one that socket
+    requests can join in turn. _on_job_event reports the run back to the job.
+    """
+    job = inflight_jobs.get(shortcode) or _start_post_job(shortcode)
+    job["product_jobs"].append(product_job)
+    product_job.attach(job["request_id"])
+    if job["last_progress"]:
+        product_job.on_event('progress', job["last_progress"])
+
+
+def _start_product_jobs(product_names):
+    """Creates and starts (or enqueues) one job per distinct product name; returns [{job_id, product_name}]."""
+    jobs = []
+    for product_name in dict.fromkeys(product_names):
+        job_id = create_product_job(product_job_store, product_name)
+        if job_backend is not None:
+            _ensure_job_relay()
+            job_backend.enqueue({"job_id": job_id, "type": "product", "product_name": product_name})
+        else:
+            socketio.start_background_task(_run_product_job, job_id, product_name)
+        jobs.append({"job_id": job_id, "product_name": product_name})
+    return jobs
+
+
+def _product_names(values):
+    if not isinstance(values, list):
+        return None
+    names = [value.strip() for value in values if isinstance(value, str) and value.strip()]
+    return names if len(names) == len(values) else None
+
+
+@app.route('/products', methods=['POST'])
+def start_product_job():
+    payload = request.get_json(silent=True) or {}
+    names = _product_names([payload.get('product_name')])
+    if not names:
+        return jsonify({"error": "Missing product_name in body"}), 400
+    job = _start_product_jobs(names)[0]
+    return jsonify({**job, "status_url": f"/products/{job['job_id']}"}), 202
+
+
+@app.route('/products/batch', methods=['POST'])
+def start_product_batch():
+    payload = request.get_json(silent=True) or {}
+    names = _product_names(payload.get('product_names'))
+    if not names:
+        return jsonify({"error": "product_names must be a non-empty list of product names"}), 400
+    if len(names) > PRODUCT_BATCH_MAX_SIZE:
+        return jsonify({"error": f"At most {PRODUCT_BATCH_MAX_SIZE} product names per batch"}), 400
+    jobs = _start_product_jobs(names)
+    batch_id = create_product_batch(product_job_store, [job["job_id"] for job in jobs])
+    return jsonify({"batch_id": batch_id, "jobs": jobs, "status_url": f"/products/batch/{batch_id}"}), 202
+
+
+@app.route('/products/<job_id>', methods=['GET'])
+def get_product_job(job_id):
+    status = product_job_status(product_job_store, job_id)
+    if status is None:
+        return jsonify({"error": "Product job not found or has expired."}), 404
+    return jsonify(status)
+
+
+@app.route('/products/batch/<batch_id>', methods=['GET'])
+def get_product_batch(batch_id):
+    status = product_batch_status(product_job_store, batch_id)
+    if status is None:
+        return jsonify({"error": "Batch not found or has expired."}), 404
+    return jsonify(status)
+
+
+def _find_inflight(request_id):
+    for shortcode, job in inflight_jobs.items():
+        if job["request_id"] == request_id:
+            return shortcode, job
+    return None, None
+
+
+def _on_job_event(request_id, event, payload):
+    """Remembers the latest state of an in-flight job and retires it once its result is out."""
+    shortcode, job = _find_inflight(request_id)
+    if job is None:
+        return
+    if event == 'progress':
+        job["last_progress"] = payload
+    elif event == 'caption_update':
+        job["caption"] = payload
+    elif event == 'transcript_update':
+        job["transcript"] = payload
+    elif event == 'partial_result':
+        job["partial_result"] = payload
+    elif event in ('result', 'error'):
+        inflight_jobs.pop(shortcode, None)
+    for product_job in job["product_jobs"]:
+        if event == 'result':
+            product_job.finish(payload)
+        elif event == 'error':
+            product_job.fail(payload.get('error') or "Processing failed")
+        else:
+            product_job.on_event(event, payload)
 
-        video_path = post_info.get('video_path')
-
-        # If client disconnected in between, stop early and cleanup
-        if sid in canceled_sids:
-            _cleanup_request_dir(request_dir)
-            return
-
-        if video_path:
-            print(f"Processing video: {video_path}")
-            socketio.emit('progress', {'data': 'Separating frames from video...', 'progress': 40}, room=sid)
-            socketio.sleep(0.1)
-            frames_output_dir = os.path.join(request_dir, "frames")
-            video_to_frames(video_path, frames_output_dir, shortcode)
-            print("Frame separation completed")
-            # Notify frontend that frame separation has completed
-            socketio.emit('progress', {'data': 'Frames separated successfully', 'progress': 50}, room=sid)
-            socketio.sleep(0.1)
-
-            if sid in canceled_sids:
-                _cleanup_request_dir(request_dir)
-                return
 
-            socketio.emit('progress', {'data': 'Classifying frames and selecting the best ones...', 'progress': 60}, room=sid)
-            socketio.sleep(0.1)
-            classify_and_move_images(shortcode, request_dir, frames_output_dir)
-            print("Frame classification completed")
-            # Notify frontend that classification has completed
-            socketio.emit('progress', {'data': 'Frame classification completed', 'progress': 70}, room=sid)
-            socketio.sleep(0.1)
-            # Optionally emit the original caption after classification so UI can show/update it
-            try:
-                caption_path = os.path.join(request_dir, 'caption.txt')
-                if os.path.exists(caption_path):
-                    with open(caption_path, 'r', encoding='utf-8') as cf:
-                        original_caption = cf.read()
-                    socketio.emit('caption_update', {'caption': original_caption}, room=sid)
-                    socketio.sleep(0.01)
-            except Exception:
-                pass
-
-            if sid in canceled_sids:
-                _cleanup_request_dir(request_dir)
+def _job_emitter(request_id):
+    """Returns an emit(event, payload) callback that delivers pipeline events to every subscriber."""
+    def emit(event, payload):
+        _on_job_event(request_id, event, payload)
+        socketio.emit(event, payload, room=request_id)
+        socketio.sleep(0.05)
+    return emit
+
+
+def process_instagram_post_sync(shortcode, request_id, request_dir):
+    PostJob(
+        shortcode,
+        request_id,
+        request_dir,
+        _job_emitter(request_id),
+        is_canceled=lambda: request_id in canceled_requests,
+    ).run()
+    # A canceled run never emits its result; make sure it stops being joinable
+    _, job = _find_inflight(request_id)
+    if job is not None:
+        inflight_jobs.pop(job["shortcode"], None)
+        for product_job in job["product_jobs"]:
+            product_job.fail("Processing was canceled")
+
+
+def _run_queued_job(shortcode, request_id, request_dir):
+    """Waits for one of the MAX_CONCURRENT_JOBS slots, then runs the pipeline."""
+    def on_queued(position):
+        socketio.emit('progress', {'data': f'Waiting for a free worker (position {position} in queue)...', 'progress': 10}, room=request_id)
+        socketio.sleep(0.01)
+
+    try:
+        with job_slots.slot(on_queued=on_queued):
+            if request_id in canceled_requests:
+                cleanup_request_dir(request_dir)
                 return
+            process_instagram_post_sync(shortcode, request_id, request_dir)
+    finally:
+        canceled_requests.discard(request_id)
 
-            print("Starting audio transcription")
-            socketio.emit('progress', {'data': 'Extracting and transcribing audio...', 'progress': 80}, room=sid)
-            socketio.sleep(0.1)
-            transcribe_video(video_path, request_dir)
-            print("Audio transcription completed")
-        
-        if sid in canceled_sids:
-            _cleanup_request_dir(request_dir)
-            return
-
-        print("Starting Gemini parsing")
-        socketio.emit('progress', {'data': 'Generating final listing with AI...', 'progress': 95}, room=sid)
-        socketio.sleep(0.1)
+
+def _relay_job_events():
+    """Forwards events published by queue workers to the Socket.IO rooms they target."""
+    while True:
         try:
-            parsed_content = parse_content(shortcode, request_dir)
-            print("Gemini parsing completed successfully")
+            for event in job_backend.listen():
+                if event["event"] == "product_post":
+                    # A worker found a product job's post; run it through inflight_jobs here
+                    data = event["data"]
+                    product_job = ProductJob(event["job_id"], data["product_name"], product_job_store)
+                    _process_product_post(product_job, data["shortcode"])
+                    continue
+                _on_job_event(event.get("job_id"), event["event"], event["data"])
+                room = event.get("room")
+                if room:
+                    socketio.emit(event["event"], event["data"], room=room)
         except Exception as e:
-            print(f"Error in parse_content: {e}")
-            # Create fallback content
-            caption_text = ""
-            try:
-                with open(os.path.join(request_dir, 'caption.txt'), 'r', encoding='utf-8') as cf:
-                    caption_text = cf.read()
-            except Exception:
-                pass
-            transcript_text = ""
-            try:
-                with open(os.path.join(request_dir, 'transcript.txt'), 'r', encoding='utf-8') as tf:
-                    transcript_text = tf.read()
-            except Exception:
-                pass
-            parsed_content = _placeholder_result(caption_text, transcript_text)
-            print("Using fallback content due to Gemini error")
-        # Ensure caption.txt exists even if Instaloader changes behavior
-        caption_path = os.path.join(request_dir, 'caption.txt')
-        if not os.path.exists(caption_path):
-            try:
-                with open(caption_path, 'w', encoding='utf-8') as cf:
-                    cf.write("")
-            except Exception:
-                pass
-        
-        with open(os.path.join(request_dir, 'result.json'), 'w') as f:
-            json.dump(parsed_content, f)
-
-        # Update index for cache reuse
-        idx = _read_index()
-        idx[shortcode] = {"request_id": request_id, "ts": time.time()}
-        _write_index(idx)
-
-        final_images_dir = os.path.join(request_dir, "relevant_final")
-        final_images = []
-        if os.path.exists(final_images_dir):
-            final_images = [f"/image/{request_id}/{f}" for f in sorted(os.listdir(final_images_dir))[:30]]
-
-        expiration_time = datetime.utcnow() + timedelta(seconds=DATA_TTL_SECONDS)
-        
-        print(f"Emitting final result to sid: {sid}")
-        socketio.emit('result', {
-            'structured_content': parsed_content,
-            'images': final_images,
-            'request_id': request_id,
-            'expiration_timestamp': expiration_time.isoformat() + 'Z',
-            'expires_in_seconds': DATA_TTL_SECONDS
-        }, room=sid)
-        
-        socketio.sleep(0.1)
-        print(f"Processing completed successfully for sid: {sid}")
+            print(f"Job event relay interrupted: {e}")
+            socketio.sleep(1)
+
+
+def _ensure_job_relay():
+    global _relay_started
+    if _relay_started:
+        return
+    _relay_started = True
+    socketio.start_background_task(_relay_job_events)
+    if isinstance(job_backend, MemoryJobBackend):
+        # The in-process stand-in has no external workers; run them here
+        start_local_workers(job_backend, MAX_CONCURRENT_JOBS)
+
+
+def _subscribe(sid, request_id, request_dir):
+    """Attaches a client to a request's room, detaching it from any earlier request."""
+    previous = sid_to_request.get(sid)
+    if previous and previous["request_id"] != request_id:
+        _unsubscribe(sid)
+    join_room(request_id, sid=sid)
+    request_subscribers.setdefault(request_id, set()).add(sid)
+    sid_to_request[sid] = {"request_id": request_id, "request_dir": request_dir}
+
+
+def _unsubscribe(sid):
+    """
+    Detaches a client from its request. The job is canceled and its files are
+    removed only when no other client is following the same request.
+    """
+    info = sid_to_request.pop(sid, None)
+    if not info:
+        return
+    request_id = info["request_id"]
+    subscribers = request_subscribers.get(request_id, set())
+    subscribers.discard(sid)
+    try:
+        leave_room(request_id, sid=sid)
+    except Exception:
+        pass
+    if subscribers:
+        return
+    request_subscribers.pop(request_id, None)
+    _, job = _find_inflight(request_id)
+    if job is None:
+        # Finished and failed runs are registered for expiry; they stay until
+        # then to serve the cached result or resume a retry
+        return
+    if job["product_jobs"]:
+        # A product job still waits for the run
+        return
+    inflight_jobs.pop(job["shortcode"], None)
+    canceled_requests.add(request_id)
+    if job_backend is not None:
+        job_backend.cancel(request_id)
+    cleanup_request_dir(info.get("request_dir"))
 
-    except Exception as e:
-        # Send placeholder result instead of raw error
-        try:
-            caption_text = ""
-            try:
-                with open(os.path.join(request_dir, 'caption.txt'), 'r', encoding='utf-8') as cf:
-                    caption_text = cf.read()
-            except Exception:
-                pass
-            transcript_text = ""
-            try:
-                with open(os.path.join(request_dir, 'transcript.txt'), 'r', encoding='utf-8') as tf:
-                    transcript_text = tf.read()
-            except Exception:
-                pass
-            expiration_time = datetime.utcnow() + timedelta(seconds=DATA_TTL_SECONDS)
-            socketio.emit('result', {
-                'structured_content': _placeholder_result(caption_text, transcript_text),
-                'images': [],
-                'request_id': request_id,
-                'expiration_timestamp': expiration_time.isoformat() + 'Z',
-                'expires_in_seconds': DATA_TTL_SECONDS
-            }, room=sid)
-        except Exception:
-            socketio.emit('error', {'error': str(e)}, room=sid)
-        finally:
-            _cleanup_request_dir(request_dir)
 
 @socketio.on('start_processing')
 def handle_start_processing(json_data):
@@ -440,32 +453,76 @@ def handle_start_processing(json_data):
     if _emit_cached_result(sid, shortcode):
         return
 
-    request_id = str(uuid.uuid4())
-    request_dir = os.path.join(TEMP_PROCESSING_DIR, request_id)
-    os.makedirs(request_dir, exist_ok=True)
-
-    # Immediately notify frontend that processing has begun
-    try:
-        socketio.emit('progress', {'data': 'Processing started...', 'progress': 10}, room=sid)
+    # Join a run of the same post that is already in progress instead of starting another
+    job = inflight_jobs.get(shortcode)
+    if job is not None:
+        _subscribe(sid, job["request_id"], job["request_dir"])
+        socketio.emit('progress', job["last_progress"] or {'data': 'Processing started...', 'progress': 10}, room=sid)
+        if job["caption"]:
+            socketio.emit('caption_update', job["caption"], room=sid)
+        if job["transcript"]:
+            socketio.emit('transcript_update', job["transcript"], room=sid)
+        if job["partial_result"]:
+            socketio.emit('partial_result', job["partial_result"], room=sid)
         socketio.sleep(0.05)
-    except Exception:
-        pass
+        return
 
-    # Register sid to request mapping; clear any previous canceled flag
-    canceled_sids.discard(sid)
-    sid_to_request[sid] = {"request_id": request_id, "request_dir": request_dir}
+    _start_post_job(shortcode, sid)
+
+
+def _start_post_job(shortcode, sid=None):
+    """
+    Starts a pipeline run for a post and registers it in inflight_jobs, so
+    later requests for the same post join it. sid, if given, follows the run.
+    Returns the in-flight entry.
+    """
+    request_id, request_dir = open_request_dir(shortcode)
+
+    if sid is not None:
+        _subscribe(sid, request_id, request_dir)
+    job = inflight_jobs[shortcode] = {
+        "shortcode": shortcode,
+        "request_id": request_id,
+        "request_dir": request_dir,
+        "last_progress": None,
+        "caption": None,
+        "transcript": None,
+        "partial_result": None,
+        # ProductJobs waiting for this run's result
+        "product_jobs": [],
+    }
+
+    if sid is not None:
+        # Immediately notify frontend that processing has begun
+        try:
+            socketio.emit('progress', {'data': 'Processing started...', 'progress': 10}, room=sid)
+            socketio.sleep(0.05)
+        except Exception:
+            pass
+
+    if job_backend is not None:
+        # Hand the job to the worker pool; its progress comes back through the relay
+        _ensure_job_relay()
+        job_backend.enqueue({
+            "job_id": request_id,
+            "shortcode": shortcode,
+            "request_dir": request_dir,
+            "room": request_id,
+        })
+        return job
 
     # Offload the long-running task to a background thread
-    socketio.start_background_task(process_instagram_post_sync, sid, shortcode, request_id, request_dir)
+    socketio.start_background_task(_run_queued_job, shortcode, request_id, request_dir)
+    return job
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    sid = request.sid
-    canceled_sids.add(sid)
-    info = sid_to_request.pop(sid, None)
-    if info:
-        _cleanup_request_dir(info.get("request_dir"))
+    _unsubscribe(request.sid)
+
+
+# Expired request directories are deleted in the background instead of on demand
+socketio.start_background_task(_reap_expired_requests)
 
 if __name__ == '__main__':
     socketio.run(app, host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
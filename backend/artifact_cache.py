@@ -0,0 +1,154 @@
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+
+from storage import SQLiteFile
+
+# Stage outputs shared across requests. Kept outside temp_processing/ so the
+# request reaper never touches it.
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", "artifact_cache")
+# How long a stage output may be reused after it was produced
+ARTIFACT_CACHE_TTL_SECONDS = int(os.getenv("ARTIFACT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Total size of stored outputs; least recently used entries are evicted beyond it
+ARTIFACT_CACHE_MAX_BYTES = int(os.getenv("ARTIFACT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+# Set to "0" to disable the cache entirely
+ARTIFACT_CACHE_ENABLED = os.getenv("ARTIFACT_CACHE_ENABLED", "1") == "1"
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def text_sha256(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def link_or_copy(src, dest):
+    """Hardlinks src to dest, copying when the filesystem cannot link (or dest exists)."""
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+
+class ArtifactCache:
+    """
+    Content-addressed store for pipeline stage outputs. Each entry is a
+    directory of files under a key derived from the input content hash and
+    the version of whatever produced it (model, prompt, sampling settings),
+    so a repost of the same video or a rerun after the result TTL reuses any
+    stage that already ran. Entries expire after ttl_seconds and are evicted
+    least-recently-used once the store exceeds max_bytes.
+    """
+
+    def __init__(self, root=ARTIFACT_CACHE_DIR, ttl_seconds=ARTIFACT_CACHE_TTL_SECONDS,
+                 max_bytes=ARTIFACT_CACHE_MAX_BYTES):
+        self.root = root
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.db = SQLiteFile(os.path.join(root, "index.sqlite3"), [
+            "CREATE TABLE IF NOT EXISTS artifacts ("
+            " key TEXT PRIMARY KEY,"
+            " stage TEXT NOT NULL,"
+            " size_bytes INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS artifacts_last_used ON artifacts (last_used)",
+            "CREATE INDEX IF NOT EXISTS artifacts_created_at ON artifacts (created_at)",
+        ])
+
+    @staticmethod
+    def key(stage, *parts):
+        """Builds the cache key for a stage from its input hashes and version strings."""
+        return f"{stage}-" + hashlib.sha256("\0".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def restore(self, key, dest_dir):
+        """
+        Copies the files stored under key into dest_dir (relative paths kept).
+        Returns the restored relative paths, or None on a miss.
+        """
+        with self.db.connect() as conn:
+            row = conn.execute("SELECT created_at FROM artifacts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[0] + self.ttl_seconds <= time.time():
+                conn.execute("DELETE FROM artifacts WHERE key = ?", (key,))
+                row = None
+            else:
+                conn.execute("UPDATE artifacts SET last_used = ? WHERE key = ?", (time.time(), key))
+        entry_dir = self._entry_dir(key)
+        if row is None or not os.path.isdir(entry_dir):
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+
+        restored = []
+        for root, _, files in os.walk(entry_dir):
+            for fname in files:
+                src = os.path.join(root, fname)
+                rel = os.path.relpath(src, entry_dir)
+                dest = os.path.join(dest_dir, rel)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                # Not hardlinked: stages rewrite their outputs in place (open(..., "w"),
+                # ffmpeg -y), which would change the entry for every other request
+                shutil.copy2(src, dest)
+                restored.append(rel)
+        return sorted(restored)
+
+    def store(self, key, stage, base_dir, rel_paths):
+        """Stores copies of the given files (relative to base_dir) under key, replacing any previous entry."""
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=self.root)
+        size_bytes = 0
+        try:
+            for rel in rel_paths:
+                src = os.path.join(base_dir, rel)
+                if not os.path.isfile(src):
+                    continue
+                dest = os.path.join(staging, rel)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                shutil.copy2(src, dest)
+                size_bytes += os.path.getsize(dest)
+            entry_dir = self._entry_dir(key)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            # The rename makes the entry appear all at once
+            os.replace(staging, entry_dir)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        now = time.time()
+        with self.db.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO artifacts (key, stage, size_bytes, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, stage, size_bytes, now, now),
+            )
+        self.evict()
+
+    def evict(self):
+        """Drops expired entries, then least recently used ones until the store fits max_bytes."""
+        doomed = []
+        with self.db.connect() as conn:
+            cutoff = time.time() - self.ttl_seconds
+            doomed += [row[0] for row in conn.execute("SELECT key FROM artifacts WHERE created_at <= ?", (cutoff,))]
+            conn.execute("DELETE FROM artifacts WHERE created_at <= ?", (cutoff,))
+            if self.max_bytes:
+                total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM artifacts").fetchone()[0]
+                if total > self.max_bytes:
+                    for key, size_bytes in conn.execute("SELECT key, size_bytes FROM artifacts ORDER BY last_used").fetchall():
+                        if total <= self.max_bytes:
+                            break
+                        conn.execute("DELETE FROM artifacts WHERE key = ?", (key,))
+                        doomed.append(key)
+                        total -= size_bytes
+        for key in doomed:
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+        return len(doomed)
+
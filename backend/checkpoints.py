@@ -0,0 +1,84 @@
+import os
+import json
+import time
+
+# Completion markers, one JSON manifest per stage, inside each request directory
+CHECKPOINT_DIR = ".checkpoints"
+# Stages whose inputs each stage produces; finishing a stage again invalidates them
+STAGE_DEPENDENTS = {
+    "download": ("frames", "transcript", "listing"),
+    "frames": ("listing",),
+    "transcript": ("listing",),
+    "listing": (),
+}
+
+
+def _marker_path(request_dir, stage):
+    return os.path.join(request_dir, CHECKPOINT_DIR, f"{stage}.json")
+
+
+def _load(request_dir, stage):
+    try:
+        with open(_marker_path(request_dir, stage), 'r') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def completed(request_dir, stage):
+    """Returns the stage's manifest if it finished and every output is still intact, else None."""
+    manifest = _load(request_dir, stage)
+    if manifest is None:
+        return None
+    for rel, size in manifest.get("outputs", {}).items():
+        path = os.path.join(request_dir, rel)
+        if not os.path.isfile(path) or os.path.getsize(path) != size:
+            return None
+    return manifest
+
+
+def invalidate(request_dir, stage):
+    """
+    Drops a stage's marker together with the outputs it recorded, so a rerun
+    starts from a clean slate.
+    """
+    manifest = _load(request_dir, stage)
+    if manifest is None:
+        return
+    for rel in manifest.get("outputs", {}):
+        try:
+            os.remove(os.path.join(request_dir, rel))
+        except OSError:
+            pass
+    try:
+        os.remove(_marker_path(request_dir, stage))
+    except OSError:
+        pass
+
+
+def mark_complete(request_dir, stage, outputs, **details):
+    """
+    Records that a stage finished, with a manifest of the files it produced
+    (paths relative to request_dir; missing ones are skipped). Extra keyword
+    arguments are stored in the manifest. Downstream stages are invalidated.
+    """
+    for dependent in STAGE_DEPENDENTS.get(stage, ()):
+        invalidate(request_dir, dependent)
+    manifest = {
+        "stage": stage,
+        "completed_at": time.time(),
+        "outputs": {
+            rel: os.path.getsize(os.path.join(request_dir, rel))
+            for rel in outputs
+            if os.path.isfile(os.path.join(request_dir, rel))
+        },
+    }
+    manifest.update(details)
+    marker_path = _marker_path(request_dir, stage)
+    os.makedirs(os.path.dirname(marker_path), exist_ok=True)
+    tmp_path = marker_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    # The marker only appears once the manifest is fully written
+    os.replace(tmp_path, marker_path)
+    return manifest
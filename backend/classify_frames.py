@@ -1,15 +1,75 @@
 import os
+import json
 import shutil
+import functools
 import onnxruntime
 from PIL import Image, ImageOps
 import numpy as np
 import re
+import sys
+from separate_frames import (
+    stream_frames,
+    extract_frames_at,
+    grid_frame_number,
+    grid_timestamp,
+    FRAME_EXTRACTION_MODE,
+    FRAME_SAMPLING,
+    SCENE_ANALYSIS_FPS,
+    SCENE_CHANGE_THRESHOLD,
+    ADAPTIVE_MAX_GAP_SECONDS,
+    ADAPTIVE_MAX_FRAMES,
+    TARGET_SAVED_FRAMES,
+    STREAM_FRAME_SIZE,
+)
+from workers import native
+from artifact_cache import file_sha256, link_or_copy
+from frame_selection import (
+    select_frames,
+    difference_hash,
+    file_difference_hash,
+    MAX_SELECTED_FRAMES,
+    FRAME_MIN_SPACING_SECONDS,
+    FRAME_DEDUP_ENABLED,
+    FRAME_DEDUP_MAX_DISTANCE,
+)
 
 
 # Initialize the session to None. It will be loaded on the first request.
 ort_session = None
 class_names = open("labels.txt", "r").readlines()
 
+# Number of frames scored per ONNX Runtime call. The model is exported with a
+# dynamic batch dimension (see convert_model.py), so frames can share one call.
+CLASSIFIER_BATCH_SIZE = int(os.getenv("CLASSIFIER_BATCH_SIZE", "32"))
+# Threads that decode and resize frames while the previous batch is being scored.
+# PIL and NumPy release the GIL for the heavy parts, so these run on separate cores.
+CLASSIFIER_PREPROCESS_WORKERS = int(os.getenv("CLASSIFIER_PREPROCESS_WORKERS", str(min(8, os.cpu_count() or 1))))
+# Resampling filter used for the 224x224 fit. "lanczos" matches the training
+# pipeline; "bilinear" is considerably cheaper. Check the score drift of a
+# cheaper setting with `python classify_frames.py <frames_dir> <resample>`.
+CLASSIFIER_RESAMPLE = os.getenv("CLASSIFIER_RESAMPLE", "lanczos").lower()
+# Let the JPEG decoder downscale while decoding (no effect on PNG frames).
+CLASSIFIER_FAST_DECODE = os.getenv("CLASSIFIER_FAST_DECODE", "0") == "1"
+
+# Per-frame scores of the last classification run, written next to relevant_final/
+SCORES_FILENAME = "scores.json"
+# Score above which a frame counts as relevant
+RELEVANCE_THRESHOLD = 0.5
+# Set to "1" to also sort every classified frame into relevant/ and
+# non-relevant/ for debugging; scores.json records the same split
+CLASSIFIER_DEBUG_OUTPUTS = os.getenv("CLASSIFIER_DEBUG_OUTPUTS", "0") == "1"
+
+_RESAMPLE_FILTERS = {
+    "lanczos": Image.Resampling.LANCZOS,
+    "bicubic": Image.Resampling.BICUBIC,
+    "bilinear": Image.Resampling.BILINEAR,
+    "nearest": Image.Resampling.NEAREST,
+}
+if CLASSIFIER_RESAMPLE not in _RESAMPLE_FILTERS:
+    raise ValueError(
+        f"Unknown CLASSIFIER_RESAMPLE: {CLASSIFIER_RESAMPLE} (expected one of: {', '.join(_RESAMPLE_FILTERS)})"
+    )
+
 def get_ort_session():
     """
     Lazily initializes and returns the ONNX runtime session.
@@ -24,7 +84,30 @@ def get_ort_session():
         print("ONNX session initialized successfully.")
     return ort_session
 
-# --- MODIFICATION END ---
+
+@functools.lru_cache(maxsize=None)
+def classifier_version():
+    """
+    Identifies the model and the sampling/preprocessing settings behind a frame
+    selection; part of its artifact cache key.
+    """
+    base_dir = os.path.dirname(__file__)
+    parts = [
+        file_sha256(os.path.join(base_dir, "model.onnx"))[:16],
+        file_sha256(os.path.join(base_dir, "labels.txt"))[:16],
+        FRAME_EXTRACTION_MODE,
+        str(TARGET_SAVED_FRAMES),
+        FRAME_SAMPLING,
+        f"{SCENE_ANALYSIS_FPS}/{SCENE_CHANGE_THRESHOLD}/{ADAPTIVE_MAX_GAP_SECONDS}/{ADAPTIVE_MAX_FRAMES}"
+        if FRAME_SAMPLING == "adaptive" else "",
+        str(STREAM_FRAME_SIZE),
+        CLASSIFIER_RESAMPLE,
+        "fast" if CLASSIFIER_FAST_DECODE else "full",
+        f"{MAX_SELECTED_FRAMES}@{FRAME_MIN_SPACING_SECONDS}s",
+        f"dedup{FRAME_DEDUP_MAX_DISTANCE}" if FRAME_DEDUP_ENABLED else "nodedup",
+    ]
+    return ":".join(parts)
+
 
 def get_frame_number(filename):
     match = re.search(r'frame_(\d+)', filename)
@@ -32,18 +115,172 @@ def get_frame_number(filename):
         return int(match.group(1))
     return 0
 
-def classify_and_move_images(shortcode, request_dir, frames_dir):
-    # --- MODIFICATION: Call the function to get the session ---
+
+def _effective_batch_size(session, batch_size):
+    """Clamps the batch size to the model's batch dimension when it is fixed rather than dynamic."""
+    batch_dim = session.get_inputs()[0].shape[0]
+    if isinstance(batch_dim, int) and batch_dim > 0:
+        return batch_dim
+    return max(1, int(batch_size))
+
+
+def preprocess_image(image_path, resample=None, fast_decode=None):
+    """Loads an image and returns the normalized (224, 224, 3) float32 array the model expects."""
+    resample = _RESAMPLE_FILTERS[resample or CLASSIFIER_RESAMPLE]
+    if fast_decode is None:
+        fast_decode = CLASSIFIER_FAST_DECODE
+    with Image.open(image_path) as image:
+        if fast_decode:
+            # JPEG only: decode at the smallest 1/2, 1/4 or 1/8 scale that still covers 224x224
+            image.draft("RGB", (224, 224))
+        image = image.convert("RGB")
+        image = ImageOps.fit(image, (224, 224), resample)
+        return (np.asarray(image).astype(np.float32) / 127.5) - 1
+
+
+def _preprocessed_frames(image_paths, workers, queue_size, resample=None, fast_decode=None):
+    """
+    Preprocesses images on a pool of native threads and yields (index, array)
+    pairs in completion order; array is None for unreadable images. The output
+    queue is bounded so decoding stays at most a couple of batches ahead of inference.
+    """
+    threading = native("threading")
+    queue = native("queue")
+
+    results = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    next_index = iter(range(len(image_paths)))
+    index_lock = threading.Lock()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker():
+        while not stop.is_set():
+            with index_lock:
+                index = next(next_index, None)
+            if index is None:
+                break
+            try:
+                array = preprocess_image(image_paths[index], resample, fast_decode)
+            except Exception:
+                array = None
+            if not put((index, array)):
+                return
+        put(done)
+
+    workers = max(1, min(workers, len(image_paths)))
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        finished = 0
+        while finished < workers:
+            item = results.get()
+            if item is done:
+                finished += 1
+                continue
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def score_batch(session, batch):
+    """Runs one inference call on an (N, 224, 224, 3) batch and returns the N relevance scores."""
+    input_name = session.get_inputs()[0].name
+    prediction = session.run(None, {input_name: batch})[0]
+    return [float(score) for score in prediction[:, 0]]
+
+
+def score_images(image_paths, batch_size=None, workers=None, resample=None, fast_decode=None):
+    """
+    Scores images with the ONNX classifier, batching them into as few
+    session.run calls as possible while a thread pool preprocesses the next
+    frames. Returns one score per path, in order, with None for images that
+    could not be read.
+    """
     session = get_ort_session()
-    
+    batch_size = _effective_batch_size(session, batch_size or CLASSIFIER_BATCH_SIZE)
+    workers = workers or CLASSIFIER_PREPROCESS_WORKERS
+
+    frames = _preprocessed_frames(image_paths, workers, batch_size * 2, resample, fast_decode)
+    scored = _score_items(session, frames, batch_size)
+    return [scored.get(index) for index in range(len(image_paths))]
+
+
+def _score_items(session, items, batch_size):
+    """
+    Scores (key, normalized array) pairs in batches of batch_size and returns
+    a {key: score} dict. Items whose array is None are skipped.
+    """
+    scores = {}
+    batch = np.empty((batch_size, 224, 224, 3), dtype=np.float32)
+    batch_keys = []
+
+    def flush():
+        if not batch_keys:
+            return
+        batch_scores = score_batch(session, batch[:len(batch_keys)])
+        scores.update(zip(batch_keys, batch_scores))
+        batch_keys.clear()
+
+    for key, array in items:
+        if array is None:
+            continue
+        batch[len(batch_keys)] = array
+        batch_keys.append(key)
+        if len(batch_keys) == batch_size:
+            flush()
+    flush()
+
+    return scores
+
+
+def _write_scores(request_dir, all_frames_with_scores, selected_frames):
+    """Records every frame's score, and whether it was selected, in scores.json."""
+    selected = {frame_info['filename'] for frame_info in selected_frames}
+    frames = sorted(all_frames_with_scores, key=lambda x: x['frame_number'])
+    with open(os.path.join(request_dir, SCORES_FILENAME), 'w') as f:
+        json.dump({
+            "classifier_version": classifier_version(),
+            "relevance_threshold": RELEVANCE_THRESHOLD,
+            "frames": [
+                dict(
+                    frame_info,
+                    relevant=frame_info['score'] > RELEVANCE_THRESHOLD,
+                    selected=frame_info['filename'] in selected,
+                )
+                for frame_info in frames
+            ],
+        }, f)
+
+
+def classify_and_move_images(shortcode, request_dir, frames_dir, video_path=None):
+    """
+    Scores the frames video_to_frames wrote and moves the best ones to
+    relevant_final/; the other frames are deleted unless CLASSIFIER_DEBUG_OUTPUTS
+    is set. video_path gives frame numbers their timestamps; without
+    it frames are taken to be one second apart.
+    """
     input_frames_dir = os.path.join(frames_dir, f"output_frames_{shortcode}")
     
     relevant_dir = os.path.join(request_dir, "relevant")
     non_relevant_dir = os.path.join(request_dir, "non-relevant")
     final_relevant_dir = os.path.join(request_dir, "relevant_final")
 
-    os.makedirs(relevant_dir, exist_ok=True)
-    os.makedirs(non_relevant_dir, exist_ok=True)
+    if CLASSIFIER_DEBUG_OUTPUTS:
+        os.makedirs(relevant_dir, exist_ok=True)
+        os.makedirs(non_relevant_dir, exist_ok=True)
     os.makedirs(final_relevant_dir, exist_ok=True)
     
     if not os.path.isdir(input_frames_dir):
@@ -55,85 +292,137 @@ def classify_and_move_images(shortcode, request_dir, frames_dir):
     if not images:
         return
 
-    # --- MODIFICATION: Use the lazily-loaded session ---
-    input_name = session.get_inputs()[0].name
-    
-    all_frames_with_scores = []
+    image_paths = [os.path.join(input_frames_dir, filename) for filename in images]
+    scores = score_images(image_paths)
 
-    for filename in images:
-        image_path = os.path.join(input_frames_dir, filename)
-        
-        data = np.ndarray(shape=(1, 224, 224, 3), dtype=np.float32)
-        try:
-            with Image.open(image_path) as image:
-                image = image.convert("RGB")
-                image = ImageOps.fit(image, (224, 224), Image.Resampling.LANCZOS)
-                image_array = np.asarray(image)
-                normalized_image_array = (image_array.astype(np.float32) / 127.5) - 1
-                data[0] = normalized_image_array
-        except Exception:
+    all_frames_with_scores = []
+    for filename, relevant_score in zip(images, scores):
+        if relevant_score is None:
             continue
-        
-        ort_inputs = {input_name: data}
-        # --- MODIFICATION: Use the lazily-loaded session ---
-        ort_outs = session.run(None, ort_inputs)
-        prediction = ort_outs[0]
-
-        relevant_score = prediction[0][0]
-        
+        frame_number = get_frame_number(filename)
         all_frames_with_scores.append({
             "filename": filename,
             "score": relevant_score,
-            "frame_number": get_frame_number(filename)
+            "frame_number": frame_number,
+            "timestamp": grid_timestamp(video_path, frame_number) if video_path else float(frame_number - 1),
         })
 
-    all_frames_with_scores.sort(key=lambda x: x['score'], reverse=True)
-    
-    # ... the rest of the function remains the same ...
-    selected_frames = []
-    selected_frame_numbers = []
-    FRAME_DIFFERENCE_THRESHOLD = 60
-
-    for frame_info in all_frames_with_scores:
-        if len(selected_frames) >= 30:
-            break
+    def hash_fn(frame_info):
+        frame_info["dhash"] = file_difference_hash(os.path.join(input_frames_dir, frame_info['filename']))
+        return frame_info["dhash"]
 
-        is_far_enough = True
-        for selected_num in selected_frame_numbers:
-            if abs(frame_info["frame_number"] - selected_num) < FRAME_DIFFERENCE_THRESHOLD:
-                is_far_enough = False
-                break
-        
-        if is_far_enough:
-            selected_frames.append(frame_info)
-            selected_frame_numbers.append(frame_info["frame_number"])
-
-    if len(selected_frames) < 30:
-        for frame_info in all_frames_with_scores:
-            if len(selected_frames) >= 30:
-                break
-            if frame_info in selected_frames:
-                continue
-            is_far_enough = True
-            for selected_num in selected_frame_numbers:
-                if abs(frame_info["frame_number"] - selected_num) < FRAME_DIFFERENCE_THRESHOLD:
-                    is_far_enough = False
-                    break
-            if is_far_enough:
-                selected_frames.append(frame_info)
-                selected_frame_numbers.append(frame_info["frame_number"])
+    selected_frames = select_frames(all_frames_with_scores, hash_fn=hash_fn)
+    _write_scores(request_dir, all_frames_with_scores, selected_frames)
 
+    # The sampled frames are scratch files: the winners are moved rather than
+    # copied, or hardlinked when the debug folders need them as well
+    place = link_or_copy if CLASSIFIER_DEBUG_OUTPUTS else os.replace
     for frame_info in selected_frames:
         src_path = os.path.join(input_frames_dir, frame_info['filename'])
         dest_path = os.path.join(final_relevant_dir, frame_info['filename'])
         if os.path.exists(src_path):
-            shutil.copy(src_path, dest_path)
-            
+            place(src_path, dest_path)
+
+    if not CLASSIFIER_DEBUG_OUTPUTS:
+        # The rest of the sampled frames are no longer needed
+        shutil.rmtree(input_frames_dir, ignore_errors=True)
+        try:
+            os.rmdir(frames_dir)
+        except OSError:
+            pass
+        return
     for frame_info in all_frames_with_scores:
         src_path = os.path.join(input_frames_dir, frame_info['filename'])
-        if frame_info['score'] > 0.5:
+        if frame_info['score'] > RELEVANCE_THRESHOLD:
              dest_path = os.path.join(relevant_dir, frame_info['filename'])
         else:
              dest_path = os.path.join(non_relevant_dir, frame_info['filename'])
         if os.path.exists(src_path):
-            shutil.copy(src_path, dest_path)
\ No newline at end of file
+            link_or_copy(src_path, dest_path)
+
+
+def classify_video_stream(shortcode, request_dir, video_path, fps=None, frames=None, ready=None):
+    """
+    Streaming counterpart of video_to_frames + classify_and_move_images: frames
+    are scored straight from an ffmpeg pipe, and only the selected ones are
+    written to relevant_final/ at full resolution through a targeted seek.
+    `frames` may be supplied by a shared MediaIngest; by default the video is
+    sampled with stream_frames(). Frames are numbered by grid_frame_number(),
+    unless an explicit uniform fps is given.
+    When the frames come from a video that is still downloading, ready() is
+    called once they are scored; it waits for video_path to be complete and
+    returns False if the frames cannot be trusted, in which case nothing is written.
+    Returns True when relevant_final/ was written.
+    """
+    final_relevant_dir = os.path.join(request_dir, "relevant_final")
+    os.makedirs(final_relevant_dir, exist_ok=True)
+
+    session = get_ort_session()
+    batch_size = _effective_batch_size(session, CLASSIFIER_BATCH_SIZE)
+
+    timestamps = {}
+    hashes = {}
+
+    def normalized_frames():
+        source = frames if frames is not None else stream_frames(video_path, fps)
+        for index, timestamp, frame in source:
+            timestamps[index] = timestamp
+            if FRAME_DEDUP_ENABLED:
+                hashes[index] = difference_hash(frame)
+            yield index, (frame.astype(np.float32) / 127.5) - 1
+
+    scores = _score_items(session, normalized_frames(), batch_size)
+    if ready is not None and not ready():
+        return False
+
+    def frame_number(index):
+        return index + 1 if fps else grid_frame_number(video_path, timestamps[index])
+
+    all_frames_with_scores = [
+        {
+            "filename": f"frame_{frame_number(index):04d}.png",
+            "score": score,
+            "frame_number": frame_number(index),
+            "timestamp": timestamps[index],
+            "dhash": hashes.get(index),
+        }
+        for index, score in sorted(scores.items())
+    ]
+
+    selected_frames = select_frames(all_frames_with_scores)
+    selected_frames.sort(key=lambda x: x['frame_number'])
+    _write_scores(request_dir, all_frames_with_scores, selected_frames)
+    extract_frames_at(
+        video_path,
+        [frame_info['timestamp'] for frame_info in selected_frames],
+        [os.path.join(final_relevant_dir, frame_info['filename']) for frame_info in selected_frames],
+    )
+    return True
+
+
+def preprocessing_score_drift(image_paths, resample, fast_decode=False):
+    """
+    Returns the largest absolute score difference between the reference
+    preprocessing (LANCZOS, full decode) and the given cheaper settings.
+    """
+    if resample not in _RESAMPLE_FILTERS:
+        raise ValueError(f"Unknown resample filter: {resample} (expected one of: {', '.join(_RESAMPLE_FILTERS)})")
+    reference = score_images(image_paths, resample="lanczos", fast_decode=False)
+    candidate = score_images(image_paths, resample=resample, fast_decode=fast_decode)
+    drift = [abs(a - b) for a, b in zip(reference, candidate) if a is not None and b is not None]
+    return max(drift) if drift else 0.0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python classify_frames.py <frames_dir> <resample> [fast_decode]")
+        sys.exit(1)
+
+    frames_dir_arg = sys.argv[1]
+    paths = sorted(
+        (os.path.join(frames_dir_arg, f) for f in os.listdir(frames_dir_arg)
+         if f.lower().endswith(('.png', '.jpg', '.jpeg'))),
+        key=get_frame_number,
+    )
+    max_drift = preprocessing_score_drift(paths, sys.argv[2], len(sys.argv) > 3 and sys.argv[3] == "1")
+    print(f"Max score drift over {len(paths)} frames: {max_drift:.4f}")
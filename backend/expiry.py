@@ -0,0 +1,115 @@
+import os
+import time
+import threading
+
+from storage import REDIS_URL, SQLiteFile, create_backend
+
+# How often the reaper looks for expired request directories
+REAPER_INTERVAL_SECONDS = int(os.getenv("REAPER_INTERVAL_SECONDS", "60"))
+
+
+class MemoryExpiryRegistry:
+    """In-process registry, for tests and single-process setups."""
+
+    def __init__(self):
+        self._expires_at = {}
+        self._lock = threading.Lock()
+
+    def register(self, request_id, expires_at):
+        with self._lock:
+            self._expires_at[request_id] = expires_at
+
+    def expires_at(self, request_id):
+        with self._lock:
+            return self._expires_at.get(request_id)
+
+    def expired(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            return [rid for rid, expires_at in self._expires_at.items() if expires_at <= now]
+
+    def forget(self, request_id):
+        with self._lock:
+            self._expires_at.pop(request_id, None)
+
+
+class SQLiteExpiryRegistry:
+    """Expiry timestamps per request_id in a SQLite file, indexed for both lookups and reaping."""
+
+    def __init__(self, path):
+        self.db = SQLiteFile(path, [
+            "CREATE TABLE IF NOT EXISTS expiry ("
+            " request_id TEXT PRIMARY KEY,"
+            " expires_at REAL NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS expiry_expires_at ON expiry (expires_at)",
+        ])
+
+    def register(self, request_id, expires_at):
+        with self.db.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO expiry (request_id, expires_at) VALUES (?, ?)",
+                (request_id, expires_at),
+            )
+
+    def expires_at(self, request_id):
+        with self.db.connect() as conn:
+            row = conn.execute("SELECT expires_at FROM expiry WHERE request_id = ?", (request_id,)).fetchone()
+        return row[0] if row else None
+
+    def expired(self, now=None):
+        with self.db.connect() as conn:
+            rows = conn.execute("SELECT request_id FROM expiry WHERE expires_at <= ?", (now or time.time(),)).fetchall()
+        return [row[0] for row in rows]
+
+    def forget(self, request_id):
+        with self.db.connect() as conn:
+            conn.execute("DELETE FROM expiry WHERE request_id = ?", (request_id,))
+
+
+class RedisExpiryRegistry:
+    """Expiry timestamps as a Redis sorted set scored by expiry time."""
+
+    def __init__(self, url=REDIS_URL, prefix="socialkart"):
+        import redis
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.key = f"{prefix}:expiry"
+
+    def register(self, request_id, expires_at):
+        self.redis.zadd(self.key, {request_id: expires_at})
+
+    def expires_at(self, request_id):
+        return self.redis.zscore(self.key, request_id)
+
+    def expired(self, now=None):
+        return self.redis.zrangebyscore(self.key, "-inf", now or time.time())
+
+    def forget(self, request_id):
+        self.redis.zrem(self.key, request_id)
+
+
+def create_expiry_registry(sqlite_path):
+    """Builds the registry matching RESULT_CACHE_BACKEND."""
+    return create_backend(
+        memory=MemoryExpiryRegistry,
+        sqlite=lambda: SQLiteExpiryRegistry(sqlite_path),
+        redis=RedisExpiryRegistry,
+    )
+
+
+def remaining_seconds(registry, request_id):
+    """Seconds until request_id expires (0 if already expired), or None if it was never registered."""
+    expires_at = registry.expires_at(request_id)
+    if expires_at is None:
+        return None
+    return int(max(0, expires_at - time.time()))
+
+
+def reap_expired(registry, base_dir, cleanup):
+    """Deletes every expired request directory under base_dir. Returns the reaped request_ids."""
+    reaped = []
+    for request_id in registry.expired():
+        cleanup(os.path.join(base_dir, request_id))
+        registry.forget(request_id)
+        reaped.append(request_id)
+    return reaped
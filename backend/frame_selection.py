@@ -0,0 +1,99 @@
+import os
+import bisect
+import heapq
+
+import numpy as np
+from PIL import Image
+
+# Frames kept per video
+MAX_SELECTED_FRAMES = int(os.getenv("MAX_SELECTED_FRAMES", "30"))
+# Minimum time between two kept frames, in seconds of video
+FRAME_MIN_SPACING_SECONDS = float(os.getenv("FRAME_MIN_SPACING_SECONDS", "1.0"))
+# Set to "0" to keep frames that look the same as an already kept one
+FRAME_DEDUP_ENABLED = os.getenv("FRAME_DEDUP_ENABLED", "1") == "1"
+# Frames whose 64-bit difference hashes differ in at most this many bits count as the same picture
+FRAME_DEDUP_MAX_DISTANCE = int(os.getenv("FRAME_DEDUP_MAX_DISTANCE", "6"))
+
+
+def difference_hash(image):
+    """
+    64-bit perceptual difference hash (dHash) of a PIL image or an RGB uint8
+    array: each bit says whether a pixel of the 9x8 grayscale thumbnail is
+    brighter than its right neighbour. Near-identical pictures get hashes a
+    few bits apart.
+    """
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
+    thumbnail = np.asarray(image.convert("L").resize((9, 8), Image.Resampling.BILINEAR), dtype=np.int16)
+    bits = (thumbnail[:, 1:] > thumbnail[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def file_difference_hash(path):
+    """difference_hash of an image file, or None if it cannot be read."""
+    try:
+        with Image.open(path) as image:
+            return difference_hash(image)
+    except Exception:
+        return None
+
+
+def _too_close(timestamps, timestamp, spacing):
+    """True if a sorted list of timestamps has one within spacing of timestamp."""
+    position = bisect.bisect_left(timestamps, timestamp)
+    if position < len(timestamps) and timestamps[position] - timestamp < spacing:
+        return True
+    return position > 0 and timestamp - timestamps[position - 1] < spacing
+
+
+def select_frames(
+    candidates,
+    max_frames=None,
+    min_spacing_seconds=None,
+    max_hash_distance=None,
+    hash_fn=None,
+):
+    """
+    Picks up to max_frames of the highest-scoring candidates, no two of them
+    closer than min_spacing_seconds and none a near duplicate of another.
+
+    candidates are dicts with "score" and "timestamp" (seconds) and optionally
+    "dhash" (see difference_hash). When a candidate has no hash, hash_fn(candidate)
+    is asked for one; it is only called for frames that pass the spacing check.
+    Pass max_hash_distance=-1 to skip duplicate detection. Candidates are
+    popped from a heap, so only as many as needed are examined, and each check
+    is a binary search over the kept timestamps. Returns the kept candidates
+    in descending score order.
+    """
+    if max_frames is None:
+        max_frames = MAX_SELECTED_FRAMES
+    if min_spacing_seconds is None:
+        min_spacing_seconds = FRAME_MIN_SPACING_SECONDS
+    if max_hash_distance is None:
+        max_hash_distance = FRAME_DEDUP_MAX_DISTANCE if FRAME_DEDUP_ENABLED else -1
+
+    # The index breaks score ties in candidate order and keeps dicts out of comparisons
+    heap = [(-candidate["score"], index, candidate) for index, candidate in enumerate(candidates)]
+    heapq.heapify(heap)
+
+    selected = []
+    selected_timestamps = []
+    selected_hashes = []
+    while heap and len(selected) < max_frames:
+        _, _, candidate = heapq.heappop(heap)
+        timestamp = candidate["timestamp"]
+        if _too_close(selected_timestamps, timestamp, min_spacing_seconds):
+            continue
+
+        if max_hash_distance >= 0:
+            frame_hash = candidate.get("dhash")
+            if frame_hash is None and hash_fn is not None:
+                frame_hash = hash_fn(candidate)
+            if frame_hash is not None:
+                if any(bin(frame_hash ^ other).count("1") <= max_hash_distance for other in selected_hashes):
+                    continue
+                selected_hashes.append(frame_hash)
+
+        selected.append(candidate)
+        bisect.insort(selected_timestamps, timestamp)
+    return selected
@@ -0,0 +1,173 @@
+import os
+import json
+import queue
+import threading
+import time
+
+# "inline" runs jobs inside the Socket.IO process (no queue), "memory" uses the
+# in-process stand-in below, "redis" enqueues for worker.py processes.
+JOB_BACKEND = os.getenv("JOB_BACKEND", "inline").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Prefix for every Redis key and channel used by the job queue
+JOB_KEY_PREFIX = os.getenv("JOB_KEY_PREFIX", "socialkart")
+# How long a cancellation flag is kept around
+CANCEL_TTL_SECONDS = 3600
+
+
+class MemoryJobBackend:
+    """
+    In-process stand-in for the Redis backend, for tests and single-box setups.
+    Jobs are plain dicts; events fan out to every listener.
+    """
+
+    def __init__(self):
+        self._jobs = queue.Queue()
+        self._processing = {}
+        self._listeners = []
+        self._canceled = set()
+        self._lock = threading.Lock()
+
+    def enqueue(self, job):
+        self._jobs.put(dict(job))
+
+    def reserve(self, worker_id, timeout=1.0):
+        """Takes the next job for worker_id, or returns None after timeout seconds."""
+        try:
+            job = self._jobs.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._lock:
+            self._processing.setdefault(worker_id, []).append(job)
+        return job
+
+    def ack(self, worker_id, job):
+        with self._lock:
+            jobs = self._processing.get(worker_id, [])
+            if job in jobs:
+                jobs.remove(job)
+
+    def requeue_stale(self, worker_id):
+        """Puts back jobs a previous incarnation of worker_id reserved but never acked."""
+        with self._lock:
+            stale = self._processing.pop(worker_id, [])
+        for job in stale:
+            self._jobs.put(job)
+        return len(stale)
+
+    def publish(self, event):
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener.put(event)
+
+    def listen(self):
+        """Yields every event published after the call."""
+        listener = queue.Queue()
+        with self._lock:
+            self._listeners.append(listener)
+        try:
+            while True:
+                yield listener.get()
+        finally:
+            with self._lock:
+                self._listeners.remove(listener)
+
+    def cancel(self, job_id):
+        with self._lock:
+            self._canceled.add(job_id)
+
+    def is_canceled(self, job_id):
+        with self._lock:
+            return job_id in self._canceled
+
+
+class RedisJobBackend:
+    """
+    Durable job queue on Redis. Jobs wait in a list; a worker atomically moves
+    the job it takes into its own processing list and removes it on ack, so a
+    job held by a crashed worker is requeued when that worker restarts.
+    Events are relayed to the Socket.IO process over a pub/sub channel.
+    """
+
+    def __init__(self, url=REDIS_URL, prefix=JOB_KEY_PREFIX):
+        import redis
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.jobs_key = f"{prefix}:jobs"
+        self.events_channel = f"{prefix}:events"
+
+    def _processing_key(self, worker_id):
+        return f"{self.prefix}:jobs:processing:{worker_id}"
+
+    def _cancel_key(self, job_id):
+        return f"{self.prefix}:job:{job_id}:canceled"
+
+    def enqueue(self, job):
+        self.redis.lpush(self.jobs_key, json.dumps(job))
+
+    def reserve(self, worker_id, timeout=1.0):
+        raw = self.redis.blmove(self.jobs_key, self._processing_key(worker_id), timeout, "RIGHT", "LEFT")
+        if raw is None:
+            return None
+        job = json.loads(raw)
+        job["_raw"] = raw
+        return job
+
+    def ack(self, worker_id, job):
+        raw = job.get("_raw") or json.dumps(job)
+        self.redis.lrem(self._processing_key(worker_id), 1, raw)
+
+    def requeue_stale(self, worker_id):
+        moved = 0
+        while self.redis.lmove(self._processing_key(worker_id), self.jobs_key, "RIGHT", "RIGHT") is not None:
+            moved += 1
+        return moved
+
+    def publish(self, event):
+        self.redis.publish(self.events_channel, json.dumps(event))
+
+    def listen(self):
+        pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.events_channel)
+        try:
+            for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                try:
+                    yield json.loads(message["data"])
+                except ValueError:
+                    continue
+        finally:
+            pubsub.close()
+
+    def cancel(self, job_id):
+        self.redis.set(self._cancel_key(job_id), "1", ex=CANCEL_TTL_SECONDS)
+
+    def is_canceled(self, job_id):
+        return self.redis.exists(self._cancel_key(job_id)) > 0
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_job_backend():
+    """Returns the process-wide job backend selected by JOB_BACKEND, or None for inline mode."""
+    global _backend
+    if JOB_BACKEND == "inline":
+        return None
+    with _backend_lock:
+        if _backend is None:
+            if JOB_BACKEND == "redis":
+                _backend = RedisJobBackend()
+            elif JOB_BACKEND == "memory":
+                _backend = MemoryJobBackend()
+            else:
+                raise ValueError(f"Unknown JOB_BACKEND: {JOB_BACKEND}")
+        return _backend
+
+
+def job_event(job, event, data):
+    """Builds the pub/sub message that carries one Socket.IO event for a job."""
+    return {"job_id": job["job_id"], "room": job.get("room"), "event": event, "data": data, "ts": time.time()}
@@ -0,0 +1,148 @@
+import os
+import sys
+import time
+import random
+
+import httpx
+from dotenv import load_dotenv
+from google import genai
+from google.genai import types, errors
+from pydantic import BaseModel
+
+from rate_limit import TokenBucket
+from workers import native
+
+load_dotenv()
+
+_threading = native("threading")
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# Override the Gemini endpoint, e.g. with a local fake server in tests
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+# Simultaneous Gemini calls per process
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+# Sustained request rate (requests per second) and the burst allowed above it
+LLM_RATE_PER_SECOND = float(os.getenv("LLM_RATE_PER_SECOND", "2"))
+LLM_BURST = int(os.getenv("LLM_BURST", "4"))
+# Attempts per call after the first one, for quota, server and network errors
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+# Exponential backoff between attempts: base * 2^attempt with full jitter, capped
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "1"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "20"))
+# Timeout of a single HTTP attempt
+LLM_REQUEST_TIMEOUT_SECONDS = float(os.getenv("LLM_REQUEST_TIMEOUT_SECONDS", "60"))
+# Overall budget of one call, including waiting for a slot and all retries
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "180"))
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# One client per worker thread. Under eventlet the locks inside a client's
+# connection pool are green, and worker threads must never wait on the same one.
+_clients = _threading.local()
+_slots = _threading.BoundedSemaphore(max(1, LLM_MAX_CONCURRENCY))
+_rate_limiter = TokenBucket(LLM_RATE_PER_SECOND, LLM_BURST)
+
+
+class LLMDeadlineExceeded(Exception):
+    pass
+
+
+def get_client():
+    """
+    Returns the calling thread's Gemini client. Its HTTP connection pool is
+    reused by every call from that thread instead of opening a new one per request.
+    """
+    client = getattr(_clients, "client", None)
+    if client is None:
+        if not GEMINI_API_KEY:
+            raise RuntimeError("GEMINI_API_KEY missing in environment.")
+        http_options = types.HttpOptions(timeout=int(LLM_REQUEST_TIMEOUT_SECONDS * 1000))
+        if GEMINI_BASE_URL:
+            http_options.base_url = GEMINI_BASE_URL
+        client = genai.Client(api_key=GEMINI_API_KEY, http_options=http_options)
+        _clients.client = client
+    return client
+
+
+def _build_genai_models():
+    """
+    Finishes building genai's pydantic models now, at import. pydantic would
+    otherwise build each one on first use under a process-wide lock, which
+    under eventlet is green; two worker threads waiting on it crash the hub.
+    """
+    for name, module in list(sys.modules.items()):
+        if not name.startswith("google.genai") or module is None:
+            continue
+        for value in list(vars(module).values()):
+            if (
+                isinstance(value, type)
+                and issubclass(value, BaseModel)
+                and not getattr(value, "__pydantic_complete__", True)
+            ):
+                try:
+                    value.model_rebuild()
+                except Exception:
+                    pass
+
+
+_build_genai_models()
+
+
+def _is_retryable(error):
+    if isinstance(error, errors.APIError):
+        return error.code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (httpx.TimeoutException, httpx.TransportError))
+
+
+def _backoff_seconds(attempt):
+    return random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def generate_text(model, contents, config=None, on_chunk=None, on_restart=None, deadline_seconds=None):
+    """
+    Streams a Gemini completion and returns its full text. Calls share a
+    concurrency limit and a rate limit; quota, server and network errors are
+    retried with jittered exponential backoff until the deadline.
+    on_chunk(text) receives each streamed piece. A retry restarts the stream
+    from scratch and calls on_restart() first, so partial output can be dropped.
+    Blocks; call it from a worker thread (run_blocking) in the web process.
+    """
+    deadline = time.monotonic() + (deadline_seconds or LLM_DEADLINE_SECONDS)
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not _slots.acquire(timeout=remaining):
+            raise LLMDeadlineExceeded("Timed out waiting for a free LLM slot")
+        try:
+            if not _rate_limiter.acquire(timeout=deadline - time.monotonic()):
+                raise LLMDeadlineExceeded("Timed out waiting for the LLM rate limit")
+            attempt_config = (config or types.GenerateContentConfig()).model_copy()
+            # A single attempt never outlives the call's deadline
+            attempt_timeout = min(LLM_REQUEST_TIMEOUT_SECONDS, deadline - time.monotonic())
+            attempt_config.http_options = types.HttpOptions(timeout=max(1, int(attempt_timeout * 1000)))
+            text = ""
+            for chunk in get_client().models.generate_content_stream(
+                model=model,
+                contents=contents,
+                config=attempt_config,
+            ):
+                if chunk.text:
+                    text += chunk.text
+                    if on_chunk is not None:
+                        on_chunk(chunk.text)
+            return text
+        except LLMDeadlineExceeded:
+            raise
+        except Exception as e:
+            if not _is_retryable(e) or attempt >= LLM_MAX_RETRIES:
+                raise
+            delay = _backoff_seconds(attempt)
+            if time.monotonic() + delay >= deadline:
+                raise
+            print(f"Gemini call failed ({e}); retrying in {delay:.1f}s")
+        finally:
+            _slots.release()
+        attempt += 1
+        time.sleep(delay)
+        if on_restart is not None:
+            on_restart()
@@ -0,0 +1,314 @@
+import os
+import json
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from workers import native, run_parallel
+
+_threading = native("threading")
+
+# Files fetched at the same time per post (carousel items, or ranges of one large video)
+MEDIA_DOWNLOAD_WORKERS = int(os.getenv("MEDIA_DOWNLOAD_WORKERS", "4"))
+# Files at least this large are fetched as parallel HTTP range requests
+MEDIA_RANGE_MIN_BYTES = int(os.getenv("MEDIA_RANGE_MIN_BYTES", str(4 * 1024 * 1024)))
+# Bytes read from the response and written at a time
+MEDIA_CHUNK_BYTES = int(os.getenv("MEDIA_CHUNK_BYTES", str(256 * 1024)))
+# How often a ranged download records its progress for resuming; ranges
+# that stop are always recorded
+MEDIA_STATE_SAVE_SECONDS = float(os.getenv("MEDIA_STATE_SAVE_SECONDS", "2"))
+# Attempts per file or range; each one resumes where the previous stopped
+MEDIA_DOWNLOAD_ATTEMPTS = int(os.getenv("MEDIA_DOWNLOAD_ATTEMPTS", "3"))
+MEDIA_DOWNLOAD_TIMEOUT_SECONDS = float(os.getenv("MEDIA_DOWNLOAD_TIMEOUT_SECONDS", "30"))
+MEDIA_USER_AGENT = os.getenv(
+    "INSTAGRAM_USER_AGENT",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.0.0 Safari/537.36"
+).strip()
+
+_http_session = None
+_http_session_lock = _threading.Lock()
+
+
+def get_http_session():
+    """Process-wide requests session; its connection pool is shared by every media download."""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max(8, MEDIA_DOWNLOAD_WORKERS * 4))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"User-Agent": MEDIA_USER_AGENT})
+            _http_session = session
+        return _http_session
+
+
+def resolve_media(post):
+    """
+    Returns [(url, filename)] for a post_metadata() summary: video.mp4 for a
+    video post, image_NN.jpg for a photo or for each carousel item (a video
+    item contributes its cover image).
+    """
+    if post["typename"] == "GraphSidecar":
+        return [
+            (node["display_url"], f"image_{number:02d}.jpg")
+            for number, node in enumerate(post["sidecar"], start=1)
+        ]
+    if post["is_video"]:
+        return [(post["video_url"], "video.mp4")]
+    return [(post["display_url"], "image_01.jpg")]
+
+
+def _probe(url, session):
+    """(size, accepts_ranges) of a remote file; (None, False) if the server does not say."""
+    try:
+        response = session.head(url, allow_redirects=True, timeout=MEDIA_DOWNLOAD_TIMEOUT_SECONDS)
+        response.raise_for_status()
+    except requests.RequestException:
+        return None, False
+    size = response.headers.get("Content-Length")
+    accepts_ranges = response.headers.get("Accept-Ranges", "").lower() == "bytes"
+    return (int(size) if size and size.isdigit() else None), accepts_ranges
+
+
+def _plan_ranges(size, workers):
+    """Splits [0, size) into [start, end, done] ranges, one per worker for large files."""
+    parts = max(1, min(workers, size // MEDIA_RANGE_MIN_BYTES)) if size >= MEDIA_RANGE_MIN_BYTES else 1
+    step = -(-size // parts)
+    return [[start, min(start + step, size), 0] for start in range(0, size, step)]
+
+
+def _load_state(state_path, part_path, size):
+    """Ranges recorded by an earlier, interrupted download of the same file, if usable."""
+    try:
+        with open(state_path, "r") as f:
+            state = json.load(f)
+        if state.get("size") == size and os.path.getsize(part_path) == size:
+            return state["ranges"]
+    except Exception:
+        pass
+    return None
+
+
+def _is_client_error(error):
+    """True for 4xx answers (other than 429), which a retry of the same URL will not fix."""
+    response = getattr(error, "response", None)
+    return response is not None and 400 <= response.status_code < 500 and response.status_code != 429
+
+
+def _fetch_sequential(url, part_path, session, accepts_ranges, on_chunk=None):
+    """
+    Downloads url into part_path in order, in one request at a time. A retry
+    resumes with a range request when the server supports it and starts over
+    otherwise; either way on_chunk(bytes) sees every byte of the file exactly once.
+    """
+    delivered = 0
+    for attempt in range(MEDIA_DOWNLOAD_ATTEMPTS):
+        resume = accepts_ranges and delivered > 0
+        headers = {"Range": f"bytes={delivered}-"} if resume else {}
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=MEDIA_DOWNLOAD_TIMEOUT_SECONDS) as response:
+                response.raise_for_status()
+                resume = resume and response.status_code == 206
+                offset = delivered if resume else 0
+                with open(part_path, "r+b" if resume else "wb") as f:
+                    f.seek(offset)
+                    for chunk in response.iter_content(MEDIA_CHUNK_BYTES):
+                        f.write(chunk)
+                        offset += len(chunk)
+                        if offset > delivered:
+                            if on_chunk is not None:
+                                on_chunk(chunk[len(chunk) - (offset - delivered):])
+                            delivered = offset
+            return
+        except requests.RequestException as e:
+            if attempt + 1 >= MEDIA_DOWNLOAD_ATTEMPTS or _is_client_error(e):
+                raise
+            print(f"Download interrupted ({e}); retrying")
+            time.sleep(2 ** attempt)
+
+
+class _PrefixFeeder:
+    """
+    Hands on_chunk the bytes of a file being filled by parallel ranges, in
+    order: whatever extends the contiguous prefix written so far is read back
+    from the part file. Range workers call feed() after each chunk; only one
+    feeds at a time and the others go back to downloading.
+    """
+
+    def __init__(self, part_path, ranges, lock, on_chunk):
+        self.part_path = part_path
+        self.ranges = ranges
+        self.lock = lock
+        self.on_chunk = on_chunk
+        self.delivered = 0
+        self._feeding = _threading.Lock()
+
+    def _prefix_end(self):
+        end = 0
+        with self.lock:
+            for start, stop, done in self.ranges:
+                if start != end:
+                    break
+                end = start + done
+                if end < stop:
+                    break
+        return end
+
+    def feed(self, wait=False):
+        if not self._feeding.acquire(blocking=wait):
+            return
+        try:
+            with open(self.part_path, "rb") as f:
+                while True:
+                    end = self._prefix_end()
+                    if end <= self.delivered:
+                        return
+                    f.seek(self.delivered)
+                    while self.delivered < end:
+                        chunk = f.read(min(MEDIA_CHUNK_BYTES, end - self.delivered))
+                        self.on_chunk(chunk)
+                        self.delivered += len(chunk)
+        finally:
+            self._feeding.release()
+
+
+def _fetch_ranges(url, part_path, state_path, size, ranges, session, workers, on_chunk=None):
+    """
+    Fills part_path (preallocated to size) with parallel range requests. Progress
+    is saved to state_path every MEDIA_STATE_SAVE_SECONDS and whenever a range
+    stops, so a later call resumes each range close to its last written byte.
+    4xx answers (e.g. an expired signed URL) fail at once instead of being retried.
+    With on_chunk the file's bytes are also handed over in order as the
+    contiguous prefix grows (see _PrefixFeeder).
+    """
+    lock = _threading.Lock()
+    feeder = _PrefixFeeder(part_path, ranges, lock, on_chunk) if on_chunk is not None else None
+    saved_at = [0.0]
+
+    def save_state():
+        # Called with lock held
+        tmp_path = state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"size": size, "ranges": ranges}, f)
+        os.replace(tmp_path, state_path)
+        saved_at[0] = time.monotonic()
+
+    def fetch(byte_range):
+        for attempt in range(MEDIA_DOWNLOAD_ATTEMPTS):
+            start, end, done = byte_range
+            if start + done >= end:
+                return
+            try:
+                headers = {"Range": f"bytes={start + done}-{end - 1}"}
+                with session.get(url, headers=headers, stream=True, timeout=MEDIA_DOWNLOAD_TIMEOUT_SECONDS) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise requests.HTTPError(f"Range request answered with {response.status_code}")
+                    with open(part_path, "r+b") as f:
+                        f.seek(start + done)
+                        try:
+                            for chunk in response.iter_content(MEDIA_CHUNK_BYTES):
+                                chunk = chunk[:end - (start + byte_range[2])]
+                                f.write(chunk)
+                                f.flush()
+                                with lock:
+                                    byte_range[2] += len(chunk)
+                                    if time.monotonic() - saved_at[0] >= MEDIA_STATE_SAVE_SECONDS:
+                                        save_state()
+                                if feeder is not None:
+                                    feeder.feed()
+                        finally:
+                            with lock:
+                                save_state()
+                if start + byte_range[2] >= end:
+                    return
+            except requests.RequestException as e:
+                if attempt + 1 >= MEDIA_DOWNLOAD_ATTEMPTS or _is_client_error(e):
+                    raise
+                print(f"Range {start}-{end} interrupted ({e}); resuming")
+                time.sleep(2 ** attempt)
+        if start + byte_range[2] < end:
+            raise IOError(f"Range {start}-{end} incomplete after {MEDIA_DOWNLOAD_ATTEMPTS} attempts")
+
+    with lock:
+        save_state()
+    run_parallel(fetch, ranges, workers)
+    if feeder is not None:
+        # Whatever a busy feeder skipped
+        feeder.feed(wait=True)
+
+
+def download_file(url, dest_path, session=None, workers=None, on_chunk=None):
+    """
+    Downloads url to dest_path through a dest_path.part file that only takes
+    the final name once complete. Files the server can serve in ranges are
+    fetched as parallel range requests and resume after an interruption;
+    others are fetched in one request. With on_chunk every byte of the file is
+    also handed to on_chunk(bytes), in order, as soon as all bytes before it
+    have arrived.
+    """
+    session = session or get_http_session()
+    workers = workers or MEDIA_DOWNLOAD_WORKERS
+    part_path = dest_path + ".part"
+    state_path = part_path + ".json"
+
+    size, accepts_ranges = _probe(url, session)
+    if size and os.path.isfile(dest_path) and os.path.getsize(dest_path) == size:
+        if on_chunk is not None:
+            with open(dest_path, "rb") as f:
+                for chunk in iter(lambda: f.read(MEDIA_CHUNK_BYTES), b""):
+                    on_chunk(chunk)
+        return dest_path
+
+    if size and accepts_ranges:
+        ranges = _load_state(state_path, part_path, size)
+        if ranges is None:
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+            ranges = _plan_ranges(size, workers)
+        else:
+            print(f"Resuming download of {os.path.basename(dest_path)}")
+        _fetch_ranges(url, part_path, state_path, size, ranges, session, workers, on_chunk)
+    else:
+        _fetch_sequential(url, part_path, session, bool(size and accepts_ranges), on_chunk)
+
+    os.replace(part_path, dest_path)
+    try:
+        os.remove(state_path)
+    except OSError:
+        pass
+    return dest_path
+
+
+def download_post_media(post, request_dir, session=None, video_sink=None):
+    """
+    Downloads the media of a post (its post_metadata() summary) into
+    request_dir under predictable names (see resolve_media), carousel items in
+    parallel. Returns the written paths.
+
+    For a video post, video_sink(post) may return a consumer (e.g. a stdin
+    MediaIngest) that receives the video while it downloads through
+    write(chunk); end_input() follows a complete download and close() a failed one.
+    """
+    os.makedirs(request_dir, exist_ok=True)
+    items = resolve_media(post)
+    sink = video_sink(post) if video_sink is not None and post["is_video"] and len(items) == 1 else None
+    if sink is not None:
+        url, filename = items[0]
+        try:
+            path = download_file(url, os.path.join(request_dir, filename), session, on_chunk=sink.write)
+        except BaseException:
+            sink.close()
+            raise
+        sink.end_input()
+        return [path]
+
+    # Parallel items each get a single connection; a lone file may split into ranges
+    per_file_workers = MEDIA_DOWNLOAD_WORKERS if len(items) == 1 else 1
+    return run_parallel(
+        lambda item: download_file(item[0], os.path.join(request_dir, item[1]), session, per_file_workers),
+        items,
+        MEDIA_DOWNLOAD_WORKERS,
+    )
@@ -0,0 +1,645 @@
+import os
+import re
+import json
+import struct
+import tempfile
+from collections import deque
+
+import imageio_ffmpeg as iio_ffmpeg
+import numpy as np
+
+from workers import native
+
+# Ingest runs on worker OS threads (see workers.run_blocking), so it uses real
+# threads, queues and pipes even when the app is monkey-patched by eventlet.
+queue = native("queue")
+subprocess = native("subprocess")
+threading = native("threading")
+
+# ffmpeg probe results are written next to the video so later stages (and retries) reuse them
+MEDIA_INFO_FILENAME = "media.json"
+# Mono 16 kHz is all the transcription step needs
+AUDIO_SAMPLE_RATE = 16000
+# Sampled frames an ingest keeps in memory ahead of its consumer (about 150 KB
+# each at the classifier size); further ones are spilled to a temporary file
+INGEST_QUEUE_FRAMES = int(os.getenv("INGEST_QUEUE_FRAMES", "300"))
+# Largest moov box probe_media parses itself; bigger indexes are left to ffmpeg
+MP4_HEADER_MAX_BYTES = 16 * 1024 * 1024
+# Most bytes of a video's head held back while looking for its moov box before streaming
+STREAM_HEAD_MAX_BYTES = int(os.getenv("STREAM_HEAD_MAX_BYTES", str(1024 * 1024)))
+
+# One line per frame that passes ffmpeg's showinfo filter
+_SHOWINFO_PTS_TIME = re.compile(r"\[Parsed_showinfo_\d+ @ [^\]]+\] n:\s*\d+ pts:\s*-?\d+\s+pts_time:(-?[\d.]+)")
+
+_probe_cache = {}
+_probe_lock = threading.Lock()
+
+
+def _parse_probe_output(meta):
+    info = {"duration": None, "fps": None, "width": None, "height": None, "has_audio": False}
+
+    match = re.search(r"Duration:\s+(\d+):(\d+):(\d+(?:\.\d+)?)", meta)
+    if match:
+        info["duration"] = int(match.group(1)) * 3600 + int(match.group(2)) * 60 + float(match.group(3))
+
+    video_line = re.search(r"Stream #\d+:\d+.*?: Video: (.*)", meta)
+    if video_line:
+        resolution = re.search(r"\b(\d{2,5})x(\d{2,5})\b", video_line.group(1))
+        if resolution:
+            info["width"] = int(resolution.group(1))
+            info["height"] = int(resolution.group(2))
+        rate = re.search(r"(\d+(?:\.\d+)?) (?:fps|tbr)", video_line.group(1))
+        if rate:
+            info["fps"] = float(rate.group(1))
+
+    info["has_audio"] = re.search(r"Stream #\d+:\d+.*?: Audio:", meta) is not None
+    return info
+
+
+def _iter_boxes(data, offset=0, end=None):
+    """Yields (type, payload_start, box_end) for each MP4 box in data[offset:end]."""
+    end = len(data) if end is None else end
+    while offset + 8 <= end:
+        size, kind = struct.unpack(">I4s", data[offset:offset + 8])
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                return
+            size = struct.unpack(">Q", data[offset + 8:offset + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            return
+        yield kind, offset + header, offset + size
+        offset += size
+
+
+def _child(data, kind, start, end):
+    for child_kind, child_start, child_end in _iter_boxes(data, start, end):
+        if child_kind == kind:
+            return child_start, child_end
+    return None
+
+
+def _read_moov(video_path):
+    """The payload of the file's top-level moov box, wherever it sits, or None."""
+    with open(video_path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        offset = 0
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            header = f.read(16)
+            size, kind = struct.unpack(">I4s", header[:8])
+            header_size = 8
+            if size == 1 and len(header) == 16:
+                size = struct.unpack(">Q", header[8:16])[0]
+                header_size = 16
+            elif size == 0:
+                size = file_size - offset
+            if size < header_size:
+                return None
+            if kind == b"moov":
+                if size > MP4_HEADER_MAX_BYTES:
+                    return None
+                f.seek(offset + header_size)
+                return f.read(size - header_size)
+            offset += size
+    return None
+
+
+def _media_timing(data, start, end):
+    """(timescale, duration) of an mvhd or mdhd box payload."""
+    if data[start] == 1:
+        return struct.unpack(">IQ", data[start + 20:start + 32])
+    return struct.unpack(">II", data[start + 12:start + 20])
+
+
+def _parse_moov(moov):
+    """probe_media's info from the payload of a moov box; None without a video track."""
+    info = {"duration": None, "fps": None, "width": None, "height": None, "has_audio": False}
+    has_video = False
+    for kind, start, end in _iter_boxes(moov):
+        if kind == b"mvhd":
+            timescale, duration = _media_timing(moov, start, end)
+            if timescale and duration:
+                info["duration"] = round(duration / timescale, 3)
+        elif kind == b"trak":
+            mdia = _child(moov, b"mdia", start, end)
+            hdlr = mdia and _child(moov, b"hdlr", *mdia)
+            if not hdlr:
+                continue
+            handler = moov[hdlr[0] + 8:hdlr[0] + 12]
+            if handler == b"soun":
+                info["has_audio"] = True
+            elif handler == b"vide" and not has_video:
+                has_video = True
+                tkhd = _child(moov, b"tkhd", start, end)
+                if tkhd:
+                    # Track size is 16.16 fixed point, in the last 8 bytes of tkhd
+                    width, height = struct.unpack(">II", moov[tkhd[1] - 8:tkhd[1]])
+                    info["width"], info["height"] = (width >> 16) or None, (height >> 16) or None
+                mdhd = _child(moov, b"mdhd", *mdia)
+                minf = _child(moov, b"minf", *mdia)
+                stbl = minf and _child(moov, b"stbl", *minf)
+                stsz = stbl and _child(moov, b"stsz", *stbl)
+                if mdhd and stsz:
+                    timescale, duration = _media_timing(moov, *mdhd)
+                    samples = struct.unpack(">I", moov[stsz[0] + 8:stsz[0] + 12])[0]
+                    if timescale and duration and samples:
+                        info["fps"] = round(samples * timescale / duration, 2)
+    if not has_video or not info["duration"]:
+        return None
+    return info
+
+
+def _parse_mp4_header(video_path):
+    """
+    probe_media's info read straight from an MP4's moov box, without running
+    ffmpeg. None when the file is not a plain MP4 (no moov, a fragmented
+    file, no video track), so the caller can fall back to ffmpeg.
+    """
+    moov = _read_moov(video_path)
+    return _parse_moov(moov) if moov else None
+
+
+def mp4_info_from_head(head):
+    """
+    probe_media's info for a video from its first bytes, when they hold the
+    whole moov box (a faststart MP4); otherwise None.
+    """
+    for kind, start, end in _iter_boxes(head):
+        if kind == b"moov":
+            try:
+                return _parse_moov(head[start:end])
+            except (struct.error, IndexError):
+                return None
+    return None
+
+
+def probe_media(video_path):
+    """
+    Returns {"duration", "fps", "width", "height", "has_audio"} for a video.
+    The container is parsed once per file, in-process for MP4s and by ffmpeg
+    for anything else; the result is cached in memory and in media.json beside
+    the video, keyed by the file's size and mtime.
+    """
+    stat = os.stat(video_path)
+    cache_key = (os.path.abspath(video_path), stat.st_size, stat.st_mtime)
+    with _probe_lock:
+        if cache_key in _probe_cache:
+            return dict(_probe_cache[cache_key])
+
+    info_path = os.path.join(os.path.dirname(video_path), MEDIA_INFO_FILENAME)
+    info = None
+    try:
+        with open(info_path, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        if stored.get("size") == stat.st_size and stored.get("mtime") == stat.st_mtime:
+            info = stored["info"]
+    except Exception:
+        pass
+
+    if info is None:
+        try:
+            info = _parse_mp4_header(video_path)
+        except (OSError, struct.error, IndexError):
+            info = None
+
+    if info is None:
+        ffmpeg_exe = iio_ffmpeg.get_ffmpeg_exe()
+        # "ffmpeg -i <input>" prints metadata (including Duration) to stderr
+        proc = subprocess.run(
+            [ffmpeg_exe, "-hide_banner", "-i", video_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        info = _parse_probe_output(proc.stderr or "")
+        try:
+            with open(info_path, "w", encoding="utf-8") as f:
+                json.dump({"size": stat.st_size, "mtime": stat.st_mtime, "info": info}, f)
+        except Exception:
+            pass
+
+    with _probe_lock:
+        _probe_cache[cache_key] = info
+    return dict(info)
+
+
+def scene_select_filter(analysis_fps, threshold, min_gap, max_gap):
+    """
+    ffmpeg filter chain for adaptive sampling. The video is looked at
+    analysis_fps times a second and a frame is kept when a new shot starts
+    (scene score above threshold, at least min_gap seconds after the last kept
+    frame) or when max_gap seconds have passed without one. showinfo logs the
+    timestamp of every kept frame; read them back with parse_showinfo_timestamps.
+    """
+    return (
+        f"fps={analysis_fps:.6f},"
+        f"select='isnan(prev_selected_t)"
+        f"+gt(scene,{threshold:.3f})*gte(t-prev_selected_t,{min_gap:.6f})"
+        f"+gte(t-prev_selected_t,{max_gap:.6f})',"
+        f"showinfo"
+    )
+
+
+def parse_showinfo_timestamps(text):
+    """Returns the timestamps (seconds) of the frames logged by showinfo, in order."""
+    return [float(match.group(1)) for match in _SHOWINFO_PTS_TIME.finditer(text)]
+
+
+def classifier_filter(fps, size, select=None):
+    """
+    ffmpeg filter chain producing size x size center-cropped frames, like ImageOps.fit.
+    Frames are sampled uniformly at fps, or by the given select chain (see scene_select_filter).
+    """
+    # Convert to RGB before scaling so the result matches the PIL path on PNG frames
+    return (
+        f"{select or f'fps={fps:.6f}'},format=rgb24,"
+        f"scale={size}:{size}:force_original_aspect_ratio=increase:flags=lanczos,"
+        f"crop={size}:{size}"
+    )
+
+
+def pcm_path_for(audio_path):
+    """The raw PCM copy written beside an extracted audio file (see audio_output_args)."""
+    return os.path.splitext(audio_path)[0] + ".pcm"
+
+
+def audio_output_args(audio_path):
+    """
+    ffmpeg output options for the first audio track: a 16 kHz mono MP3 at
+    audio_path for transcription, plus the same samples as raw 16-bit PCM at
+    pcm_path_for(audio_path), so speech detection needs no second decode.
+    """
+    return [
+        "-map", "0:a:0",
+        "-ac", "1",
+        "-ar", str(AUDIO_SAMPLE_RATE),
+        "-acodec", "libmp3lame",
+        "-b:a", "96k",
+        audio_path,
+        "-map", "0:a:0",
+        "-ac", "1",
+        "-ar", str(AUDIO_SAMPLE_RATE),
+        "-f", "s16le",
+        pcm_path_for(audio_path),
+    ]
+
+
+def moov_precedes_mdat(head):
+    """
+    Walks the top-level MP4 boxes in the first bytes of a file. True when the
+    moov box (the index) comes before mdat, so the video can be decoded while
+    it arrives; False when mdat comes first or the data is not MP4; None when
+    more bytes are needed to tell.
+    """
+    offset = 0
+    while offset + 8 <= len(head):
+        size, kind = struct.unpack(">I4s", head[offset:offset + 8])
+        if kind == b"moov":
+            return True
+        if kind == b"mdat":
+            return False
+        if size == 1:
+            # 64-bit size follows the box type
+            if offset + 16 > len(head):
+                return None
+            size = struct.unpack(">Q", head[offset + 8:offset + 16])[0]
+        elif size == 0:
+            # The box runs to the end of the file, so nothing follows it
+            return False
+        if size < 8:
+            return False
+        offset += size
+    return None
+
+
+class FaststartGate:
+    """
+    video_sink consumer that holds back the first bytes of a video until its
+    box order is known. A faststart file opens the ingest with open_ingest()
+    and gets everything written to it; any other file is not streamed, since
+    ffmpeg cannot decode it from a pipe before the moov box at its end arrives.
+    open_ingest(info) gets mp4_info_from_head() of the held-back bytes (None
+    if unreadable). on_decided(ingest) is called once, with None when the file
+    is not streamed.
+    """
+
+    def __init__(self, open_ingest, on_decided):
+        self._open_ingest = open_ingest
+        self._on_decided = on_decided
+        self._head = b""
+        self._decided = False
+        self.ingest = None
+
+    def _decide(self, streamable):
+        self._decided = True
+        try:
+            if streamable:
+                self.ingest = self._open_ingest(mp4_info_from_head(self._head))
+                self.ingest.write(self._head)
+        finally:
+            self._head = b""
+            self._on_decided(self.ingest)
+
+    def write(self, chunk):
+        if self._decided:
+            if self.ingest is not None:
+                self.ingest.write(chunk)
+            return
+        self._head += chunk
+        streamable = moov_precedes_mdat(self._head)
+        if streamable is None and len(self._head) < STREAM_HEAD_MAX_BYTES:
+            return
+        self._decide(bool(streamable))
+
+    def end_input(self):
+        if not self._decided:
+            self._decide(bool(moov_precedes_mdat(self._head)))
+        if self.ingest is not None:
+            self.ingest.end_input()
+
+    def close(self):
+        if not self._decided:
+            self._decide(False)
+        if self.ingest is not None:
+            self.ingest.close()
+
+
+def _read_exact(stream, size):
+    """Reads exactly size bytes from a pipe, or fewer only at end of stream."""
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+class _FrameSpool:
+    """
+    FIFO of (index, timestamp, frame) tuples whose put() never blocks. Up to
+    max_in_memory waiting frames are kept in memory; the pixels of any beyond
+    that go to a temporary file until the consumer catches up.
+    """
+
+    def __init__(self, max_in_memory):
+        self._max_in_memory = max_in_memory
+        self._items = deque()
+        self._in_memory = 0
+        self._spilled = 0
+        self._file = None
+        self._closed = False
+        self._changed = threading.Condition()
+
+    def put(self, item):
+        with self._changed:
+            if self._closed:
+                return
+            offset = None
+            if item is not None:
+                if self._in_memory < self._max_in_memory:
+                    self._in_memory += 1
+                else:
+                    index, timestamp, frame = item
+                    if self._file is None:
+                        self._file = tempfile.TemporaryFile()
+                    self._file.seek(0, os.SEEK_END)
+                    offset = self._file.tell()
+                    self._spilled += 1
+                    self._file.write(frame.tobytes())
+                    item = (index, timestamp, frame.shape)
+            self._items.append((item, offset))
+            self._changed.notify()
+
+    def get(self, timeout=None):
+        """The next item; raises queue.Empty if none arrives within timeout."""
+        with self._changed:
+            if not self._changed.wait_for(lambda: self._items, timeout):
+                raise queue.Empty
+            item, offset = self._items.popleft()
+            if offset is None:
+                if item is not None:
+                    self._in_memory -= 1
+                return item
+            index, timestamp, shape = item
+            self._file.seek(offset)
+            frame = np.frombuffer(self._file.read(int(np.prod(shape))), dtype=np.uint8).reshape(shape)
+            self._spilled -= 1
+            if not self._spilled:
+                # Caught up; the file starts over for the next overflow
+                self._file.seek(0)
+                self._file.truncate()
+            return index, timestamp, frame
+
+    def close(self):
+        with self._changed:
+            self._closed = True
+            self._items.clear()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class MediaIngest:
+    """
+    Demuxes a video once. A single ffmpeg process writes the sampled classifier
+    frames as rawvideo to a pipe and, when audio_path is given, the 16 kHz mono
+    audio track to that file.
+
+    The frame pipe is drained by a reader thread as fast as ffmpeg produces it,
+    so the audio file is complete as soon as decoding finishes rather than when
+    the (slower) classifier has consumed every frame. Frames the classifier
+    has not taken yet stay in memory up to INGEST_QUEUE_FRAMES and are spilled
+    to a temporary file beyond that.
+
+    With a select chain (see scene_select_filter) frames are no longer evenly
+    spaced; their timestamps are then read from ffmpeg's showinfo log.
+
+    With video_path=None the video is read from ffmpeg's stdin instead, fed
+    with write() while it downloads and finished with end_input(). The
+    stream cannot be probed then, so audio is only written when has_audio
+    says the video has a track (see mp4_info_from_head).
+    """
+
+    def __init__(self, video_path, fps, size, audio_path=None, select=None, has_audio=None):
+        self.video_path = video_path
+        self.fps = fps
+        self.size = size
+        self.audio_path = audio_path
+        self.has_audio = has_audio
+        self.select = select
+        self.stderr = ""
+        self._frames = _FrameSpool(INGEST_QUEUE_FRAMES)
+        self._timestamps = queue.Queue(maxsize=INGEST_QUEUE_FRAMES)
+        self._finished = threading.Event()
+        self._closed = threading.Event()
+        self._proc = None
+        self._threads = []
+        self._input_broken = False
+
+    def start(self):
+        if self._proc is not None:
+            return self
+
+        ffmpeg_exe = iio_ffmpeg.get_ffmpeg_exe()
+        # showinfo logs at info level
+        loglevel = "info" if self.select else "error"
+        from_stdin = self.video_path is None
+        cmd = [ffmpeg_exe, "-hide_banner", "-loglevel", loglevel, "-y"]
+        cmd += ["-i", "pipe:0"] if from_stdin else ["-nostdin", "-i", self.video_path]
+        cmd += [
+            "-map", "0:v:0",
+            "-vf", classifier_filter(self.fps, self.size, self.select),
+            # Keep the selected frames as they are instead of filling the gaps to a constant rate
+            "-fps_mode", "passthrough",
+            "-f", "rawvideo",
+            "-pix_fmt", "rgb24",
+            "pipe:1",
+        ]
+        has_audio = self.has_audio
+        if has_audio is None and self.audio_path and not from_stdin:
+            has_audio = probe_media(self.video_path).get("has_audio")
+        if self.audio_path and has_audio:
+            cmd += audio_output_args(self.audio_path)
+        else:
+            self.audio_path = None
+
+        self._proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE if from_stdin else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self._threads = [
+            threading.Thread(target=self._read_frames, daemon=True),
+            threading.Thread(target=self._read_stderr, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def _put(self, items, item):
+        """Queues item for a consumer, giving up once the ingest is closed."""
+        while not self._closed.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _next_timestamp(self):
+        """The next timestamp from the showinfo log; None at its end or once the ingest is closed."""
+        while True:
+            try:
+                return self._timestamps.get(timeout=0.1)
+            except queue.Empty:
+                # close() drops the end marker along with the rest of the log
+                if self._closed.is_set():
+                    return None
+
+    def _read_frames(self):
+        frame_bytes = self.size * self.size * 3
+        index = 0
+        logged_timestamps = bool(self.select)
+        try:
+            while True:
+                buffer = _read_exact(self._proc.stdout, frame_bytes)
+                if len(buffer) < frame_bytes:
+                    break
+                frame = np.frombuffer(buffer, dtype=np.uint8).reshape(self.size, self.size, 3)
+                timestamp = self._next_timestamp() if logged_timestamps else None
+                if timestamp is None:
+                    logged_timestamps = False
+                    timestamp = index / self.fps
+                self._frames.put((index, timestamp, frame))
+                index += 1
+        finally:
+            self._frames.put(None)
+            self._proc.wait()
+            self._finished.set()
+
+    def _read_stderr(self):
+        if not self.select:
+            self.stderr = self._proc.stderr.read().decode(errors="ignore")
+            return
+        lines = []
+        try:
+            for raw_line in self._proc.stderr:
+                line = raw_line.decode(errors="ignore")
+                match = _SHOWINFO_PTS_TIME.search(line)
+                if match:
+                    self._put(self._timestamps, float(match.group(1)))
+                elif "Parsed_showinfo" not in line:
+                    lines.append(line)
+        finally:
+            # Unblocks the frame reader if ffmpeg logged fewer frames than it wrote
+            self._put(self._timestamps, None)
+            self.stderr = "".join(lines)
+
+    def write(self, chunk):
+        """Feeds the next bytes of the video (stdin mode). Once ffmpeg has given up, further data is dropped."""
+        if self._input_broken:
+            return
+        try:
+            self._proc.stdin.write(chunk)
+        except (BrokenPipeError, OSError, ValueError):
+            self._input_broken = True
+
+    def end_input(self):
+        """Signals the end of the video (stdin mode), so ffmpeg can flush its last frames."""
+        try:
+            self._proc.stdin.close()
+        except (BrokenPipeError, OSError, ValueError):
+            pass
+
+    def succeeded(self, timeout=None):
+        """Waits for ffmpeg to exit. True if it read the whole input and exited cleanly."""
+        self.start()
+        if not self._finished.wait(timeout):
+            return False
+        return self._proc.returncode == 0 and not self._input_broken
+
+    def frames(self):
+        """Yields (index, timestamp_seconds, frame) tuples; frame is a (size, size, 3) uint8 RGB array."""
+        self.start()
+        while True:
+            try:
+                item = self._frames.get(timeout=0.1)
+            except queue.Empty:
+                # close() drops the end marker if nobody was reading
+                if self._closed.is_set():
+                    break
+                continue
+            if item is None:
+                break
+            yield item
+
+    def wait_audio(self, timeout=None):
+        """Blocks until ffmpeg exits. Returns True if the audio track was written."""
+        self.start()
+        if not self._finished.wait(timeout):
+            return False
+        return bool(
+            self.audio_path
+            and self._proc.returncode == 0
+            and os.path.exists(self.audio_path)
+            and os.path.getsize(self.audio_path) > 0
+        )
+
+    def close(self):
+        self._closed.set()
+        if self._proc is None:
+            return
+        if self._proc.poll() is None:
+            self._proc.kill()
+        if self._proc.stdin is not None:
+            self.end_input()
+        for thread in self._threads:
+            thread.join()
+        self._frames.close()
@@ -1,53 +1,24 @@
 import os
 import json
 import base64
-from google import genai
+import hashlib
 from google.genai import types
 from dotenv import load_dotenv
-from PIL import Image
-import io
+from llm_client import generate_text
+from utils import (
+    encode_image_payload,
+    select_payload_frames,
+    IMAGE_PAYLOAD_MAX_EDGE,
+    IMAGE_PAYLOAD_FORMAT,
+    IMAGE_PAYLOAD_QUALITY,
+    IMAGE_PAYLOAD_MAX_FRAMES,
+)
 
 load_dotenv()
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+LISTING_MODEL = "gemini-2.0-flash"
 
-def parse_content(shortcode, request_dir):
-    caption = ""
-    caption_path = os.path.join(request_dir, "caption.txt")
-    if os.path.exists(caption_path):
-        with open(caption_path, 'r', encoding='utf-8') as f:
-            caption = f.read()
-
-    transcript = ""
-    transcript_path = os.path.join(request_dir, "transcript.txt")
-    if os.path.exists(transcript_path):
-        with open(transcript_path, 'r', encoding='utf-8') as f:
-            transcript = f.read()
-    
-    image_parts = []
-    final_images_dir = os.path.join(request_dir, "relevant_final")
-    if os.path.exists(final_images_dir):
-        image_files = sorted([f for f in os.listdir(final_images_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))])
-        for image_file in image_files:
-            image_path = os.path.join(final_images_dir, image_file)
-            try:
-                with Image.open(image_path) as img:
-                    img = img.convert("RGB")
-                    img_buffer = io.BytesIO()
-                    img.save(img_buffer, format='PNG')
-                    img_bytes = img_buffer.getvalue()
-                    image_part = types.Part.from_bytes(
-                        mime_type="image/png",
-                        data=img_bytes
-                    )
-                    image_parts.append(image_part)
-            except Exception:
-                continue
-    
-    try:
-        client = genai.Client(api_key=GEMINI_API_KEY)
-
-        static_instructions = """
+LISTING_INSTRUCTIONS = """
 You are an expert e-commerce and marketing assistant. Analyze the caption, audio transcript, and images of a social media post and return a comprehensive product listing as pure JSON.
 
 Return ONLY the JSON object, with no markdown or extra text.
@@ -79,8 +50,105 @@ Image-derived cues (when visible):
 - Extract visible labels, packaging sizes, display sizes, form factor, ports, connectors, patterns, gemstone shapes/cuts, clasp types, ring size guides, etc.
 """
 
+# Identifies the model, prompt and image payload settings behind a listing; part of its artifact cache key
+LISTING_VERSION = ":".join([
+    LISTING_MODEL,
+    hashlib.sha256(LISTING_INSTRUCTIONS.encode("utf-8")).hexdigest()[:16],
+    f"{IMAGE_PAYLOAD_FORMAT}{IMAGE_PAYLOAD_QUALITY}@{IMAGE_PAYLOAD_MAX_EDGE}x{IMAGE_PAYLOAD_MAX_FRAMES}",
+])
+
+
+class ListingStreamParser:
+    """
+    Incremental parser for the streamed listing JSON. feed() takes each chunk
+    of text and returns the top-level (key, value) pairs that completed in it,
+    so fields can be shown before the whole object has arrived. Text before the
+    opening brace (e.g. a ```json fence) is skipped.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.field_start = None
+        self.done = False
+
+    def _complete(self, text, fields):
+        try:
+            fields.extend(json.loads("{" + text + "}").items())
+        except ValueError:
+            pass
+
+    def feed(self, text):
+        self.buffer += text
+        fields = []
+        while self.pos < len(self.buffer) and not self.done:
+            ch = self.buffer[self.pos]
+            if self.field_start is None:
+                if ch == "{":
+                    self.depth = 1
+                    self.field_start = self.pos + 1
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    self._complete(self.buffer[self.field_start:self.pos], fields)
+                    self.done = True
+            elif ch == "," and self.depth == 1:
+                self._complete(self.buffer[self.field_start:self.pos], fields)
+                self.field_start = self.pos + 1
+            self.pos += 1
+        return fields
+
+
+def parse_content(shortcode, request_dir, on_field=None):
+    """
+    Generates the listing for a post from its caption, transcript and selected
+    frames. on_field(key, value) is called for each top-level field as soon as
+    it has streamed in; the complete listing is returned at the end.
+    """
+    caption = ""
+    caption_path = os.path.join(request_dir, "caption.txt")
+    if os.path.exists(caption_path):
+        with open(caption_path, 'r', encoding='utf-8') as f:
+            caption = f.read()
+
+    transcript = ""
+    transcript_path = os.path.join(request_dir, "transcript.txt")
+    if os.path.exists(transcript_path):
+        with open(transcript_path, 'r', encoding='utf-8') as f:
+            transcript = f.read()
+    
+    image_parts = []
+    final_images_dir = os.path.join(request_dir, "relevant_final")
+    if os.path.exists(final_images_dir):
+        image_files = sorted([f for f in os.listdir(final_images_dir) if f.lower().endswith(('.png', '.jpg', '.jpeg'))])
+        image_paths = select_payload_frames([os.path.join(final_images_dir, f) for f in image_files])
+        for image_path in image_paths:
+            encoded = encode_image_payload(image_path)
+            if encoded is None:
+                continue
+            mime_type, img_bytes = encoded
+            image_parts.append(types.Part.from_bytes(mime_type=mime_type, data=img_bytes))
+    
+    try:
         prompt_text = (
-            static_instructions
+            LISTING_INSTRUCTIONS
             + "\n\nPost Caption:\n" + (caption or "")
             + "\n\nAudio Transcript:\n" + (transcript or "")
         )
@@ -92,16 +160,16 @@ Image-derived cues (when visible):
 
         contents = [types.Content(role="user", parts=content_parts)]
 
-        generate_content_config = types.GenerateContentConfig()
+        on_chunk = on_restart = None
+        if on_field is not None:
+            parser = ListingStreamParser()
+            on_restart = parser.reset
+
+            def on_chunk(text):
+                for key, value in parser.feed(text):
+                    on_field(key, value)
 
-        full_response = ""
-        for chunk in client.models.generate_content_stream(
-            model="gemini-2.0-flash",
-            contents=contents,
-            config=generate_content_config,
-        ):
-            if chunk.text:
-                full_response += chunk.text
+        full_response = generate_text(LISTING_MODEL, contents, on_chunk=on_chunk, on_restart=on_restart)
         
         generated_text = full_response.strip()
         if generated_text.startswith("```json"):
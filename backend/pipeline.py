@@ -0,0 +1,643 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import threading
+from datetime import datetime, timedelta
+
+from video_caption_grabber import grab_post
+from separate_frames import (
+    video_to_frames,
+    open_media_ingest,
+    open_streamed_ingest,
+    FRAME_EXTRACTION_MODE,
+    STREAMING_INGEST,
+)
+from classify_frames import classify_and_move_images, classify_video_stream, classifier_version, SCORES_FILENAME
+from parse_gemini import parse_content, LISTING_VERSION
+from transcribe_video import transcribe_video, TRANSCRIBE_VERSION
+from media_ingest import FaststartGate
+from workers import native, run_blocking, run_blocking_streamed
+from result_cache import create_result_cache
+from expiry import create_expiry_registry, remaining_seconds
+from artifact_cache import ArtifactCache, ARTIFACT_CACHE_ENABLED, file_sha256, text_sha256
+import checkpoints
+
+# Base directory for all temporary processing. Web and worker processes must share it.
+TEMP_PROCESSING_DIR = os.getenv("TEMP_PROCESSING_DIR", "temp_processing")
+# How long to keep generated artifacts accessible to the frontend
+DATA_TTL_SECONDS = 600  # 10 minutes
+os.makedirs(TEMP_PROCESSING_DIR, exist_ok=True)
+# Maps shortcode -> finished request_id for reuse
+result_cache = create_result_cache(os.path.join(TEMP_PROCESSING_DIR, "result_cache.sqlite3"))
+# Maps shortcode -> request_id of a failed run whose completed stages a retry resumes from
+resume_index = create_result_cache(os.path.join(TEMP_PROCESSING_DIR, "resume_index.sqlite3"), prefix="socialkart:resume")
+# Records when each finished request's directory may be deleted
+expiry_registry = create_expiry_registry(os.path.join(TEMP_PROCESSING_DIR, "expiry.sqlite3"))
+# Stage outputs by content hash, reused across shortcodes and after the result TTL
+artifact_cache = ArtifactCache() if ARTIFACT_CACHE_ENABLED else None
+
+
+def cleanup_request_dir(request_dir):
+    try:
+        if os.path.exists(request_dir):
+            shutil.rmtree(request_dir)
+    except Exception:
+        pass
+
+
+def remaining_ttl_seconds(request_id):
+    """Seconds until a request directory expires."""
+    remain = remaining_seconds(expiry_registry, request_id)
+    if remain is not None:
+        return remain
+    # Directories that were never registered fall back to their own mtime
+    try:
+        spent = time.time() - os.path.getmtime(os.path.join(TEMP_PROCESSING_DIR, request_id))
+    except Exception:
+        return 0
+    return int(max(0, DATA_TTL_SECONDS - spent))
+
+
+def open_request_dir(shortcode):
+    """
+    Creates the directory for a new run of a post and returns (request_id,
+    request_dir). A retry of a failed run resumes in that run's directory,
+    from its last completed stage.
+    """
+    resumable = resume_index.get(shortcode)
+    if resumable and os.path.isdir(os.path.join(TEMP_PROCESSING_DIR, resumable["request_id"])):
+        request_id = resumable["request_id"]
+        resume_index.delete(shortcode)
+        expiry_registry.forget(request_id)
+    else:
+        request_id = str(uuid.uuid4())
+    request_dir = os.path.join(TEMP_PROCESSING_DIR, request_id)
+    os.makedirs(request_dir, exist_ok=True)
+    return request_id, request_dir
+
+
+def cached_result(shortcode):
+    """The result payload of an earlier, still unexpired run of the same post, or None."""
+    entry = result_cache.get(shortcode)
+    if not entry:
+        return None
+    request_id = entry.get("request_id")
+    if not request_id:
+        return None
+    request_dir = os.path.join(TEMP_PROCESSING_DIR, request_id)
+    result_path = os.path.join(request_dir, "result.json")
+    final_images_dir = os.path.join(request_dir, "relevant_final")
+    if not (os.path.exists(result_path) and os.path.isdir(final_images_dir)):
+        return None
+
+    remaining = remaining_ttl_seconds(request_id)
+    if remaining <= 0:
+        return None
+
+    try:
+        with open(result_path, 'r', encoding='utf-8') as f:
+            structured_content = json.load(f)
+    except Exception:
+        return None
+
+    image_files = sorted(os.listdir(final_images_dir))
+    expiration_time = datetime.utcnow() + timedelta(seconds=remaining)
+    return {
+        'structured_content': structured_content,
+        'images': [f"/image/{request_id}/{filename}" for filename in image_files[:30]],
+        'request_id': request_id,
+        'expiration_timestamp': expiration_time.isoformat() + 'Z',
+        'expires_in_seconds': remaining
+    }
+
+
+def placeholder_result(caption_text, transcript_text):
+    base_desc = caption_text or transcript_text or ""
+    return {
+        "product_name": "Generated Listing",
+        "description": base_desc,
+        "key_features": [],
+        "target_audience": "",
+        "seo_keywords": [],
+        "technical_details": {},
+        "technical_details_schema": {"category": "", "properties": {}}
+    }
+
+
+def _read_text(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except Exception:
+        return ""
+
+
+class PostJob:
+    """
+    Runs the grab -> frames -> classify -> transcribe -> parse pipeline for one
+    Instagram post. Events go out through emit(event, payload), so the same job
+    runs inside the Socket.IO process or in a separate worker process.
+    is_canceled() is polled between stages.
+    """
+
+    def __init__(self, shortcode, request_id, request_dir, emit, is_canceled=None):
+        self.shortcode = shortcode
+        self.request_id = request_id
+        self.request_dir = request_dir
+        self.emit = emit
+        self.is_canceled = is_canceled or (lambda: False)
+        self._progress = 0
+        self._progress_lock = threading.Lock()
+        self._partial_fields = {}
+        self._keys = {}
+
+    def progress(self, message, progress, branch=None):
+        """
+        Emits a progress event. The vision and audio branches report concurrently,
+        so the overall percentage only moves forward; `branch` names the reporter.
+        """
+        with self._progress_lock:
+            self._progress = max(self._progress, progress)
+            payload = {'data': message, 'progress': self._progress}
+        if branch:
+            payload['branch'] = branch
+        self.emit('progress', payload)
+
+    def _emit_caption(self):
+        caption_path = os.path.join(self.request_dir, 'caption.txt')
+        if os.path.exists(caption_path):
+            self.emit('caption_update', {'caption': _read_text(caption_path)})
+
+    def _post_images(self):
+        return sorted(
+            f for f in os.listdir(self.request_dir)
+            if f.lower().endswith(('.jpg', '.jpeg', '.png', '.webp'))
+        )
+
+    def _media_hash(self, video_path):
+        """SHA-256 of the downloaded media: video.mp4, or the post's images for photo posts."""
+        if video_path:
+            return file_sha256(video_path)
+        images = self._post_images()
+        if not images:
+            return None
+        return ArtifactCache.key("images", *(file_sha256(os.path.join(self.request_dir, f)) for f in images))
+
+    def _stage_keys(self, video_path):
+        """Artifact cache keys for the frames and transcript stages (None when caching is off)."""
+        if artifact_cache is None:
+            return None, None, None
+        # Hashing the media once per run is enough
+        if video_path not in self._keys:
+            self._keys[video_path] = self._compute_stage_keys(video_path)
+        return self._keys[video_path]
+
+    def _compute_stage_keys(self, video_path):
+        media_hash = self._media_hash(video_path)
+        if not media_hash or not video_path:
+            return media_hash, None, None
+        frames_key = ArtifactCache.key("frames", media_hash, classifier_version())
+        transcript_key = ArtifactCache.key("transcript", media_hash, TRANSCRIBE_VERSION)
+        return media_hash, frames_key, transcript_key
+
+    def _listing_key(self, media_hash, frames_key):
+        """The listing depends on the selected frames and on the caption and transcript text."""
+        if artifact_cache is None or not media_hash:
+            return None
+        return ArtifactCache.key(
+            "listing",
+            frames_key or media_hash,
+            text_sha256(_read_text(os.path.join(self.request_dir, 'caption.txt'))),
+            text_sha256(_read_text(os.path.join(self.request_dir, 'transcript.txt'))),
+            LISTING_VERSION,
+        )
+
+    def _restore_stage(self, key):
+        """Copies a cached stage output into the request directory. Returns its files, or None on a miss."""
+        if artifact_cache is None or key is None:
+            return None
+        try:
+            return run_blocking(artifact_cache.restore, key, self.request_dir)
+        except Exception as e:
+            print(f"Artifact cache lookup failed: {e}")
+            return None
+
+    def _store_stage(self, key, stage, rel_paths):
+        if artifact_cache is None or key is None:
+            return
+        try:
+            run_blocking(artifact_cache.store, key, stage, self.request_dir, rel_paths)
+        except Exception as e:
+            print(f"Failed to cache {stage} output: {e}")
+
+    def _stage_done(self, stage, key=None):
+        """
+        True if the stage already completed in this request directory (a resumed
+        run) or its output could be restored from the artifact cache.
+        """
+        if checkpoints.completed(self.request_dir, stage) is not None:
+            print(f"Resuming after completed stage: {stage}")
+            return True
+        restored = self._restore_stage(key)
+        if restored is None:
+            return False
+        print(f"Reusing cached output for stage: {stage}")
+        checkpoints.mark_complete(self.request_dir, stage, restored)
+        return True
+
+    def _complete_stage(self, stage, key, rel_paths):
+        """Checkpoints a freshly run stage and shares its outputs through the artifact cache."""
+        checkpoints.mark_complete(self.request_dir, stage, rel_paths)
+        self._store_stage(key, stage, rel_paths)
+
+    def _frame_outputs(self):
+        final_images_dir = os.path.join(self.request_dir, "relevant_final")
+        outputs = [SCORES_FILENAME]
+        if os.path.isdir(final_images_dir):
+            outputs += [os.path.join("relevant_final", f) for f in sorted(os.listdir(final_images_dir))]
+        return outputs
+
+    def _download(self, video_sink=None):
+        """
+        Fetches the post unless an earlier run of this request already did. Returns post_info.
+        video_sink is passed on to grab_post.
+        """
+        manifest = checkpoints.completed(self.request_dir, "download")
+        if manifest is not None:
+            print("Resuming with previously downloaded media")
+            self.progress('Reusing downloaded media and caption...', 20)
+            return manifest["post_info"]
+
+        self.progress('Downloading media and caption...', 20)
+        post_info = run_blocking(grab_post, self.shortcode, self.request_dir, video_sink)
+        if not post_info:
+            raise Exception("Failed to get post information")
+        outputs = ['caption.txt']
+        if post_info.get('video_path'):
+            outputs.append(os.path.relpath(post_info['video_path'], self.request_dir))
+        else:
+            outputs += self._post_images()
+        checkpoints.mark_complete(self.request_dir, "download", outputs, post_info=post_info)
+        return post_info
+
+    def _streams_during_download(self):
+        return (
+            FRAME_EXTRACTION_MODE == "stream"
+            and STREAMING_INGEST
+            and checkpoints.completed(self.request_dir, "download") is None
+        )
+
+    def _download_streaming(self):
+        """
+        _download() that classifies a video post's frames while the video is
+        still arriving: grab_post tees the download into a stdin MediaIngest
+        whose frames a worker thread scores meanwhile. Returns (post_info,
+        wait_streamed, ingest); wait_streamed() blocks until that classification ends
+        and returns True if it wrote relevant_final/, or is None when nothing
+        was streamed (not a video post, or a video whose moov box follows its
+        data, which ffmpeg cannot decode from a pipe) or when the finished download's frames
+        were already done (checkpoint or artifact cache); the streamed pass is
+        then dropped without writing anything. ingest is the streamed ingest,
+        which also writes the audio track for the audio branch, or None.
+        """
+        _threading = native("threading")
+        sink_opened = _threading.Event()
+        download_done = _threading.Event()
+        state = {}
+        video_path = os.path.join(self.request_dir, "video.mp4")
+
+        def on_decided(ingest):
+            state["ingest"] = ingest
+            sink_opened.set()
+
+        def open_sink(post):
+            # A retry with another session must not feed the same ingest twice
+            if "sink" in state:
+                return None
+
+            def open_ingest(info):
+                # The moov box at the head of the file tells whether there is audio to write
+                has_audio = bool(info and info["has_audio"])
+                return open_streamed_ingest(
+                    post.get("video_duration") or (info or {}).get("duration"),
+                    audio_path=os.path.join(self.request_dir, "audio.mp3") if has_audio else None,
+                    has_audio=has_audio,
+                )
+
+            # Only faststart files are streamed; the gate opens the ingest once it knows
+            state["sink"] = FaststartGate(open_ingest, on_decided)
+            return state["sink"]
+
+        def ready():
+            download_done.wait()
+            return bool(state.get("downloaded")) and not state.get("reused") and state["ingest"].succeeded()
+
+        def classify():
+            sink_opened.wait()
+            ingest = state.get("ingest")
+            if ingest is None:
+                return False
+            try:
+                return classify_video_stream(
+                    self.shortcode, self.request_dir, video_path, frames=ingest.frames(), ready=ready,
+                )
+            finally:
+                ingest.close()
+
+        def vision_task():
+            try:
+                state["streamed"] = run_blocking(classify)
+            except Exception as e:
+                print(f"Classifying the video while downloading failed: {e}")
+
+        task = threading.Thread(target=vision_task, daemon=True)
+        task.start()
+        try:
+            post_info = self._download(video_sink=open_sink)
+            state["downloaded"] = True
+            if state.get("ingest") is not None and post_info.get('video_path'):
+                _, frames_key, _ = run_blocking(self._stage_keys, post_info['video_path'])
+                if self._stage_done("frames", frames_key):
+                    # Stop sampling; ready() tells the streamed pass not to write
+                    state["reused"] = True
+                    run_blocking(state["ingest"].close)
+        finally:
+            sink_opened.set()
+            download_done.set()
+            if state.get("ingest") is None:
+                task.join()
+
+        if state.get("ingest") is None:
+            return post_info, None, None
+        if state.get("reused"):
+            task.join()
+            return post_info, None, None
+        self.progress('Extracting and classifying frames...', 40, branch='vision')
+
+        def wait_streamed():
+            task.join()
+            return bool(state.get("streamed"))
+
+        return post_info, wait_streamed, state["ingest"]
+
+    def _vision_branch(self, video_path, ingest, frames_key=None, done=False, wait_streamed=None):
+        """
+        Samples and classifies frames, leaving the selected ones in relevant_final/.
+        wait_streamed is _download_streaming's handle on a classification that
+        ran during the download; if it failed, the finished file is classified.
+        """
+        streamed = wait_streamed is not None and wait_streamed()
+        if done:
+            print("Frame selection already available")
+        elif streamed:
+            print("Frames classified while the video downloaded")
+        elif wait_streamed is not None:
+            print("Streamed classification unusable; classifying the downloaded file")
+            run_blocking(classify_video_stream, self.shortcode, self.request_dir, video_path)
+            print("Frame classification completed")
+        elif ingest is not None:
+            self.progress('Extracting and classifying frames...', 40, branch='vision')
+            run_blocking(classify_video_stream, self.shortcode, self.request_dir, video_path, frames=ingest.frames())
+            print("Frame classification completed")
+        else:
+            self.progress('Separating frames from video...', 40, branch='vision')
+            frames_output_dir = os.path.join(self.request_dir, "frames")
+            run_blocking(video_to_frames, video_path, frames_output_dir, self.shortcode)
+            print("Frame separation completed")
+            # Notify frontend that frame separation has completed
+            self.progress('Frames separated successfully', 50, branch='vision')
+
+            if self.is_canceled():
+                return
+
+            self.progress('Classifying frames and selecting the best ones...', 60, branch='vision')
+            run_blocking(classify_and_move_images, self.shortcode, self.request_dir, frames_output_dir, video_path)
+            print("Frame classification completed")
+        if not done:
+            self._complete_stage("frames", frames_key, self._frame_outputs())
+        # Notify frontend that classification has completed
+        self.progress('Frame classification completed', 70, branch='vision')
+        # Optionally emit the original caption after classification so UI can show/update it
+        try:
+            self._emit_caption()
+        except Exception:
+            pass
+
+    def _audio_branch(self, video_path, ingest, transcript_key=None, done=False):
+        """Transcribes the audio track into transcript.txt, using the ingest's audio when available."""
+        if done:
+            transcript = _read_text(os.path.join(self.request_dir, 'transcript.txt'))
+            if transcript:
+                self._emit_transcript(transcript)
+            self.progress('Audio transcription completed', 45, branch='audio')
+            return
+        try:
+            print("Starting audio transcription")
+            self.progress('Extracting and transcribing audio...', 30, branch='audio')
+            extracted_audio = None
+            if ingest is not None and run_blocking(ingest.wait_audio):
+                extracted_audio = ingest.audio_path
+            if self.is_canceled():
+                return
+            transcript = run_blocking_streamed(
+                lambda publish: transcribe_video(video_path, self.request_dir, audio_path=extracted_audio, on_text=publish),
+                self._emit_transcript,
+            )
+            print("Audio transcription completed")
+            # Failed transcriptions stay incomplete and are retried next time;
+            # "no speech" is a result and is kept like any transcript
+            if transcript is not None:
+                self._complete_stage("transcript", transcript_key, ['transcript.txt'])
+            self.progress('Audio transcription completed', 45, branch='audio')
+        except Exception as e:
+            print(f"Error in audio branch: {e}")
+
+    def _parse(self, listing_key):
+        """
+        Produces the listing and writes result.json. Returns (listing, complete);
+        fallback listings are returned but left incomplete so a retry regenerates them.
+        """
+        request_dir = self.request_dir
+        result_path = os.path.join(request_dir, 'result.json')
+        if self._stage_done("listing", listing_key):
+            try:
+                with open(result_path, 'r') as f:
+                    return json.load(f), True
+            except Exception:
+                checkpoints.invalidate(request_dir, "listing")
+
+        fallback = placeholder_result(
+            _read_text(os.path.join(request_dir, 'caption.txt')),
+            _read_text(os.path.join(request_dir, 'transcript.txt')),
+        )
+        try:
+            parsed_content = run_blocking_streamed(
+                lambda publish: parse_content(self.shortcode, request_dir, on_field=lambda key, value: publish((key, value))),
+                self._emit_partial,
+            )
+            print("Gemini parsing completed successfully")
+        except Exception as e:
+            print(f"Error in parse_content: {e}")
+            # Create fallback content
+            parsed_content = fallback
+            print("Using fallback content due to Gemini error")
+
+        with open(result_path, 'w') as f:
+            json.dump(parsed_content, f)
+        complete = isinstance(parsed_content, dict) and "error" not in parsed_content and parsed_content != fallback
+        if complete:
+            self._complete_stage("listing", listing_key, ['result.json'])
+        return parsed_content, complete
+
+    def _emit_transcript(self, transcript):
+        """Forwards the transcript as it streams in."""
+        self.emit('transcript_update', {'request_id': self.request_id, 'transcript': transcript})
+
+    def _emit_partial(self, field):
+        """Forwards a listing field as soon as it has streamed in; the final `result` event is unchanged."""
+        key, value = field
+        self._partial_fields[key] = value
+        self.emit('partial_result', {
+            'request_id': self.request_id,
+            'field': key,
+            'value': value,
+            'fields': dict(self._partial_fields),
+        })
+
+    def _keep_for_retry(self):
+        """Leaves the request directory for a retry of the same shortcode to resume from, until it expires."""
+        try:
+            resume_index.put(self.shortcode, self.request_id, DATA_TTL_SECONDS)
+            expiry_registry.register(self.request_id, time.time() + DATA_TTL_SECONDS)
+        except Exception as e:
+            print(f"Failed to register request for retry: {e}")
+
+    def _result_payload(self, structured_content, images):
+        expiration_time = datetime.utcnow() + timedelta(seconds=DATA_TTL_SECONDS)
+        return {
+            'structured_content': structured_content,
+            'images': images,
+            'request_id': self.request_id,
+            'expiration_timestamp': expiration_time.isoformat() + 'Z',
+            'expires_in_seconds': DATA_TTL_SECONDS
+        }
+
+    def run(self):
+        """
+        Runs the pipeline to completion. Returns the result payload, or None if
+        canceled; after an error it is a placeholder listing with "failed" set.
+        Stages that completed in an earlier run of the same request directory
+        are skipped, so a retry resumes at the first incomplete one.
+        """
+        request_dir = self.request_dir
+        try:
+            print(f"Starting processing for request: {self.request_id}, shortcode: {self.shortcode}")
+            wait_streamed = streamed_ingest = None
+            if self._streams_during_download():
+                post_info, wait_streamed, streamed_ingest = self._download_streaming()
+            else:
+                post_info = self._download()
+            print(f"Post info retrieved: {post_info}")
+
+            # Emit the freshly downloaded original caption as early as possible
+            try:
+                self._emit_caption()
+            except Exception:
+                pass
+
+            video_path = post_info.get('video_path')
+
+            # If client disconnected in between, stop early and cleanup
+            if self.is_canceled():
+                if wait_streamed is not None:
+                    # Let the classification that read the download stop writing first
+                    wait_streamed()
+                cleanup_request_dir(request_dir)
+                return None
+
+            media_hash, frames_key, transcript_key = run_blocking(self._stage_keys, video_path)
+
+            if video_path:
+                print(f"Processing video: {video_path}")
+                # Stages finished by an earlier attempt, or on the same video under any shortcode, are skipped.
+                # With a streamed download the frames cache was already checked right after it.
+                frames_done = wait_streamed is None and self._stage_done("frames", frames_key)
+                transcript_done = self._stage_done("transcript", transcript_key)
+                ingest = None
+                if FRAME_EXTRACTION_MODE == "stream" and not frames_done and wait_streamed is None:
+                    # One ffmpeg pass produces both the classifier frames and the audio track
+                    audio_path = None if transcript_done else os.path.join(request_dir, "audio.mp3")
+                    ingest = run_blocking(open_media_ingest, video_path, audio_path=audio_path)
+                # Transcription only depends on the video, so it runs alongside frame
+                # extraction and classification; parsing waits for both branches.
+                audio_task = threading.Thread(
+                    target=self._audio_branch,
+                    args=(video_path, ingest if ingest is not None else streamed_ingest, transcript_key, transcript_done),
+                    daemon=True,
+                )
+                audio_task.start()
+                try:
+                    self._vision_branch(video_path, ingest, frames_key, frames_done, wait_streamed)
+                finally:
+                    audio_task.join()
+                    if ingest is not None:
+                        run_blocking(ingest.close)
+
+            if self.is_canceled():
+                cleanup_request_dir(request_dir)
+                return None
+
+            print("Starting Gemini parsing")
+            self.progress('Generating final listing with AI...', 95)
+            parsed_content, complete = self._parse(self._listing_key(media_hash, frames_key))
+            # Ensure caption.txt exists even if Instaloader changes behavior
+            caption_path = os.path.join(request_dir, 'caption.txt')
+            if not os.path.exists(caption_path):
+                try:
+                    with open(caption_path, 'w', encoding='utf-8') as cf:
+                        cf.write("")
+                except Exception:
+                    pass
+
+            if complete:
+                # Index the result for cache reuse and schedule its directory for deletion
+                result_cache.put(self.shortcode, self.request_id, DATA_TTL_SECONDS)
+                resume_index.delete(self.shortcode)
+                expiry_registry.register(self.request_id, time.time() + DATA_TTL_SECONDS)
+            else:
+                self._keep_for_retry()
+
+            final_images_dir = os.path.join(request_dir, "relevant_final")
+            final_images = []
+            if os.path.exists(final_images_dir):
+                final_images = [f"/image/{self.request_id}/{f}" for f in sorted(os.listdir(final_images_dir))[:30]]
+
+            print(f"Emitting final result for request: {self.request_id}")
+            result = self._result_payload(parsed_content, final_images)
+            self.emit('result', result)
+            print(f"Processing completed successfully for request: {self.request_id}")
+            return result
+
+        except Exception as e:
+            print(f"Error while processing request {self.request_id}: {e}")
+            # Completed stages stay on disk; a retry of this shortcode resumes from them
+            self._keep_for_retry()
+            # Send placeholder result instead of raw error
+            try:
+                result = self._result_payload(
+                    placeholder_result(
+                        _read_text(os.path.join(request_dir, 'caption.txt')),
+                        _read_text(os.path.join(request_dir, 'transcript.txt')),
+                    ),
+                    [],
+                )
+                # Marks the placeholder for callers that must not mistake it for a listing
+                result['failed'] = True
+                result['error'] = str(e)
+                self.emit('result', result)
+                return result
+            except Exception:
+                self.emit('error', {'error': str(e)})
+                return None
@@ -0,0 +1,180 @@
+import os
+import json
+import time
+import threading
+
+from storage import REDIS_URL, SQLiteFile, create_backend
+
+# How long a post's metadata is reused. Media URLs in it are signed and expire
+# after some hours, so keep this well below that.
+POST_METADATA_TTL_SECONDS = int(os.getenv("POST_METADATA_TTL_SECONDS", "3600"))
+# How long a missing, private or otherwise unavailable post is remembered
+POST_METADATA_NEGATIVE_TTL_SECONDS = int(os.getenv("POST_METADATA_NEGATIVE_TTL_SECONDS", "600"))
+
+
+class PostUnavailable(Exception):
+    """The post does not exist or cannot be seen (possibly remembered from an earlier lookup)."""
+
+
+def _optional(read):
+    try:
+        return read()
+    except Exception:
+        return None
+
+
+def post_metadata(post):
+    """
+    Plain, JSON-serialisable summary of an instaloader Post: everything the
+    pipeline and product search read, so a cached copy can stand in for the Post.
+    """
+    metadata = {
+        "shortcode": post.shortcode,
+        "typename": post.typename,
+        "caption": post.caption or "",
+        "is_video": post.is_video,
+        "display_url": post.url,
+        "video_url": post.video_url if post.is_video else None,
+        "video_duration": _optional(lambda: post.video_duration) if post.is_video else None,
+        "likes": _optional(lambda: post.likes) or 0,
+        "owner": _optional(lambda: post.owner_username),
+        "sidecar": [],
+    }
+    if post.typename == "GraphSidecar":
+        metadata["sidecar"] = [
+            {"is_video": node.is_video, "display_url": node.display_url, "video_url": node.video_url}
+            for node in post.get_sidecar_nodes()
+        ]
+    return metadata
+
+
+class _MemoryStore:
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] <= time.time():
+                self._entries.pop(key, None)
+                return None
+            return entry[0]
+
+    def set(self, key, value, ttl_seconds):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl_seconds)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def evict_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if entry[1] <= now]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+
+class _SQLiteStore:
+    def __init__(self, path):
+        self.db = SQLiteFile(path, [
+            "CREATE TABLE IF NOT EXISTS posts ("
+            " shortcode TEXT PRIMARY KEY,"
+            " entry TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS posts_expires_at ON posts (expires_at)",
+        ])
+
+    def get(self, key):
+        with self.db.connect() as conn:
+            row = conn.execute(
+                "SELECT entry FROM posts WHERE shortcode = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl_seconds):
+        with self.db.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO posts (shortcode, entry, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ttl_seconds),
+            )
+
+    def delete(self, key):
+        with self.db.connect() as conn:
+            conn.execute("DELETE FROM posts WHERE shortcode = ?", (key,))
+
+    def evict_expired(self):
+        with self.db.connect() as conn:
+            return conn.execute("DELETE FROM posts WHERE expires_at <= ?", (time.time(),)).rowcount
+
+
+class _RedisStore:
+    def __init__(self, url=REDIS_URL, prefix="socialkart"):
+        import redis
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+
+    def _key(self, key):
+        return f"{self.prefix}:post:{key}"
+
+    def get(self, key):
+        return self.redis.get(self._key(key))
+
+    def set(self, key, value, ttl_seconds):
+        self.redis.set(self._key(key), value, ex=max(1, int(ttl_seconds)))
+
+    def delete(self, key):
+        self.redis.delete(self._key(key))
+
+    def evict_expired(self):
+        # Keys expire on their own
+        return 0
+
+
+class PostMetadataCache:
+    """
+    post_metadata() summaries by shortcode, so retries, repeated requests and
+    product search do not spend Instagram requests on posts already looked up.
+    Unavailable posts are remembered too, for a shorter time.
+    """
+
+    def __init__(self, store, ttl_seconds=POST_METADATA_TTL_SECONDS,
+                 negative_ttl_seconds=POST_METADATA_NEGATIVE_TTL_SECONDS):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+
+    def get(self, shortcode):
+        """Cached metadata, or None on a miss. Raises PostUnavailable for a remembered failure."""
+        raw = self.store.get(shortcode)
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        if "unavailable" in entry:
+            raise PostUnavailable(entry["unavailable"])
+        return entry["metadata"]
+
+    def put(self, shortcode, metadata):
+        self.store.set(shortcode, json.dumps({"metadata": metadata}), self.ttl_seconds)
+
+    def put_unavailable(self, shortcode, reason):
+        self.store.set(shortcode, json.dumps({"unavailable": str(reason)}), self.negative_ttl_seconds)
+
+    def delete(self, shortcode):
+        self.store.delete(shortcode)
+
+    def evict_expired(self):
+        return self.store.evict_expired()
+
+
+def create_post_metadata_cache(sqlite_path, prefix="socialkart"):
+    """Builds the cache on the backend selected by RESULT_CACHE_BACKEND."""
+    return PostMetadataCache(create_backend(
+        memory=_MemoryStore,
+        sqlite=lambda: _SQLiteStore(sqlite_path),
+        redis=lambda: _RedisStore(prefix=prefix),
+    ))
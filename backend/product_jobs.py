@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import uuid
+import threading
+
+from job_queue import JOB_BACKEND, REDIS_URL, JOB_KEY_PREFIX
+from pipeline import PostJob, cached_result, open_request_dir
+from video_caption_grabber import find_best_product_post
+from workers import run_blocking
+
+# How long a product job's progress and result stay queryable
+PRODUCT_JOB_TTL_SECONDS = int(os.getenv("PRODUCT_JOB_TTL_SECONDS", "86400"))
+# Most product names accepted in one batch
+PRODUCT_BATCH_MAX_SIZE = int(os.getenv("PRODUCT_BATCH_MAX_SIZE", "50"))
+# Share of a product job's progress taken by the post search; the pipeline fills the rest
+SEARCH_PROGRESS = 20
+
+
+class MemoryProductJobStore:
+    """In-process stand-in for RedisProductJobStore, for tests and single-box setups."""
+
+    def __init__(self):
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def update(self, key, fields, ttl_seconds=PRODUCT_JOB_TTL_SECONDS):
+        now = time.time()
+        with self._lock:
+            entry = self._hashes.get(key)
+            values = entry[0] if entry is not None and entry[1] > now else {}
+            # Same types as a Redis hash: every field is a string
+            values.update({name: str(value) for name, value in fields.items()})
+            self._hashes[key] = (values, now + ttl_seconds)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._hashes.get(key)
+            if entry is None or entry[1] <= time.time():
+                self._hashes.pop(key, None)
+                return {}
+            return dict(entry[0])
+
+
+class RedisProductJobStore:
+    """Product job state as Redis hashes, readable by the web process and every worker."""
+
+    def __init__(self, url=REDIS_URL, prefix=JOB_KEY_PREFIX):
+        import redis
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+
+    def _key(self, key):
+        return f"{self.prefix}:{key}"
+
+    def update(self, key, fields, ttl_seconds=PRODUCT_JOB_TTL_SECONDS):
+        pipe = self.redis.pipeline()
+        pipe.hset(self._key(key), mapping={name: str(value) for name, value in fields.items()})
+        pipe.expire(self._key(key), ttl_seconds)
+        pipe.execute()
+
+    def get(self, key):
+        return self.redis.hgetall(self._key(key))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_product_job_store():
+    """Returns the process-wide product job store: Redis with JOB_BACKEND=redis, else in memory."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = RedisProductJobStore() if JOB_BACKEND == "redis" else MemoryProductJobStore()
+        return _store
+
+
+def _job_key(job_id):
+    return f"product_job:{job_id}"
+
+
+def _batch_key(batch_id):
+    return f"product_batch:{batch_id}"
+
+
+def create_product_job(store, product_name):
+    """Records a queued job for a product name and returns its id."""
+    job_id = str(uuid.uuid4())
+    store.update(_job_key(job_id), {
+        "job_id": job_id,
+        "product_name": product_name,
+        "status": "queued",
+        "progress": 0,
+        "current_step": "Waiting for a free worker...",
+        "error": "",
+        "created_at": time.time(),
+    })
+    return job_id
+
+
+def create_product_batch(store, job_ids):
+    batch_id = str(uuid.uuid4())
+    store.update(_batch_key(batch_id), {"batch_id": batch_id, "job_ids": json.dumps(job_ids)})
+    return batch_id
+
+
+def product_job_status(store, job_id):
+    """The job's state with progress as a number and the result decoded, or None if unknown or expired."""
+    fields = store.get(_job_key(job_id))
+    if not fields:
+        return None
+    status = dict(fields)
+    status["progress"] = int(float(status.get("progress") or 0))
+    if "result" in status:
+        status["result"] = json.loads(status["result"])
+    return status
+
+
+def product_batch_status(store, batch_id):
+    fields = store.get(_batch_key(batch_id))
+    if not fields:
+        return None
+    jobs = []
+    for job_id in json.loads(fields["job_ids"]):
+        status = product_job_status(store, job_id)
+        jobs.append(status if status is not None else {"job_id": job_id, "status": "expired"})
+    return {
+        "batch_id": batch_id,
+        "done": sum(1 for job in jobs if job.get("status") in ("done", "failed", "expired")),
+        "total": len(jobs),
+        "jobs": jobs,
+    }
+
+
+class ProductJob:
+    """
+    Finds the most liked relevant sponsored post for a product name and runs
+    the full PostJob pipeline on it, reusing the result of an earlier run of
+    the same post while it is cached. Progress and the result are written to
+    the product job store instead of being emitted.
+
+    process_post(job, shortcode) hands the post to the host instead of
+    running it here: the web process joins it with socket requests for the
+    same post (see app.py), and reports back through on_event() and finish().
+    """
+
+    def __init__(self, job_id, product_name, store, process_post=None):
+        self.job_id = job_id
+        self.product_name = product_name
+        self.store = store
+        self.process_post = process_post
+        self._error = None
+
+    def _update(self, **fields):
+        self.store.update(_job_key(self.job_id), fields)
+
+    def attach(self, request_id):
+        """Records the pipeline run (request_id) processing the job's post."""
+        self._update(request_id=request_id)
+
+    def fail(self, error):
+        print(f"Product job {self.job_id} ({self.product_name}) failed: {error}")
+        self._update(status="failed", error=error, current_step="Failed")
+
+    def on_event(self, event, payload):
+        """PostJob events, folded into the job's hash."""
+        if event == 'progress':
+            progress = SEARCH_PROGRESS + int(payload.get('progress', 0)) * (100 - SEARCH_PROGRESS) // 100
+            self._update(progress=progress, current_step=payload.get('data', ''))
+        elif event == 'error':
+            self._error = payload.get('error')
+
+    def finish(self, result):
+        """Records the post's result payload; a missing or failed one fails the job."""
+        if result is None or result.get("failed"):
+            self.fail((result or {}).get("error") or self._error or "Processing failed")
+            return None
+        self._update(
+            status="done",
+            progress=100,
+            current_step="Processing complete!",
+            request_id=result["request_id"],
+            result=json.dumps(result),
+        )
+        return result
+
+    def run(self):
+        """
+        Runs the job. Returns the pipeline's result payload, or None on failure
+        or when the post was handed to process_post.
+        """
+        self._update(status="searching", progress=5, current_step="Searching for product posts...")
+        try:
+            # The search blocks on real threads; keep the hub free meanwhile
+            post = run_blocking(find_best_product_post, self.product_name)
+        except Exception as e:
+            self.fail(f"Error searching for product posts: {e}")
+            return None
+        if post is None:
+            self.fail("No relevant sponsored posts found")
+            return None
+
+        shortcode = post["shortcode"]
+        self._update(
+            status="processing",
+            shortcode=shortcode,
+            progress=SEARCH_PROGRESS,
+            current_step=f"Processing post {shortcode}...",
+        )
+        result = cached_result(shortcode)
+        if result is not None:
+            return self.finish(result)
+        if self.process_post is not None:
+            self.process_post(self, shortcode)
+            return None
+        request_id, request_dir = open_request_dir(shortcode)
+        self.attach(request_id)
+        return self.finish(PostJob(shortcode, request_id, request_dir, self.on_event).run())
@@ -0,0 +1,47 @@
+import time
+
+from workers import native
+
+_threading = native("threading")
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: refills at `rate` tokens per second and holds at
+    most `burst`. The lock is a real one and is never held while waiting, so the
+    bucket can be shared by green threads and worker threads alike.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = _threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """Takes `tokens` if available. Returns 0 on success, otherwise the seconds until they will be."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens=1, timeout=None):
+        """Waits until `tokens` are available. Returns False if that would take longer than timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
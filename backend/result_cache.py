@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+from storage import REDIS_URL, SQLiteFile, create_backend
+
+# How long a shortcode keeps pointing at its finished request
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", "600"))
+# Upper bound on indexed shortcodes; the oldest entries are evicted first
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "10000"))
+
+
+class MemoryResultCache:
+    """In-process cache, for tests and single-process setups."""
+
+    def __init__(self, ttl_seconds=RESULT_CACHE_TTL_SECONDS, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, shortcode):
+        with self._lock:
+            entry = self._entries.get(shortcode)
+            if entry is None:
+                return None
+            if entry["expires_at"] <= time.time():
+                del self._entries[shortcode]
+                return None
+            return dict(entry)
+
+    def put(self, shortcode, request_id, ttl_seconds=None):
+        now = time.time()
+        entry = {
+            "request_id": request_id,
+            "ts": now,
+            "expires_at": now + (ttl_seconds or self.ttl_seconds),
+        }
+        with self._lock:
+            self._entries.pop(shortcode, None)
+            self._entries[shortcode] = entry
+            while self.max_entries and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, shortcode):
+        with self._lock:
+            self._entries.pop(shortcode, None)
+
+    def evict_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items() if entry["expires_at"] <= now]
+            for key in expired:
+                del self._entries[key]
+        return len(expired)
+
+
+class SQLiteResultCache:
+    """
+    Result index in a SQLite file. Lookups hit the primary key and every write
+    is its own transaction.
+    """
+
+    def __init__(self, path, ttl_seconds=RESULT_CACHE_TTL_SECONDS, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.db = SQLiteFile(path, [
+            "CREATE TABLE IF NOT EXISTS results ("
+            " shortcode TEXT PRIMARY KEY,"
+            " request_id TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " expires_at REAL NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS results_expires_at ON results (expires_at)",
+            "CREATE INDEX IF NOT EXISTS results_created_at ON results (created_at)",
+        ])
+
+    def get(self, shortcode):
+        with self.db.connect() as conn:
+            row = conn.execute(
+                "SELECT request_id, created_at, expires_at FROM results WHERE shortcode = ?",
+                (shortcode,),
+            ).fetchone()
+        if row is None:
+            return None
+        if row[2] <= time.time():
+            self.delete(shortcode)
+            return None
+        return {"request_id": row[0], "ts": row[1], "expires_at": row[2]}
+
+    def put(self, shortcode, request_id, ttl_seconds=None):
+        now = time.time()
+        with self.db.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (shortcode, request_id, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (shortcode, request_id, now, now + (ttl_seconds or self.ttl_seconds)),
+            )
+            if self.max_entries:
+                conn.execute(
+                    "DELETE FROM results WHERE shortcode IN ("
+                    " SELECT shortcode FROM results ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+
+    def delete(self, shortcode):
+        with self.db.connect() as conn:
+            conn.execute("DELETE FROM results WHERE shortcode = ?", (shortcode,))
+
+    def evict_expired(self):
+        with self.db.connect() as conn:
+            return conn.execute("DELETE FROM results WHERE expires_at <= ?", (time.time(),)).rowcount
+
+
+class RedisResultCache:
+    """
+    Result index in Redis, shared by every web and worker node. Entries expire
+    through Redis key TTLs; a sorted set by creation time enforces the size bound.
+    """
+
+    def __init__(self, url=REDIS_URL, prefix="socialkart", ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+                 max_entries=RESULT_CACHE_MAX_ENTRIES):
+        import redis
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.order_key = f"{prefix}:results:order"
+
+    def _key(self, shortcode):
+        return f"{self.prefix}:result:{shortcode}"
+
+    def get(self, shortcode):
+        raw = self.redis.get(self._key(shortcode))
+        return json.loads(raw) if raw else None
+
+    def put(self, shortcode, request_id, ttl_seconds=None):
+        now = time.time()
+        ttl = ttl_seconds or self.ttl_seconds
+        entry = {"request_id": request_id, "ts": now, "expires_at": now + ttl}
+        pipe = self.redis.pipeline()
+        pipe.set(self._key(shortcode), json.dumps(entry), ex=int(ttl))
+        pipe.zadd(self.order_key, {shortcode: now})
+        pipe.execute()
+        if self.max_entries:
+            overflow = self.redis.zcard(self.order_key) - self.max_entries
+            if overflow > 0:
+                oldest = self.redis.zrange(self.order_key, 0, overflow - 1)
+                if oldest:
+                    self.redis.delete(*[self._key(code) for code in oldest])
+                    self.redis.zrem(self.order_key, *oldest)
+
+    def delete(self, shortcode):
+        self.redis.delete(self._key(shortcode))
+        self.redis.zrem(self.order_key, shortcode)
+
+    def evict_expired(self):
+        # Keys expire on their own; only the ordering set needs trimming
+        cutoff = time.time() - self.ttl_seconds
+        return self.redis.zremrangebyscore(self.order_key, "-inf", cutoff)
+
+
+def create_result_cache(sqlite_path, prefix="socialkart"):
+    """Builds the cache selected by RESULT_CACHE_BACKEND. `prefix` namespaces its Redis keys."""
+    return create_backend(
+        memory=MemoryResultCache,
+        sqlite=lambda: SQLiteResultCache(sqlite_path),
+        redis=lambda: RedisResultCache(prefix=prefix),
+    )
@@ -1,29 +1,165 @@
 import os
-import re
-import subprocess
 from typing import Optional
 
 import imageio_ffmpeg as iio_ffmpeg
 
+from media_ingest import MediaIngest, probe_media, scene_select_filter, parse_showinfo_timestamps
+from workers import native
+
+# ffmpeg runs from worker OS threads (see workers.run_blocking); a green
+# subprocess there would wait on the eventlet hub from the wrong thread
+subprocess = native("subprocess")
+
+# "stream" pipes small RGB frames from ffmpeg straight into the classifier and
+# only writes the selected frames to disk; "disk" writes every sampled frame as PNG.
+FRAME_EXTRACTION_MODE = os.getenv("FRAME_EXTRACTION_MODE", "stream").lower()
+# Aim to sample enough frames to allow selecting 30 relevant ones across the video
+TARGET_SAVED_FRAMES = 300
+# Side of the square frames streamed to the classifier (the model input size)
+STREAM_FRAME_SIZE = 224
+# With "stream" extraction, sample and classify a new video while it is still downloading
+STREAMING_INGEST = os.getenv("STREAMING_INGEST", "1") == "1"
+# "adaptive" keeps a frame at every shot change plus enough in between to
+# bound the gaps (see below); "uniform" samples TARGET_SAVED_FRAMES evenly
+FRAME_SAMPLING = os.getenv("FRAME_SAMPLING", "adaptive").lower()
+# How often per second adaptive sampling looks for shot changes
+SCENE_ANALYSIS_FPS = float(os.getenv("SCENE_ANALYSIS_FPS", "10"))
+# ffmpeg scene score (0-1) above which a frame counts as the start of a new shot
+SCENE_CHANGE_THRESHOLD = float(os.getenv("SCENE_CHANGE_THRESHOLD", "0.3"))
+# Longest stretch without a candidate frame, so long static shots are still covered
+ADAPTIVE_MAX_GAP_SECONDS = float(os.getenv("ADAPTIVE_MAX_GAP_SECONDS", "1.0"))
+# Candidates adaptive sampling takes from a video even without shot changes;
+# shortens the gap below ADAPTIVE_MAX_GAP_SECONDS for short reels
+ADAPTIVE_MIN_FRAMES = int(os.getenv("ADAPTIVE_MIN_FRAMES", "60"))
+# Most candidate frames adaptive sampling takes from one video; sets the
+# minimum spacing between them (never more than TARGET_SAVED_FRAMES)
+ADAPTIVE_MAX_FRAMES = int(os.getenv("ADAPTIVE_MAX_FRAMES", "150"))
+
 
 def _get_video_duration_seconds(video_path: str) -> Optional[float]:
-    """Return duration in seconds by parsing ffmpeg probe output. None if unknown."""
-    ffmpeg_exe = iio_ffmpeg.get_ffmpeg_exe()
-    # "ffmpeg -i <input>" prints metadata (including Duration) to stderr
-    proc = subprocess.run(
-        [ffmpeg_exe, "-hide_banner", "-i", video_path],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-    )
-    meta = proc.stderr or ""
-    match = re.search(r"Duration:\s+(\d+):(\d+):(\d+(?:\.\d+)?)", meta)
-    if not match:
+    """Return duration in seconds from the cached ffmpeg probe. None if unknown."""
+    return probe_media(video_path).get("duration")
+
+
+def _fps_for_duration(duration_sec) -> float:
+    """Sampling rate that yields roughly TARGET_SAVED_FRAMES frames; 1 fps for unknown durations."""
+    if duration_sec and duration_sec > 0:
+        return max(TARGET_SAVED_FRAMES / duration_sec, 0.1)  # avoid zero
+    return 1.0
+
+
+def _sampling_fps(video_path) -> float:
+    return _fps_for_duration(_get_video_duration_seconds(video_path))
+
+
+def _select_for_duration(duration_sec, source_fps=None):
+    """scene_select_filter chain for a video, or None when FRAME_SAMPLING is "uniform"."""
+    if FRAME_SAMPLING != "adaptive":
         return None
-    hours = int(match.group(1))
-    minutes = int(match.group(2))
-    seconds = float(match.group(3))
-    return hours * 3600 + minutes * 60 + seconds
+    # Consecutive candidates are at least one uniform-grid step apart, so their
+    # grid_frame_number()s never collide
+    min_gap = 1.0 / _fps_for_duration(duration_sec)
+    if duration_sec:
+        min_gap = max(min_gap, duration_sec / max(1, ADAPTIVE_MAX_FRAMES))
+    max_gap = ADAPTIVE_MAX_GAP_SECONDS
+    if duration_sec:
+        max_gap = min(max_gap, duration_sec / max(1, ADAPTIVE_MIN_FRAMES))
+    max_gap = max(max_gap, min_gap)
+    analysis_fps = SCENE_ANALYSIS_FPS
+    if source_fps:
+        analysis_fps = min(analysis_fps, source_fps)
+    return scene_select_filter(analysis_fps, SCENE_CHANGE_THRESHOLD, min_gap, max_gap)
+
+
+def _adaptive_select(video_path):
+    info = probe_media(video_path)
+    return _select_for_duration(info.get("duration"), info.get("fps"))
+
+
+def grid_frame_number(video_path, timestamp):
+    """
+    1-based position of a timestamp on the uniform sampling grid. Frames are
+    numbered this way in both sampling modes, so a spacing rule in frame
+    numbers covers the same stretch of video either way.
+    """
+    return int(round(timestamp * _sampling_fps(video_path))) + 1
+
+
+def grid_timestamp(video_path, frame_number):
+    """Inverse of grid_frame_number: the timestamp (seconds) of a grid frame."""
+    return (frame_number - 1) / _sampling_fps(video_path)
+
+
+def stream_frames(video_path, fps=None, size=STREAM_FRAME_SIZE):
+    """
+    Samples the video at `fps` (by default as FRAME_SAMPLING says) and yields
+    (index, timestamp_seconds, frame) tuples, where frame is a (size, size, 3)
+    uint8 RGB array center-cropped like ImageOps.fit. Frames come from an
+    ffmpeg rawvideo pipe and never touch disk.
+    """
+    if not os.path.exists(video_path):
+        return
+    select = None
+    if fps is None:
+        fps = _sampling_fps(video_path)
+        select = _adaptive_select(video_path)
+
+    ingest = MediaIngest(video_path, fps, size, select=select)
+    try:
+        yield from ingest.frames()
+    finally:
+        ingest.close()
+
+
+def open_media_ingest(video_path, audio_path=None, fps=None):
+    """
+    Starts the single-pass ingest for a video: classifier frames at the sampling
+    rate (by default as FRAME_SAMPLING says) plus, if audio_path is given, the
+    16 kHz mono audio track.
+    """
+    select = None
+    if fps is None:
+        fps = _sampling_fps(video_path)
+        select = _adaptive_select(video_path)
+    return MediaIngest(video_path, fps, STREAM_FRAME_SIZE, audio_path=audio_path, select=select).start()
+
+
+def open_streamed_ingest(duration_sec=None, audio_path=None, has_audio=False):
+    """
+    Starts an ingest that reads the video from its stdin while it is still
+    being downloaded: feed it with write(chunk) and finish with end_input().
+    duration_sec sets the sampling rate, since the file cannot be probed yet.
+    The audio track is written to audio_path only when has_audio says there
+    is one (from the moov box at the head of a faststart file).
+    """
+    ingest = MediaIngest(
+        None,
+        _fps_for_duration(duration_sec),
+        STREAM_FRAME_SIZE,
+        audio_path=audio_path,
+        select=_select_for_duration(duration_sec),
+        has_audio=has_audio,
+    )
+    return ingest.start()
+
+
+def extract_frames_at(video_path, timestamps, output_paths):
+    """
+    Writes full-resolution PNGs of the frames at the given timestamps with a
+    single ffmpeg run: each timestamp is opened as its own input with an input
+    seek, so only the GOPs around the selected frames are decoded.
+    """
+    if not timestamps or not os.path.exists(video_path):
+        return
+
+    ffmpeg_exe = iio_ffmpeg.get_ffmpeg_exe()
+    cmd = [ffmpeg_exe, "-nostdin", "-hide_banner", "-loglevel", "error", "-y"]
+    for timestamp in timestamps:
+        cmd += ["-ss", f"{max(timestamp, 0):.3f}", "-i", video_path]
+    for input_index, output_path in enumerate(output_paths):
+        cmd += ["-map", f"{input_index}:v:0", "-frames:v", "1", output_path.replace('\\', '/')]
+
+    subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
 
 def video_to_frames(video_path, frames_dir, shortcode):
@@ -34,34 +170,42 @@ def video_to_frames(video_path, frames_dir, shortcode):
     if not os.path.exists(video_path):
         return
 
-    # Aim to save enough frames to allow selecting 30 relevant ones across the video
     # Save roughly up to 300 frames, spaced evenly; fallback to 1 fps for short/unknown videos
-    target_saved_frames = 300
-
-    duration_sec = _get_video_duration_seconds(video_path)
-    if duration_sec and duration_sec > 0:
-        fps = max(target_saved_frames / duration_sec, 0.1)  # avoid zero
-    else:
-        fps = 1.0
+    fps = _sampling_fps(video_path)
+    select = _adaptive_select(video_path)
 
     # Build ffmpeg command to extract frames using fps filter
     ffmpeg_exe = iio_ffmpeg.get_ffmpeg_exe()
 
+    # Adaptive frames are written under a temporary name and renamed to their
+    # grid_frame_number once their timestamps are known
+    pattern_name = 'candidate_%04d.png' if select else 'frame_%04d.png'
     # Ensure ffmpeg-friendly path separators for the output pattern
-    output_pattern = os.path.join(output_folder, 'frame_%04d.png').replace('\\', '/')
+    output_pattern = os.path.join(output_folder, pattern_name).replace('\\', '/')
 
     cmd = [
         ffmpeg_exe,
         "-nostdin",
         "-hide_banner",
         "-loglevel",
-        "error",
+        "info" if select else "error",
         "-y",
         "-i",
         video_path,
         "-vf",
-        f"fps={fps:.6f}",
+        select or f"fps={fps:.6f}",
+        "-fps_mode",
+        "passthrough",
         output_pattern,
     ]
 
-    subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
\ No newline at end of file
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if not select:
+        return
+
+    timestamps = parse_showinfo_timestamps(proc.stderr.decode(errors="ignore"))
+    for index, timestamp in enumerate(timestamps, start=1):
+        candidate_path = os.path.join(output_folder, f'candidate_{index:04d}.png')
+        if os.path.exists(candidate_path):
+            frame_path = os.path.join(output_folder, f'frame_{grid_frame_number(video_path, timestamp):04d}.png')
+            os.replace(candidate_path, frame_path)
\ No newline at end of file
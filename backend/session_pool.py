@@ -0,0 +1,143 @@
+import os
+import time
+from contextlib import contextmanager
+
+from post_metadata import PostUnavailable
+from rate_limit import TokenBucket
+from workers import native
+
+_threading = native("threading")
+
+# Requests per second each Instagram session may make, and the burst allowed above it
+INSTAGRAM_SESSION_RATE_PER_SECOND = float(os.getenv("INSTAGRAM_SESSION_RATE_PER_SECOND", "0.5"))
+INSTAGRAM_SESSION_BURST = int(os.getenv("INSTAGRAM_SESSION_BURST", "3"))
+# How long a session that was rate limited or challenged sits out before it is used again
+INSTAGRAM_SESSION_QUARANTINE_SECONDS = float(os.getenv("INSTAGRAM_SESSION_QUARANTINE_SECONDS", "900"))
+# How long a job waits for a free session before giving up
+INSTAGRAM_SESSION_WAIT_SECONDS = float(os.getenv("INSTAGRAM_SESSION_WAIT_SECONDS", "120"))
+
+
+class NoSessionAvailable(Exception):
+    pass
+
+
+class PooledSession:
+    """One logged-in client plus the bookkeeping the pool keeps for it."""
+
+    def __init__(self, name, client, rate=None, burst=None):
+        self.name = name
+        self.client = client
+        self.bucket = TokenBucket(
+            INSTAGRAM_SESSION_RATE_PER_SECOND if rate is None else rate,
+            INSTAGRAM_SESSION_BURST if burst is None else burst,
+        )
+        self.last_used = 0.0
+        self.quarantined_until = 0.0
+        self.in_use = False
+
+    def pace(self, tokens=1):
+        """Blocks until the session may make `tokens` more requests."""
+        self.bucket.acquire(tokens)
+
+
+class SessionPool:
+    """
+    Hands out sessions one job at a time, least recently used first, so work
+    spreads across every account. Each session has its own token bucket;
+    sessions reported as rate limited or challenged are quarantined for
+    INSTAGRAM_SESSION_QUARANTINE_SECONDS. Leases block on a real condition
+    variable, so take them from worker threads (run_blocking).
+    """
+
+    def __init__(self, sessions, quarantine_seconds=None):
+        self.sessions = list(sessions)
+        self.quarantine_seconds = (
+            INSTAGRAM_SESSION_QUARANTINE_SECONDS if quarantine_seconds is None else quarantine_seconds
+        )
+        self._condition = _threading.Condition()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def _pick(self, now):
+        """Least recently used free session, or (None, seconds until a quarantine ends)."""
+        free = [s for s in self.sessions if not s.in_use and s.quarantined_until <= now]
+        if free:
+            return min(free, key=lambda s: s.last_used), None
+        waiting = [s.quarantined_until - now for s in self.sessions if not s.in_use and s.quarantined_until > now]
+        return None, min(waiting) if waiting else None
+
+    def acquire(self, timeout=None):
+        if not self.sessions:
+            raise NoSessionAvailable("No Instagram sessions are configured")
+        timeout = INSTAGRAM_SESSION_WAIT_SECONDS if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                session, retry_in = self._pick(time.time())
+                if session is not None:
+                    session.in_use = True
+                    session.last_used = time.time()
+                    return session
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise NoSessionAvailable("All Instagram sessions are busy or quarantined")
+                self._condition.wait(min(remaining, retry_in) if retry_in is not None else remaining)
+
+    def release(self, session, error=None):
+        """Returns a session to the pool, quarantining it if error says it was blocked."""
+        with self._condition:
+            session.in_use = False
+            if error is not None and is_blocking_error(error):
+                session.quarantined_until = time.time() + self.quarantine_seconds
+                print(f"Instagram session {session.name} quarantined for {self.quarantine_seconds:.0f}s: {error}")
+            self._condition.notify()
+
+    @contextmanager
+    def session(self, timeout=None):
+        """with pool.session() as s: ... -- leases a session and returns it, noting failures."""
+        session = self.acquire(timeout)
+        try:
+            yield session
+        except BaseException as e:
+            self.release(session, e)
+            raise
+        else:
+            self.release(session)
+
+    def status(self):
+        now = time.time()
+        return [
+            {
+                "name": s.name,
+                "in_use": s.in_use,
+                "quarantined_for": max(0, round(s.quarantined_until - now)),
+            }
+            for s in self.sessions
+        ]
+
+
+# instaloader exceptions for an account Instagram throttles, challenges
+# (checkpoint/challenge/feedback_required) or has logged out
+_BLOCKING_ERROR_TYPES = {"TooManyRequestsException", "AbortDownloadException", "LoginRequiredException"}
+# HTTP answers about the account rather than the post ("please wait a few minutes" comes as a 401)
+_BLOCKING_STATUS_CODES = {401, 429}
+
+
+def is_blocking_error(error):
+    """
+    True for errors that mean the account, not the post, is the problem. Only
+    the exception type and HTTP status count, including those of the errors
+    it was raised from; post-level errors never match, whatever their text.
+    """
+    while error is not None:
+        if isinstance(error, PostUnavailable):
+            return False
+        names = {cls.__name__ for cls in type(error).__mro__}
+        if names & _BLOCKING_ERROR_TYPES:
+            return True
+        response = getattr(error, "response", None)
+        if getattr(response, "status_code", None) in _BLOCKING_STATUS_CODES:
+            return True
+        error = error.__cause__
+    return False
@@ -0,0 +1,40 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+
+# Where results, request expiry and post metadata are kept: "sqlite" (default), "redis" or "memory"
+RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "sqlite").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+class SQLiteFile:
+    """
+    A SQLite database file in WAL mode, so concurrent jobs and readers share it
+    without losing each other's updates. schema statements run once on open.
+    """
+
+    def __init__(self, path, schema=()):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in schema:
+                conn.execute(statement)
+
+    @contextmanager
+    def connect(self):
+        """A connection of its own (they cannot be shared across threads); its block is one transaction."""
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+
+def create_backend(memory, sqlite, redis):
+    """Calls whichever of the memory, sqlite and redis factories RESULT_CACHE_BACKEND selects."""
+    factories = {"memory": memory, "sqlite": sqlite, "redis": redis}
+    if RESULT_CACHE_BACKEND not in factories:
+        raise ValueError(f"Unknown RESULT_CACHE_BACKEND: {RESULT_CACHE_BACKEND}")
+    return factories[RESULT_CACHE_BACKEND]()
@@ -0,0 +1,52 @@
+import os
+
+from artifact_cache import ArtifactCache
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_restore_round_trip(tmp_path):
+    cache = ArtifactCache(root=str(tmp_path / "cache"))
+    write(str(tmp_path / "a" / "relevant_final" / "frame_0001.png"), "frame")
+    write(str(tmp_path / "a" / "scores.json"), "{}")
+    key = ArtifactCache.key("frames", "hash", "v1")
+    cache.store(key, "frames", str(tmp_path / "a"), ["scores.json", "relevant_final/frame_0001.png", "missing.txt"])
+
+    restored = cache.restore(key, str(tmp_path / "b"))
+    assert restored == ["relevant_final/frame_0001.png", "scores.json"]
+    assert read(str(tmp_path / "b" / "relevant_final" / "frame_0001.png")) == "frame"
+    assert cache.restore(ArtifactCache.key("frames", "other"), str(tmp_path / "c")) is None
+
+
+def test_rewriting_an_output_leaves_the_entry_alone(tmp_path):
+    cache = ArtifactCache(root=str(tmp_path / "cache"))
+    write(str(tmp_path / "a" / "scores.json"), "original")
+    key = ArtifactCache.key("frames", "hash")
+    cache.store(key, "frames", str(tmp_path / "a"), ["scores.json"])
+    # The producing request rewrites its output in place
+    write(str(tmp_path / "a" / "scores.json"), "rewritten by the producer")
+
+    cache.restore(key, str(tmp_path / "b"))
+    # So does a request that restored it
+    write(str(tmp_path / "b" / "scores.json"), "rewritten by a consumer")
+
+    cache.restore(key, str(tmp_path / "c"))
+    assert read(str(tmp_path / "c" / "scores.json")) == "original"
+
+
+def test_expired_entries_miss(tmp_path):
+    cache = ArtifactCache(root=str(tmp_path / "cache"), ttl_seconds=0)
+    write(str(tmp_path / "a" / "transcript.txt"), "hello")
+    key = ArtifactCache.key("transcript", "hash")
+    cache.store(key, "transcript", str(tmp_path / "a"), ["transcript.txt"])
+    assert cache.restore(key, str(tmp_path / "b")) is None
+    assert not os.path.exists(os.path.join(cache.root, key))
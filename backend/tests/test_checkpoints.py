@@ -0,0 +1,59 @@
+import os
+
+import pytest
+
+import checkpoints
+
+
+def write(request_dir, rel, text="x"):
+    path = os.path.join(request_dir, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def test_completed_stage_keeps_its_manifest(tmp_path):
+    request_dir = str(tmp_path)
+    write(request_dir, "caption.txt", "caption")
+    checkpoints.mark_complete(request_dir, "download", ["caption.txt", "missing.mp4"], post_info={"is_video": False})
+    manifest = checkpoints.completed(request_dir, "download")
+    assert manifest["outputs"] == {"caption.txt": len("caption")}
+    assert manifest["post_info"] == {"is_video": False}
+    assert checkpoints.completed(request_dir, "frames") is None
+
+
+@pytest.mark.parametrize("damage", ["remove", "truncate"])
+def test_damaged_outputs_void_the_stage(tmp_path, damage):
+    request_dir = str(tmp_path)
+    write(request_dir, "transcript.txt", "hello")
+    checkpoints.mark_complete(request_dir, "transcript", ["transcript.txt"])
+    if damage == "remove":
+        os.remove(os.path.join(request_dir, "transcript.txt"))
+    else:
+        write(request_dir, "transcript.txt", "hel")
+    assert checkpoints.completed(request_dir, "transcript") is None
+
+
+def test_finishing_a_stage_again_invalidates_its_dependents(tmp_path):
+    request_dir = str(tmp_path)
+    for stage, rel in [("download", "caption.txt"), ("frames", "relevant_final/frame_0001.png"),
+                       ("transcript", "transcript.txt"), ("listing", "result.json")]:
+        write(request_dir, rel)
+        checkpoints.mark_complete(request_dir, stage, [rel])
+
+    checkpoints.mark_complete(request_dir, "transcript", ["transcript.txt"])
+    assert checkpoints.completed(request_dir, "listing") is None
+    assert not os.path.exists(os.path.join(request_dir, "result.json"))
+    assert checkpoints.completed(request_dir, "frames") is not None
+
+    checkpoints.mark_complete(request_dir, "download", ["caption.txt"])
+    assert [stage for stage in ("frames", "transcript") if checkpoints.completed(request_dir, stage)] == []
+    assert not os.path.exists(os.path.join(request_dir, "relevant_final", "frame_0001.png"))
+
+
+def test_unreadable_marker_counts_as_incomplete(tmp_path):
+    request_dir = str(tmp_path)
+    os.makedirs(os.path.join(request_dir, checkpoints.CHECKPOINT_DIR))
+    with open(os.path.join(request_dir, checkpoints.CHECKPOINT_DIR, "listing.json"), "w") as f:
+        f.write('{"stage": "lis')
+    assert checkpoints.completed(request_dir, "listing") is None
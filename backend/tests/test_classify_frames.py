@@ -0,0 +1,26 @@
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_with_resample(value):
+    return subprocess.run(
+        [sys.executable, "-c", "import classify_frames"],
+        cwd=BACKEND_DIR,
+        env=dict(os.environ, CLASSIFIER_RESAMPLE=value),
+        capture_output=True,
+        text=True,
+    )
+
+
+def test_unknown_resample_filter_fails_at_import():
+    proc = import_with_resample("lanczso")
+    assert proc.returncode != 0
+    assert "Unknown CLASSIFIER_RESAMPLE: lanczso" in proc.stderr
+    assert "lanczos, bicubic, bilinear, nearest" in proc.stderr
+
+
+def test_resample_filter_names_are_case_insensitive():
+    assert import_with_resample("Bilinear").returncode == 0
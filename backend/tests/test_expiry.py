@@ -0,0 +1,55 @@
+import os
+import time
+
+import pytest
+
+from expiry import MemoryExpiryRegistry, SQLiteExpiryRegistry, reap_expired, remaining_seconds
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def registry(request, tmp_path):
+    if request.param == "memory":
+        return MemoryExpiryRegistry()
+    return SQLiteExpiryRegistry(str(tmp_path / "expiry.sqlite3"))
+
+
+def test_register_and_look_up(registry):
+    expires_at = time.time() + 60
+    registry.register("req-1", expires_at)
+    assert registry.expires_at("req-1") == pytest.approx(expires_at)
+    assert registry.expires_at("req-2") is None
+    # Registering again moves the deadline
+    registry.register("req-1", expires_at + 60)
+    assert registry.expires_at("req-1") == pytest.approx(expires_at + 60)
+
+
+def test_expired(registry):
+    now = time.time()
+    registry.register("old", now - 1)
+    registry.register("new", now + 60)
+    assert registry.expired() == ["old"]
+    assert sorted(registry.expired(now + 120)) == ["new", "old"]
+    registry.forget("old")
+    assert registry.expired() == []
+
+
+def test_remaining_seconds(registry):
+    registry.register("later", time.time() + 30.5)
+    registry.register("gone", time.time() - 5)
+    assert remaining_seconds(registry, "later") in (29, 30)
+    assert remaining_seconds(registry, "gone") == 0
+    assert remaining_seconds(registry, "unknown") is None
+
+
+def test_reap_expired_removes_directories(registry, tmp_path):
+    base_dir = str(tmp_path / "requests")
+    for request_id in ("old", "new"):
+        os.makedirs(os.path.join(base_dir, request_id))
+    registry.register("old", time.time() - 1)
+    registry.register("new", time.time() + 60)
+    cleaned = []
+    assert reap_expired(registry, base_dir, cleaned.append) == ["old"]
+    assert cleaned == [os.path.join(base_dir, "old")]
+    assert registry.expires_at("old") is None
+    assert registry.expires_at("new") is not None
+    assert reap_expired(registry, base_dir, cleaned.append) == []
@@ -0,0 +1,99 @@
+import numpy as np
+
+from frame_selection import difference_hash, select_frames
+
+
+def candidate(score, timestamp, dhash=None):
+    frame = {"score": score, "timestamp": timestamp}
+    if dhash is not None:
+        frame["dhash"] = dhash
+    return frame
+
+
+def test_empty_input():
+    assert select_frames([], max_frames=5, min_spacing_seconds=1.0) == []
+
+
+def test_single_frame():
+    frame = candidate(0.5, 3.0)
+    assert select_frames([frame], max_frames=5, min_spacing_seconds=1.0) == [frame]
+
+
+def test_orders_by_score():
+    frames = [candidate(0.2, 0.0), candidate(0.9, 5.0), candidate(0.5, 10.0)]
+    selected = select_frames(frames, max_frames=5, min_spacing_seconds=1.0, max_hash_distance=-1)
+    assert [frame["score"] for frame in selected] == [0.9, 0.5, 0.2]
+
+
+def test_min_spacing_drops_lower_scored_neighbours():
+    frames = [
+        candidate(0.9, 5.0),
+        candidate(0.8, 5.5),   # too close after the best frame
+        candidate(0.7, 4.2),   # too close before it
+        candidate(0.6, 6.0),   # exactly the spacing away
+        candidate(0.5, 2.0),
+    ]
+    selected = select_frames(frames, max_frames=10, min_spacing_seconds=1.0, max_hash_distance=-1)
+    assert [frame["timestamp"] for frame in selected] == [5.0, 6.0, 2.0]
+
+
+def test_zero_spacing_keeps_neighbours():
+    frames = [candidate(0.9, 1.0), candidate(0.8, 1.1)]
+    selected = select_frames(frames, max_frames=10, min_spacing_seconds=0.0, max_hash_distance=-1)
+    assert len(selected) == 2
+
+
+def test_near_duplicates_are_rejected():
+    base = 0b1011_0110 << 32
+    frames = [
+        candidate(0.9, 0.0, dhash=base),
+        candidate(0.8, 10.0, dhash=base ^ 0b111),        # 3 bits apart: duplicate
+        candidate(0.7, 20.0, dhash=base ^ (2 ** 20 - 1)),  # 20 bits apart: distinct
+    ]
+    selected = select_frames(frames, max_frames=10, min_spacing_seconds=1.0, max_hash_distance=6)
+    assert [frame["timestamp"] for frame in selected] == [0.0, 20.0]
+
+
+def test_dedup_disabled_keeps_duplicates():
+    frames = [candidate(0.9, 0.0, dhash=42), candidate(0.8, 10.0, dhash=42)]
+    selected = select_frames(frames, max_frames=10, min_spacing_seconds=1.0, max_hash_distance=-1)
+    assert len(selected) == 2
+
+
+def test_hash_fn_only_called_for_frames_passing_spacing():
+    frames = [candidate(0.9, 0.0), candidate(0.8, 0.5), candidate(0.7, 5.0)]
+    asked = []
+
+    def hash_fn(frame):
+        asked.append(frame["timestamp"])
+        return 7
+
+    selected = select_frames(frames, max_frames=10, min_spacing_seconds=1.0, max_hash_distance=6, hash_fn=hash_fn)
+    assert asked == [0.0, 5.0]
+    # Both hashed frames share a hash, so the second is a duplicate
+    assert [frame["timestamp"] for frame in selected] == [0.0]
+
+
+def test_score_ties_keep_candidate_order():
+    frames = [candidate(0.5, 30.0), candidate(0.5, 10.0), candidate(0.5, 20.0)]
+    selected = select_frames(frames, max_frames=2, min_spacing_seconds=1.0, max_hash_distance=-1)
+    assert [frame["timestamp"] for frame in selected] == [30.0, 10.0]
+
+
+def test_max_frames_cap():
+    frames = [candidate(i / 100, float(i * 2)) for i in range(50)]
+    selected = select_frames(frames, max_frames=4, min_spacing_seconds=1.0, max_hash_distance=-1)
+    assert [frame["timestamp"] for frame in selected] == [98.0, 96.0, 94.0, 92.0]
+
+
+def test_max_frames_zero():
+    assert select_frames([candidate(0.9, 0.0)], max_frames=0, min_spacing_seconds=1.0) == []
+
+
+def test_difference_hash_of_similar_and_different_images():
+    gradient = np.tile(np.linspace(0, 255, 64, dtype=np.uint8), (64, 1))
+    image = np.stack([gradient] * 3, axis=-1)
+    brighter = np.clip(image.astype(np.int16) + 10, 0, 255).astype(np.uint8)
+    flipped = image[:, ::-1]
+    assert bin(difference_hash(image) ^ difference_hash(brighter)).count("1") <= 6
+    assert bin(difference_hash(image) ^ difference_hash(flipped)).count("1") > 6
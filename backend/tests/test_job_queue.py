@@ -0,0 +1,108 @@
+import threading
+import time
+
+from job_queue import MemoryJobBackend, job_event
+
+
+def job(job_id):
+    return {"job_id": job_id, "shortcode": f"SC{job_id}", "room": "sid"}
+
+
+def test_reserve_returns_jobs_in_order():
+    backend = MemoryJobBackend()
+    backend.enqueue(job("1"))
+    backend.enqueue(job("2"))
+    assert backend.reserve("w1", timeout=0.1)["job_id"] == "1"
+    assert backend.reserve("w1", timeout=0.1)["job_id"] == "2"
+
+
+def test_reserve_times_out_when_empty():
+    assert MemoryJobBackend().reserve("w1", timeout=0.05) is None
+
+
+def test_enqueue_copies_the_job():
+    backend = MemoryJobBackend()
+    original = job("1")
+    backend.enqueue(original)
+    original["shortcode"] = "changed"
+    assert backend.reserve("w1", timeout=0.1)["shortcode"] == "SC1"
+
+
+def test_each_job_is_reserved_once():
+    backend = MemoryJobBackend()
+    for job_id in range(20):
+        backend.enqueue(job(str(job_id)))
+    taken = []
+    lock = threading.Lock()
+
+    def work(worker_id):
+        while True:
+            reserved = backend.reserve(worker_id, timeout=0.05)
+            if reserved is None:
+                return
+            with lock:
+                taken.append(reserved["job_id"])
+            backend.ack(worker_id, reserved)
+
+    workers = [threading.Thread(target=work, args=(f"w{i}",)) for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(5)
+    assert sorted(taken, key=int) == [str(job_id) for job_id in range(20)]
+
+
+def test_acked_jobs_are_not_requeued():
+    backend = MemoryJobBackend()
+    backend.enqueue(job("1"))
+    reserved = backend.reserve("w1", timeout=0.1)
+    backend.ack("w1", reserved)
+    assert backend.requeue_stale("w1") == 0
+    assert backend.reserve("w1", timeout=0.05) is None
+
+
+def test_requeue_stale_puts_back_unacked_jobs():
+    backend = MemoryJobBackend()
+    backend.enqueue(job("1"))
+    backend.enqueue(job("2"))
+    first = backend.reserve("w1", timeout=0.1)
+    second = backend.reserve("w1", timeout=0.1)
+    backend.ack("w1", first)
+
+    # w1 restarted without acking its second job
+    assert backend.requeue_stale("w1") == 1
+    assert backend.reserve("w2", timeout=0.1) == second
+    assert backend.requeue_stale("w1") == 0
+
+
+def test_requeue_stale_only_touches_its_worker():
+    backend = MemoryJobBackend()
+    backend.enqueue(job("1"))
+    backend.reserve("w1", timeout=0.1)
+    assert backend.requeue_stale("w2") == 0
+    assert backend.reserve("w2", timeout=0.05) is None
+
+
+def test_events_reach_every_listener():
+    backend = MemoryJobBackend()
+    first, second = backend.listen(), backend.listen()
+    # Generators subscribe on their first next(); publish from a thread once both wait
+    received = []
+    readers = [threading.Thread(target=lambda l=listener: received.append(next(l))) for listener in (first, second)]
+    for reader in readers:
+        reader.start()
+    while len(backend._listeners) < 2:
+        time.sleep(0.01)
+    event = job_event(job("1"), "progress", {"progress": 10})
+    backend.publish(event)
+    for reader in readers:
+        reader.join(5)
+    assert received == [event, event]
+
+
+def test_cancel():
+    backend = MemoryJobBackend()
+    assert not backend.is_canceled("1")
+    backend.cancel("1")
+    assert backend.is_canceled("1")
+    assert not backend.is_canceled("2")
@@ -0,0 +1,149 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from google.genai import errors
+
+import llm_client
+from rate_limit import TokenBucket
+
+
+def api_error(code):
+    return errors.APIError(code, {"error": {"code": code, "message": "fake", "status": "FAKE"}})
+
+
+class FakeModels:
+    """Stands in for genai's client.models: each call plays the next scripted outcome."""
+
+    def __init__(self, outcomes=None, hold=None):
+        self.outcomes = list(outcomes or [])
+        self.hold = hold
+        self.calls = 0
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def generate_content_stream(self, model, contents, config=None):
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            outcome = self.outcomes.pop(0) if self.outcomes else ["ok"]
+        try:
+            if self.hold is not None:
+                self.hold.wait(5)
+            if isinstance(outcome, Exception):
+                raise outcome
+            for text in outcome:
+                yield SimpleNamespace(text=text)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    models = FakeModels()
+    monkeypatch.setattr(llm_client, "get_client", lambda: SimpleNamespace(models=models))
+    monkeypatch.setattr(llm_client, "_slots", threading.BoundedSemaphore(2))
+    # A zero rate means no limit
+    monkeypatch.setattr(llm_client, "_rate_limiter", TokenBucket(0))
+    monkeypatch.setattr(llm_client, "LLM_MAX_RETRIES", 4)
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_BASE_SECONDS", 0.01)
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_MAX_SECONDS", 0.05)
+    return models
+
+
+def test_streams_chunks(fake):
+    fake.outcomes = [["Hello", ", ", "world"]]
+    chunks = []
+    assert llm_client.generate_text("m", "hi", on_chunk=chunks.append) == "Hello, world"
+    assert chunks == ["Hello", ", ", "world"]
+
+
+def test_concurrency_is_capped_by_the_semaphore(fake):
+    fake.hold = threading.Event()
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(llm_client.generate_text("m", "hi")))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    assert fake.active == 2
+    fake.hold.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == ["ok"] * 5
+    assert fake.max_active == 2
+
+
+def test_waiting_for_a_slot_expires_at_the_deadline(fake):
+    fake.hold = threading.Event()
+    holders = [threading.Thread(target=llm_client.generate_text, args=("m", "hi")) for _ in range(2)]
+    for thread in holders:
+        thread.start()
+    time.sleep(0.1)
+    started = time.monotonic()
+    with pytest.raises(llm_client.LLMDeadlineExceeded):
+        llm_client.generate_text("m", "hi", deadline_seconds=0.2)
+    assert time.monotonic() - started < 1
+    fake.hold.set()
+    for thread in holders:
+        thread.join(5)
+
+
+def test_rate_limit_expires_at_the_deadline(fake, monkeypatch):
+    monkeypatch.setattr(llm_client, "_rate_limiter", TokenBucket(1, 1))
+    assert llm_client.generate_text("m", "hi") == "ok"
+    with pytest.raises(llm_client.LLMDeadlineExceeded):
+        llm_client.generate_text("m", "hi", deadline_seconds=0.2)
+    assert fake.calls == 1
+
+
+@pytest.mark.parametrize("code", [429, 503])
+def test_retries_quota_and_server_errors_with_jittered_backoff(fake, monkeypatch, code):
+    fake.outcomes = [api_error(code), api_error(code), ["done"]]
+    delays = []
+    monkeypatch.setattr(llm_client.time, "sleep", delays.append)
+    restarts = []
+    assert llm_client.generate_text("m", "hi", on_restart=lambda: restarts.append(1)) == "done"
+    assert fake.calls == 3
+    assert len(restarts) == 2
+    # Full jitter: attempt n waits between 0 and base * 2^n
+    assert 0 <= delays[0] <= 0.01
+    assert 0 <= delays[1] <= 0.02
+
+
+def test_backoff_is_jittered_and_capped(fake):
+    samples = [llm_client._backoff_seconds(10) for _ in range(200)]
+    assert all(0 <= delay <= 0.05 for delay in samples)
+    assert len(set(samples)) > 1
+
+
+def test_client_errors_are_not_retried(fake):
+    fake.outcomes = [api_error(400)]
+    with pytest.raises(errors.APIError):
+        llm_client.generate_text("m", "hi")
+    assert fake.calls == 1
+
+
+def test_retries_stop_after_max_retries(fake, monkeypatch):
+    monkeypatch.setattr(llm_client, "LLM_MAX_RETRIES", 2)
+    monkeypatch.setattr(llm_client.time, "sleep", lambda seconds: None)
+    fake.outcomes = [api_error(503)] * 5
+    with pytest.raises(errors.APIError):
+        llm_client.generate_text("m", "hi")
+    assert fake.calls == 3
+
+
+def test_no_retry_past_the_deadline(fake, monkeypatch):
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_BASE_SECONDS", 10)
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_MAX_SECONDS", 10)
+    monkeypatch.setattr(llm_client.random, "uniform", lambda low, high: high)
+    fake.outcomes = [api_error(429), ["late"]]
+    with pytest.raises(errors.APIError):
+        llm_client.generate_text("m", "hi", deadline_seconds=1)
+    assert fake.calls == 1
@@ -0,0 +1,151 @@
+import http.server
+import json
+import os
+import re
+import socketserver
+import threading
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+import media_download
+from media_download import download_file
+
+CONTENT = os.urandom(3 * 1024 * 1024 + 12345)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(CONTENT)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get("Range"))
+        if server.status is not None:
+            self.send_response(server.status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        data = CONTENT
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = int(match.group(2)) if match.group(2) else len(data) - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+            data = data[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        # Drop the connection halfway through the first response of a range, once
+        if server.cut_after is not None and len(data) > server.cut_after:
+            server.cut_after = None
+            self.wfile.write(data[:len(data) // 2])
+            return
+        self.wfile.write(data)
+
+
+class _Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    requests = None
+    status = None
+    cut_after = None
+
+
+@pytest.fixture
+def server():
+    httpd = _Server(("127.0.0.1", 0), _Handler)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def small_ranges(monkeypatch):
+    monkeypatch.setattr(media_download, "MEDIA_RANGE_MIN_BYTES", 1024 * 1024)
+    monkeypatch.setattr(media_download, "MEDIA_CHUNK_BYTES", 64 * 1024)
+    monkeypatch.setattr(media_download.time, "sleep", lambda seconds: None)
+
+
+def url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/video.mp4"
+
+
+def test_parallel_ranges(server, tmp_path):
+    dest = str(tmp_path / "video.mp4")
+    assert download_file(url(server), dest, requests.Session(), workers=3) == dest
+    with open(dest, "rb") as f:
+        assert f.read() == CONTENT
+    assert len([r for r in server.requests if r]) == 3
+    assert not os.path.exists(dest + ".part.json")
+
+
+def test_on_chunk_gets_the_file_in_order_from_parallel_ranges(server, tmp_path):
+    received = []
+    download_file(url(server), str(tmp_path / "video.mp4"), requests.Session(), workers=3, on_chunk=received.append)
+    assert b"".join(received) == CONTENT
+    # Streaming no longer forces a single sequential request
+    assert len([r for r in server.requests if r]) == 3
+
+
+def test_client_errors_fail_without_retrying(server, tmp_path):
+    server.status = 403
+    with pytest.raises(requests.HTTPError):
+        download_file(url(server), str(tmp_path / "video.mp4"), requests.Session(), workers=3)
+    # One request per range, none of them retried
+    assert len(server.requests) == 3
+
+
+def test_interrupted_range_resumes_where_it_stopped(server, tmp_path):
+    server.cut_after = 0
+    dest = str(tmp_path / "video.mp4")
+    download_file(url(server), dest, requests.Session(), workers=3)
+    with open(dest, "rb") as f:
+        assert f.read() == CONTENT
+    starts = [int(re.match(r"bytes=(\d+)-", r).group(1)) for r in server.requests]
+    planned = [start for start, _, _ in media_download._plan_ranges(len(CONTENT), 3)]
+    # Three planned ranges plus one retry that picks up mid-range
+    assert len(starts) == 4 and len(set(starts) - set(planned)) == 1
+
+
+def test_download_resumes_after_a_failed_call(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(media_download, "MEDIA_DOWNLOAD_ATTEMPTS", 1)
+    server.cut_after = 0
+    dest = str(tmp_path / "video.mp4")
+    with pytest.raises(requests.RequestException):
+        download_file(url(server), dest, requests.Session(), workers=3)
+    assert not os.path.exists(dest) and os.path.exists(dest + ".part.json")
+
+    server.requests.clear()
+    download_file(url(server), dest, requests.Session(), workers=3)
+    with open(dest, "rb") as f:
+        assert f.read() == CONTENT
+    # Only the interrupted range is fetched again, from where it stopped
+    planned = [start for start, _, _ in media_download._plan_ranges(len(CONTENT), 3)]
+    assert len(server.requests) == 1
+    assert int(re.match(r"bytes=(\d+)-", server.requests[0]).group(1)) not in planned
+    assert not os.path.exists(dest + ".part.json")
+
+
+def test_resume_state_is_not_rewritten_after_every_chunk(server, tmp_path, monkeypatch):
+    saves = []
+
+    def dump(*args, **kwargs):
+        saves.append(1)
+        json.dump(*args, **kwargs)
+
+    monkeypatch.setattr(media_download, "json", SimpleNamespace(dump=dump, load=json.load))
+    monkeypatch.setattr(media_download, "MEDIA_STATE_SAVE_SECONDS", 60)
+    download_file(url(server), str(tmp_path / "video.mp4"), requests.Session(), workers=3)
+    # Once before starting and once as each range ends, out of ~50 chunks
+    assert len(saves) == 4
@@ -0,0 +1,145 @@
+import os
+import subprocess
+import threading
+
+import imageio_ffmpeg as iio_ffmpeg
+import pytest
+
+import media_ingest
+from media_ingest import FaststartGate, MediaIngest, mp4_info_from_head, scene_select_filter
+
+
+def make_video(path, *extra_args):
+    subprocess.run(
+        [
+            iio_ffmpeg.get_ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "lavfi", "-i", "testsrc=duration=6:size=320x240:rate=25",
+            "-f", "lavfi", "-i", "sine=duration=6",
+            "-shortest", "-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "aac", *extra_args, path,
+        ],
+        check=True,
+    )
+    return path
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+    return make_video(str(tmp_path_factory.mktemp("media") / "clip.mp4"))
+
+
+@pytest.fixture(scope="module")
+def faststart_video(tmp_path_factory):
+    return make_video(str(tmp_path_factory.mktemp("media") / "faststart.mp4"), "-movflags", "+faststart")
+
+
+def close_within(ingest, seconds=10):
+    closer = threading.Thread(target=ingest.close, daemon=True)
+    closer.start()
+    closer.join(seconds)
+    return not closer.is_alive()
+
+
+def test_reads_every_frame_with_timestamps(video):
+    ingest = MediaIngest(video, 5, 32, select=scene_select_filter(5, 0.3, 0.2, 0.2)).start()
+    frames = list(ingest.frames())
+    assert ingest.succeeded()
+    ingest.close()
+    assert 10 <= len(frames) <= 30
+    assert [index for index, _, _ in frames] == list(range(len(frames)))
+    assert frames[0][2].shape == (32, 32, 3)
+    timestamps = [timestamp for _, timestamp, _ in frames]
+    assert timestamps == sorted(timestamps)
+
+
+@pytest.mark.parametrize("select", [True, False])
+def test_close_mid_stream(video, select):
+    for _ in range(5):
+        ingest = MediaIngest(video, 25, 32, select=scene_select_filter(25, 0.3, 0.0, 0.0) if select else None).start()
+        frames = ingest.frames()
+        next(frames)
+        assert close_within(ingest)
+        # The consumer stops instead of waiting for frames that never come
+        assert len(list(frames)) < 150
+
+
+def test_close_with_full_queues(video, monkeypatch):
+    # Tiny queues leave frames in the pipe whose timestamps are dropped by close()
+    monkeypatch.setattr(media_ingest, "INGEST_QUEUE_FRAMES", 2)
+    for delay in (0.0, 0.05, 0.1, 0.2, 0.3):
+        ingest = MediaIngest(video, 25, 32, select=scene_select_filter(25, 0.3, 0.0, 0.0)).start()
+        ingest.succeeded(timeout=delay)
+        assert close_within(ingest)
+
+
+def test_close_unread(video):
+    ingest = MediaIngest(video, 25, 32, select=scene_select_filter(25, 0.3, 0.0, 0.0)).start()
+    assert close_within(ingest)
+
+
+def test_stdin_ingest_closed_before_end_of_input(video):
+    ingest = MediaIngest(None, 5, 32, select=scene_select_filter(5, 0.3, 0.2, 0.2)).start()
+    with open(video, "rb") as f:
+        ingest.write(f.read(4096))
+    frames = ingest.frames()
+    assert close_within(ingest)
+    assert list(frames) == []
+    assert not ingest.succeeded()
+
+
+def test_slow_consumer_does_not_hold_back_ffmpeg(video, monkeypatch, tmp_path):
+    monkeypatch.setattr(media_ingest, "INGEST_QUEUE_FRAMES", 2)
+    audio_path = str(tmp_path / "audio.mp3")
+    ingest = MediaIngest(video, 25, 32, audio_path=audio_path).start()
+    # Nothing has been consumed, yet ffmpeg finishes and the audio is complete
+    assert ingest.wait_audio(timeout=30)
+    frames = list(ingest.frames())
+    ingest.close()
+    assert [index for index, _, _ in frames] == list(range(150))
+    reference = MediaIngest(video, 25, 32).start()
+    expected = list(reference.frames())
+    reference.close()
+    assert all((a[2] == b[2]).all() for a, b in zip(frames, expected))
+
+
+def feed_gate(gate, path):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b""):
+            gate.write(chunk)
+    gate.end_input()
+
+
+def test_faststart_gate_streams_frames_and_audio(faststart_video, tmp_path):
+    audio_path = str(tmp_path / "audio.mp3")
+    infos, decided = [], []
+
+    def open_ingest(info):
+        infos.append(info)
+        return MediaIngest(None, 5, 32, audio_path=audio_path, has_audio=info["has_audio"]).start()
+
+    gate = FaststartGate(open_ingest, decided.append)
+    reader = threading.Thread(target=lambda: decided.append(len(list(gate.ingest.frames()))), daemon=True)
+    feed = threading.Thread(target=feed_gate, args=(gate, faststart_video), daemon=True)
+    feed.start()
+    feed.join(30)
+    reader.start()
+    reader.join(30)
+    assert infos[0]["has_audio"] and infos[0]["duration"] == pytest.approx(6, abs=0.1)
+    assert decided[0] is gate.ingest and 25 <= decided[1] <= 31
+    assert gate.ingest.succeeded() and gate.ingest.wait_audio()
+    assert os.path.getsize(media_ingest.pcm_path_for(audio_path)) > 0
+    gate.close()
+
+
+def test_gate_does_not_stream_a_moov_at_the_end(video):
+    opened, decided = [], []
+    gate = FaststartGate(opened.append, decided.append)
+    feed_gate(gate, video)
+    assert opened == [] and decided == [None]
+
+
+def test_mp4_info_from_head(video, faststart_video):
+    with open(faststart_video, "rb") as f:
+        info = mp4_info_from_head(f.read(64 * 1024))
+    assert info == media_ingest._parse_mp4_header(faststart_video)
+    with open(video, "rb") as f:
+        assert mp4_info_from_head(f.read(64 * 1024)) is None
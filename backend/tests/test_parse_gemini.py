@@ -0,0 +1,95 @@
+import json
+
+import pytest
+
+import parse_gemini
+from parse_gemini import ListingStreamParser
+
+LISTING = {
+    "product_name": "Desk \"Pro\" Lamp, v2",
+    "description": "Bright {warm} light\\nwith a \\\\ back\\slash and café ☃",
+    "key_features": ["dimmable", "USB-C, 20W", {"nested": ["a", "]"]}],
+    "target_audience": "",
+    "seo_keywords": [],
+    "technical_details": {"weight": 1.2, "cordless": True, "colour": None},
+}
+TEXT = "```json\n" + json.dumps(LISTING, indent=2, ensure_ascii=False) + "\n```"
+
+
+def feed_all(parser, chunks):
+    fields = []
+    for chunk in chunks:
+        fields.extend(parser.feed(chunk))
+    return fields
+
+
+def test_whole_text():
+    assert feed_all(ListingStreamParser(), [TEXT]) == list(LISTING.items())
+
+
+def test_every_split_point():
+    # Covers splits inside keys, inside strings and between a backslash and the character it escapes
+    for split in range(1, len(TEXT)):
+        fields = feed_all(ListingStreamParser(), [TEXT[:split], TEXT[split:]])
+        assert fields == list(LISTING.items()), split
+
+
+def test_one_character_at_a_time():
+    assert feed_all(ListingStreamParser(), TEXT) == list(LISTING.items())
+
+
+def test_fields_arrive_as_soon_as_they_complete():
+    parser = ListingStreamParser()
+    end_of_name = TEXT.index('"description"')
+    assert parser.feed(TEXT[:end_of_name - 5]) == []
+    assert parser.feed(TEXT[end_of_name - 5:end_of_name]) == [("product_name", LISTING["product_name"])]
+    # A comma inside a string does not end the field
+    assert parser.feed('"description": "a, b') == []
+
+
+def test_escaped_quote_split_from_its_backslash():
+    parser = ListingStreamParser()
+    assert parser.feed('{"a": "say \\') == []
+    assert parser.feed('", then stop", "b": 1') == [("a", 'say ", then stop')]
+    assert parser.feed("}") == [("b", 1)]
+
+
+def test_text_after_the_object_is_ignored():
+    parser = ListingStreamParser()
+    assert parser.feed('{"a": 1}') == [("a", 1)]
+    assert parser.feed(', "b": 2}') == []
+
+
+def test_reset_starts_over():
+    parser = ListingStreamParser()
+    parser.feed('{"a": "half')
+    parser.reset()
+    assert parser.feed('{"b": 2}') == [("b", 2)]
+
+
+@pytest.fixture
+def request_dir(tmp_path):
+    (tmp_path / "caption.txt").write_text("caption", encoding="utf-8")
+    return str(tmp_path)
+
+
+def test_parse_content_reports_fields_while_streaming(request_dir, monkeypatch):
+    chunks = [TEXT[start:start + 7] for start in range(0, len(TEXT), 7)]
+    fed = []
+
+    def generate_text(model, contents, on_chunk=None, on_restart=None):
+        # A first attempt breaks off and the stream restarts from the beginning
+        on_chunk(TEXT[:40])
+        on_restart()
+        for chunk in chunks:
+            fed.append(chunk)
+            on_chunk(chunk)
+        return TEXT
+
+    monkeypatch.setattr(parse_gemini, "generate_text", generate_text)
+    fields = []
+    result = parse_gemini.parse_content("SC", request_dir, on_field=lambda key, value: fields.append((key, value, len(fed))))
+    assert result == LISTING
+    assert [(key, value) for key, value, _ in fields] == list(LISTING.items())
+    # The first field was reported long before the response was complete
+    assert fields[0][2] < len(chunks) // 4
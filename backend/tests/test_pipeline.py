@@ -0,0 +1,128 @@
+import json
+import os
+import threading
+
+import pytest
+
+import checkpoints
+import pipeline
+from expiry import MemoryExpiryRegistry
+from pipeline import PostJob
+from result_cache import MemoryResultCache
+
+
+def write(request_dir, rel, text="x"):
+    path = os.path.join(request_dir, rel)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+class Stages:
+    """Stand-ins for the pipeline's stage functions that count their calls."""
+
+    def __init__(self):
+        self.calls = []
+        self.fail = set()
+
+    def _call(self, stage):
+        self.calls.append(stage)
+        if stage in self.fail:
+            raise RuntimeError(f"{stage} failed")
+
+    def grab_post(self, shortcode, request_dir, video_sink=None):
+        self._call("download")
+        write(request_dir, "caption.txt", "#ad desk lamp")
+        write(request_dir, "video.mp4", "video bytes")
+        return {"is_video": True, "video_path": os.path.join(request_dir, "video.mp4")}
+
+    def video_to_frames(self, video_path, frames_dir, shortcode):
+        self._call("frames")
+        write(frames_dir, "frame_0001.png")
+
+    def classify_and_move_images(self, shortcode, request_dir, frames_dir, video_path):
+        self._call("classify")
+        write(request_dir, "relevant_final/frame_0001.png", "frame")
+        write(request_dir, "scores.json", "{}")
+
+    def transcribe_video(self, video_path, request_dir, audio_path=None, on_text=None):
+        self._call("transcript")
+        write(request_dir, "transcript.txt", "hello")
+        return "hello"
+
+    def parse_content(self, shortcode, request_dir, on_field=None):
+        self._call("listing")
+        return {"product_name": "Desk lamp"}
+
+
+@pytest.fixture
+def stages(monkeypatch):
+    stages = Stages()
+    for name in ("grab_post", "video_to_frames", "classify_and_move_images", "transcribe_video", "parse_content"):
+        monkeypatch.setattr(pipeline, name, getattr(stages, name))
+    monkeypatch.setattr(pipeline, "FRAME_EXTRACTION_MODE", "files")
+    monkeypatch.setattr(pipeline, "artifact_cache", None)
+    monkeypatch.setattr(pipeline, "result_cache", MemoryResultCache())
+    monkeypatch.setattr(pipeline, "resume_index", MemoryResultCache())
+    monkeypatch.setattr(pipeline, "expiry_registry", MemoryExpiryRegistry())
+    return stages
+
+
+def run_post(request_dir):
+    return PostJob("SC1", "req-1", request_dir, lambda event, payload: None).run()
+
+
+def test_retry_resumes_after_the_completed_stages(stages, tmp_path):
+    request_dir = str(tmp_path / "req-1")
+    stages.fail = {"classify"}
+    result = run_post(request_dir)
+    assert result["failed"]
+    assert sorted(stages.calls) == ["classify", "download", "frames", "transcript"]
+    # The failed run is left for a retry to pick up
+    assert pipeline.resume_index.get("SC1")["request_id"] == "req-1"
+
+    stages.calls, stages.fail = [], set()
+    result = run_post(request_dir)
+    assert not result.get("failed")
+    assert result["structured_content"] == {"product_name": "Desk lamp"}
+    assert stages.calls == ["frames", "classify", "listing"]
+
+    # Everything is done now; a third run only reads result.json back
+    stages.calls = []
+    result = run_post(request_dir)
+    assert result["structured_content"] == {"product_name": "Desk lamp"}
+    assert stages.calls == []
+
+
+def test_fallback_listing_is_not_checkpointed(stages, tmp_path):
+    request_dir = str(tmp_path / "req-1")
+    stages.fail = {"listing"}
+    result = run_post(request_dir)
+    assert result["structured_content"]["product_name"] == "Generated Listing"
+    assert checkpoints.completed(request_dir, "listing") is None
+
+    stages.calls, stages.fail = [], set()
+    run_post(request_dir)
+    assert stages.calls == ["listing"]
+    with open(os.path.join(request_dir, "result.json")) as f:
+        assert json.load(f) == {"product_name": "Desk lamp"}
+
+
+def test_transcription_runs_alongside_frame_classification(stages, tmp_path, monkeypatch):
+    started = {"classify": threading.Event(), "transcript": threading.Event()}
+    overlapped = []
+
+    def meet(stage, other, run):
+        def wrapper(*args, **kwargs):
+            started[stage].set()
+            # Each stage only finishes once the other one has started
+            overlapped.append(started[other].wait(5))
+            return run(*args, **kwargs)
+        return wrapper
+
+    monkeypatch.setattr(pipeline, "classify_and_move_images", meet("classify", "transcript", stages.classify_and_move_images))
+    monkeypatch.setattr(pipeline, "transcribe_video", meet("transcript", "classify", stages.transcribe_video))
+    result = run_post(str(tmp_path / "req-1"))
+    assert overlapped == [True, True]
+    assert not result.get("failed")
+    assert stages.calls[-1] == "listing"
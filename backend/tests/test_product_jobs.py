@@ -0,0 +1,198 @@
+import time
+
+import pytest
+
+import product_jobs
+from product_jobs import (
+    MemoryProductJobStore,
+    ProductJob,
+    create_product_batch,
+    create_product_job,
+    product_batch_status,
+    product_job_status,
+)
+
+
+class RecordingStore(MemoryProductJobStore):
+    """Keeps every status a job passes through."""
+
+    def __init__(self):
+        super().__init__()
+        self.statuses = []
+
+    def update(self, key, fields, ttl_seconds=product_jobs.PRODUCT_JOB_TTL_SECONDS):
+        if "status" in fields:
+            self.statuses.append(fields["status"])
+        super().update(key, fields, ttl_seconds)
+
+
+def fake_post_job(result=None, error=None, progress=()):
+    """A PostJob stand-in that emits the given progress values, then an error or its result."""
+    runs = []
+
+    class FakePostJob:
+        def __init__(self, shortcode, request_id, request_dir, emit):
+            self.shortcode = shortcode
+            self.request_id = request_id
+            self.emit = emit
+            runs.append(self)
+
+        def run(self):
+            for value in progress:
+                self.emit('progress', {'progress': value, 'data': f'step {value}'})
+            if error is not None:
+                self.emit('error', {'error': error})
+                return None
+            return dict(result, request_id=self.request_id)
+
+    FakePostJob.runs = runs
+    return FakePostJob
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    monkeypatch.setattr(product_jobs, "open_request_dir", lambda shortcode: ("req-1", str(tmp_path / "req-1")))
+    monkeypatch.setattr(product_jobs, "cached_result", lambda shortcode: None)
+    monkeypatch.setattr(product_jobs, "find_best_product_post", lambda name: {"shortcode": "ABC123"})
+    return RecordingStore()
+
+
+def run_job(store, product_name="desk lamp"):
+    job_id = create_product_job(store, product_name)
+    result = ProductJob(job_id, product_name, store).run()
+    return job_id, result
+
+
+def test_created_job_is_queued(store):
+    job_id = create_product_job(store, "desk lamp")
+    status = product_job_status(store, job_id)
+    assert status["status"] == "queued"
+    assert status["progress"] == 0
+    assert status["product_name"] == "desk lamp"
+
+
+def test_unknown_job_has_no_status(store):
+    assert product_job_status(store, "missing") is None
+
+
+def test_successful_job(store, monkeypatch):
+    post_job = fake_post_job(result={"structured_content": {"product_name": "Lamp"}}, progress=(50,))
+    monkeypatch.setattr(product_jobs, "PostJob", post_job)
+    progress = []
+    original_update = store.update
+
+    def update(key, fields, ttl_seconds=product_jobs.PRODUCT_JOB_TTL_SECONDS):
+        if "progress" in fields:
+            progress.append(int(fields["progress"]))
+        original_update(key, fields, ttl_seconds)
+
+    monkeypatch.setattr(store, "update", update)
+    job_id, result = run_job(store)
+
+    assert store.statuses == ["queued", "searching", "processing", "done"]
+    status = product_job_status(store, job_id)
+    assert status["shortcode"] == "ABC123"
+    assert status["progress"] == 100
+    assert status["result"] == result
+    assert status["request_id"] == post_job.runs[0].request_id
+    # Pipeline progress is scaled into the share left after the search
+    assert progress == [0, 5, product_jobs.SEARCH_PROGRESS, 60, 100]
+
+
+def test_cached_result_skips_the_pipeline(store, monkeypatch):
+    cached = {"request_id": "earlier", "structured_content": {}}
+    post_job = fake_post_job(result={})
+    monkeypatch.setattr(product_jobs, "PostJob", post_job)
+    monkeypatch.setattr(product_jobs, "cached_result", lambda shortcode: cached)
+    job_id, result = run_job(store)
+
+    assert result == cached
+    assert post_job.runs == []
+    assert store.statuses[-1] == "done"
+    assert product_job_status(store, job_id)["request_id"] == "earlier"
+
+
+def test_no_post_found(store, monkeypatch):
+    monkeypatch.setattr(product_jobs, "find_best_product_post", lambda name: None)
+    job_id, result = run_job(store)
+
+    assert result is None
+    assert store.statuses == ["queued", "searching", "failed"]
+    assert product_job_status(store, job_id)["error"] == "No relevant sponsored posts found"
+
+
+def test_search_error(store, monkeypatch):
+    def fail(name):
+        raise RuntimeError("rate limited")
+
+    monkeypatch.setattr(product_jobs, "find_best_product_post", fail)
+    job_id, result = run_job(store)
+
+    assert result is None
+    assert store.statuses[-1] == "failed"
+    assert "rate limited" in product_job_status(store, job_id)["error"]
+
+
+def test_pipeline_error(store, monkeypatch):
+    monkeypatch.setattr(product_jobs, "PostJob", fake_post_job(error="download failed"))
+    job_id, result = run_job(store)
+
+    assert result is None
+    assert store.statuses == ["queued", "searching", "processing", "failed"]
+    assert product_job_status(store, job_id)["error"] == "download failed"
+
+
+def test_batch_status_counts_finished_jobs(store, monkeypatch):
+    monkeypatch.setattr(product_jobs, "PostJob", fake_post_job(result={}))
+    done_id, _ = run_job(store)
+    queued_id = create_product_job(store, "mug")
+    batch_id = create_product_batch(store, [done_id, queued_id, "expired-job"])
+
+    status = product_batch_status(store, batch_id)
+    assert status["total"] == 3
+    assert status["done"] == 2
+    assert [job["status"] for job in status["jobs"]] == ["done", "queued", "expired"]
+
+
+def test_memory_store_keeps_strings_and_expires():
+    store = MemoryProductJobStore()
+    store.update("key", {"progress": 5, "status": "queued"}, ttl_seconds=0.05)
+    store.update("key", {"status": "searching"}, ttl_seconds=0.05)
+    assert store.get("key") == {"progress": "5", "status": "searching"}
+    time.sleep(0.1)
+    assert store.get("key") == {}
+
+
+def test_failed_pipeline_result_fails_the_job(store, monkeypatch):
+    # PostJob's placeholder after an error looks like a result but carries "failed"
+    placeholder = {"structured_content": {"product_name": "Generated Listing"}, "failed": True, "error": "download failed"}
+    monkeypatch.setattr(product_jobs, "PostJob", fake_post_job(result=placeholder))
+    job_id, result = run_job(store)
+
+    assert result is None
+    assert store.statuses[-1] == "failed"
+    status = product_job_status(store, job_id)
+    assert status["error"] == "download failed"
+    assert "result" not in status
+
+
+def test_process_post_hands_the_post_over(store, monkeypatch):
+    post_job = fake_post_job(result={})
+    monkeypatch.setattr(product_jobs, "PostJob", post_job)
+    handed = []
+    job_id = create_product_job(store, "desk lamp")
+    job = ProductJob(job_id, "desk lamp", store, process_post=lambda job, shortcode: handed.append((job, shortcode)))
+
+    assert job.run() is None
+    assert post_job.runs == []
+    assert handed == [(job, "ABC123")]
+    assert product_job_status(store, job_id)["status"] == "processing"
+
+    # The host reports the shared run back
+    job.attach("shared-run")
+    job.on_event('progress', {'progress': 50, 'data': 'Classifying'})
+    assert product_job_status(store, job_id)["progress"] == 60
+    job.finish({"request_id": "shared-run", "structured_content": {}})
+    status = product_job_status(store, job_id)
+    assert status["status"] == "done"
+    assert status["request_id"] == "shared-run"
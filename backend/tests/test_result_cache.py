@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from result_cache import MemoryResultCache, SQLiteResultCache
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_cache(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "memory":
+            return MemoryResultCache(**kwargs)
+        return SQLiteResultCache(str(tmp_path / "results" / "cache.sqlite3"), **kwargs)
+    return make
+
+
+def test_put_and_get(make_cache):
+    cache = make_cache(ttl_seconds=60)
+    assert cache.get("SC1") is None
+    cache.put("SC1", "req-1")
+    entry = cache.get("SC1")
+    assert entry["request_id"] == "req-1"
+    assert entry["expires_at"] == pytest.approx(entry["ts"] + 60)
+
+
+def test_a_newer_run_replaces_the_entry(make_cache):
+    cache = make_cache()
+    cache.put("SC1", "req-1")
+    cache.put("SC1", "req-2")
+    assert cache.get("SC1")["request_id"] == "req-2"
+    cache.delete("SC1")
+    assert cache.get("SC1") is None
+
+
+def test_entries_expire(make_cache):
+    cache = make_cache(ttl_seconds=60)
+    cache.put("short", "req-1", ttl_seconds=0.05)
+    cache.put("long", "req-2")
+    time.sleep(0.1)
+    assert cache.get("short") is None
+    assert cache.get("long")["request_id"] == "req-2"
+
+
+def test_evict_expired(make_cache):
+    cache = make_cache(ttl_seconds=60)
+    for shortcode in ("a", "b"):
+        cache.put(shortcode, f"req-{shortcode}", ttl_seconds=0.05)
+    cache.put("c", "req-c")
+    time.sleep(0.1)
+    assert cache.evict_expired() == 2
+    assert cache.evict_expired() == 0
+    assert cache.get("c")["request_id"] == "req-c"
+
+
+def test_oldest_entries_are_evicted_beyond_max_entries(make_cache):
+    cache = make_cache(max_entries=2)
+    for shortcode in ("a", "b", "c"):
+        cache.put(shortcode, f"req-{shortcode}")
+        time.sleep(0.01)
+    assert cache.get("a") is None
+    assert [cache.get(code)["request_id"] for code in ("b", "c")] == ["req-b", "req-c"]
+
+
+def test_sqlite_cache_is_shared_through_its_file(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    SQLiteResultCache(path).put("SC1", "req-1")
+    assert SQLiteResultCache(path).get("SC1")["request_id"] == "req-1"
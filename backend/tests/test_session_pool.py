@@ -0,0 +1,91 @@
+import pytest
+import requests
+from instaloader.exceptions import (
+    AbortDownloadException,
+    ConnectionException,
+    QueryReturnedNotFoundException,
+    TooManyRequestsException,
+)
+
+from post_metadata import PostUnavailable
+from session_pool import NoSessionAvailable, PooledSession, SessionPool, is_blocking_error
+
+
+def make_pool(count=2, quarantine_seconds=60):
+    return SessionPool([PooledSession(f"s{n}", client=None) for n in range(count)], quarantine_seconds)
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} error", response=response)
+
+
+def raised_from(error, cause):
+    try:
+        raise error from cause
+    except Exception as e:
+        return e
+
+
+@pytest.mark.parametrize("error", [
+    TooManyRequestsException("Please wait a few minutes before you try again."),
+    AbortDownloadException("checkpoint_required"),
+    http_error(429),
+    # instaloader gives up on a query with a ConnectionException raised from the last failure
+    raised_from(ConnectionException("JSON Query to graphql/query"), TooManyRequestsException("429")),
+])
+def test_blocking_errors(error):
+    assert is_blocking_error(error)
+
+
+@pytest.mark.parametrize("error", [
+    PostUnavailable("Post C429xyz is unavailable: 404 Not Found"),
+    raised_from(PostUnavailable("Post abc is unavailable"), QueryReturnedNotFoundException("not found")),
+    ValueError("https://www.instagram.com/p/429TooManyRequests/ login_required"),
+    ConnectionException("JSON Query to graphql/query: 500 Internal Server Error"),
+    http_error(404),
+])
+def test_post_level_errors_are_not_blocking(error):
+    assert not is_blocking_error(error)
+
+
+def test_blocked_session_is_quarantined():
+    pool = make_pool()
+    with pytest.raises(TooManyRequestsException):
+        with pool.session() as session:
+            blocked = session
+            raise TooManyRequestsException("429 Too Many Requests")
+    assert [s["quarantined_for"] > 0 for s in pool.status()] == [s is blocked for s in pool.sessions]
+    # Only the other session is handed out from now on
+    for _ in range(3):
+        with pool.session() as session:
+            assert session is not blocked
+
+
+def test_post_errors_leave_the_session_in_the_pool():
+    pool = make_pool(count=1)
+    with pytest.raises(PostUnavailable):
+        with pool.session():
+            raise PostUnavailable("Post C429 is unavailable: 429 in the shortcode")
+    with pool.session(timeout=0) as session:
+        assert session.quarantined_until == 0
+
+
+def test_acquire_gives_up_when_every_session_is_quarantined():
+    pool = make_pool(count=1)
+    with pytest.raises(TooManyRequestsException):
+        with pool.session():
+            raise TooManyRequestsException("429")
+    with pytest.raises(NoSessionAvailable):
+        pool.acquire(timeout=0.05)
+
+
+def test_quarantine_ends():
+    pool = make_pool(count=1, quarantine_seconds=0.1)
+    with pytest.raises(TooManyRequestsException):
+        with pool.session():
+            raise TooManyRequestsException("429")
+    # acquire waits for the quarantine to run out
+    session = pool.acquire(timeout=5)
+    pool.release(session)
@@ -0,0 +1,74 @@
+import subprocess
+
+import imageio_ffmpeg as iio_ffmpeg
+import numpy as np
+import pytest
+
+import voice_activity
+from media_ingest import AUDIO_SAMPLE_RATE, pcm_path_for
+from voice_activity import has_speech, read_pcm, speech_seconds
+
+RATE = AUDIO_SAMPLE_RATE
+T = np.arange(RATE * 5) / RATE
+
+
+def voice(t=T):
+    """Harmonic vowels with a gliding pitch, broken into syllables four times a second."""
+    phase = 2 * np.pi * np.cumsum(150 + 30 * np.sin(2 * np.pi * 0.7 * t)) / RATE
+    harmonics = sum(np.sin(k * phase) / k for k in range(1, 20))
+    syllables = np.sin(2 * np.pi * 4 * t) > 0
+    return (0.3 * harmonics / np.abs(harmonics).max() * syllables).astype(np.float32)
+
+
+@pytest.mark.parametrize("samples", [
+    np.zeros(len(T)),
+    0.5 * np.sin(2 * np.pi * 440 * T),
+    0.1 * np.random.default_rng(0).standard_normal(len(T)),
+    voice() * 0.0003,
+    np.zeros(100),
+], ids=["silence", "hum", "steady noise", "inaudible voice", "too short"])
+def test_no_speech(samples):
+    assert speech_seconds(samples.astype(np.float32)) == 0.0
+
+
+def test_syllables_count_as_speech():
+    # Only the voiced half of each syllable cycle counts
+    assert 2.0 <= speech_seconds(voice()) <= 3.5
+
+
+def test_speech_over_a_hum():
+    samples = voice() + (0.2 * np.sin(2 * np.pi * 440 * T)).astype(np.float32)
+    assert speech_seconds(samples) >= 2.0
+
+
+def write_pcm(audio_path, samples):
+    (np.clip(samples, -1, 1) * 32767).astype(np.int16).tofile(pcm_path_for(audio_path))
+
+
+def test_has_speech_reads_the_pcm_sidecar(tmp_path):
+    audio_path = str(tmp_path / "audio.mp3")
+    write_pcm(audio_path, voice())
+    assert has_speech(audio_path)
+    write_pcm(audio_path, np.zeros(len(T)))
+    assert not has_speech(audio_path)
+
+
+def test_read_pcm_decodes_other_files(tmp_path):
+    raw_path = str(tmp_path / "voice.raw")
+    write_pcm(raw_path, voice())
+    wav_path = str(tmp_path / "voice.wav")
+    subprocess.run(
+        [iio_ffmpeg.get_ffmpeg_exe(), "-loglevel", "error", "-f", "s16le", "-ar", str(RATE), "-ac", "1",
+         "-i", pcm_path_for(raw_path), wav_path],
+        check=True,
+    )
+    np.testing.assert_array_equal(read_pcm(wav_path), read_pcm(raw_path))
+
+
+def test_has_speech_errs_towards_transcribing(tmp_path, monkeypatch):
+    # Unreadable audio is transcribed anyway
+    assert has_speech(str(tmp_path / "missing.mp3"))
+    monkeypatch.setattr(voice_activity, "SPEECH_DETECTION_ENABLED", False)
+    audio_path = str(tmp_path / "audio.mp3")
+    write_pcm(audio_path, np.zeros(len(T)))
+    assert has_speech(audio_path)
@@ -1,38 +1,47 @@
 import os
 import sys
-import shlex
-import subprocess
 import tempfile
 import base64
+import hashlib
 import traceback
 from dotenv import load_dotenv
 import imageio_ffmpeg as iio_ffmpeg
-from google import genai
 from google.genai import types
+from llm_client import GEMINI_API_KEY, generate_text
+from media_ingest import probe_media, audio_output_args, pcm_path_for
+from voice_activity import has_speech
+from workers import native
+
+# Transcription runs on worker OS threads (see workers.run_blocking_streamed),
+# so ffmpeg is waited on with the real subprocess module
+subprocess = native("subprocess")
 
 # Ensure .env is loaded
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__))))
 load_dotenv()
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+TRANSCRIBE_MODEL = "gemini-2.0-flash"
+TRANSCRIBE_PROMPT = "transcribe the voice in the audio file, just return the voice, don't return anything else"
+# Identifies the model and prompt behind a transcript; part of its artifact cache key
+TRANSCRIBE_VERSION = TRANSCRIBE_MODEL + ":" + hashlib.sha256(TRANSCRIBE_PROMPT.encode("utf-8")).hexdigest()[:16]
 
 
 def extract_audio_ffmpeg(input_video_path, output_audio_path):
     """
     Extracts audio from a video using ffmpeg (no MoviePy).
-    Produces a small mono MP3 suitable for transcription to reduce memory/CPU.
+    Produces a small mono MP3 suitable for transcription to reduce memory/CPU,
+    plus the raw PCM copy speech detection reads (see audio_output_args).
     """
     ffmpeg_exe = iio_ffmpeg.get_ffmpeg_exe()
 
-    cmd = (
-        f'"{ffmpeg_exe}" -nostdin -hide_banner -y '
-        f'-i "{input_video_path}" '
-        f'-vn -ac 1 -ar 16000 -acodec libmp3lame -b:a 96k '
-        f'-threads 1 -loglevel error "{output_audio_path}"'
-    )
+    cmd = [
+        ffmpeg_exe, "-nostdin", "-hide_banner", "-y",
+        "-i", input_video_path,
+        "-threads", "1", "-loglevel", "error",
+    ] + audio_output_args(output_audio_path)
 
     proc = subprocess.run(
-        shlex.split(cmd),
+        cmd,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
     )
@@ -41,8 +50,11 @@ def extract_audio_ffmpeg(input_video_path, output_audio_path):
         raise RuntimeError(f"ffmpeg failed to extract audio: {stderr.strip()}")
 
 
-def transcribe_audio_genai(audio_file_path):
-    """Transcribes an audio file using the Gemini API (streaming)."""
+def transcribe_audio_genai(audio_file_path, on_text=None):
+    """
+    Transcribes an audio file using the Gemini API (streaming).
+    on_text(transcript_so_far) is called as each chunk arrives.
+    """
     print("Transcribing audio with Gemini 2.0 Flash...")
     transcription = ""
 
@@ -51,9 +63,6 @@ def transcribe_audio_genai(audio_file_path):
             print("Error: GEMINI_API_KEY missing in environment.")
             return ""
 
-        client = genai.Client(api_key=GEMINI_API_KEY)
-        model = "gemini-2.0-flash"
-
         try:
             with open(audio_file_path, "rb") as audio_file:
                 audio_data = audio_file.read()
@@ -74,23 +83,26 @@ def transcribe_audio_genai(audio_file_path):
                         mime_type="audio/mp3",
                         data=audio_base64,
                     ),
-                    types.Part.from_text(
-                        text="transcribe the voice in the audio file, just return the voice, don't return anything else"
-                    ),
+                    types.Part.from_text(text=TRANSCRIBE_PROMPT),
                 ],
             ),
         ]
 
-        generate_content_config = types.GenerateContentConfig()
+        streamed = []
 
-        for chunk in client.models.generate_content_stream(
-            model=model,
-            contents=contents,
-            config=generate_content_config,
-        ):
-            if hasattr(chunk, "text") and chunk.text:
-                print(chunk.text, end="")
-                transcription += chunk.text
+        def on_chunk(text):
+            print(text, end="")
+            streamed.append(text)
+            if on_text is not None:
+                on_text("".join(streamed))
+
+        def on_restart():
+            print("\n[transcription restarted]")
+            streamed.clear()
+            if on_text is not None:
+                on_text("")
+
+        transcription = generate_text(TRANSCRIBE_MODEL, contents, on_chunk=on_chunk, on_restart=on_restart)
 
     except Exception as e:
         print(f"An error occurred during Gemini API call: {e}")
@@ -99,26 +111,45 @@ def transcribe_audio_genai(audio_file_path):
     return transcription
 
 
-def transcribe_video(video_path, post_dir):
+def transcribe_video(video_path, post_dir, audio_path=None, on_text=None):
     """
     Extracts audio from a video using ffmpeg, transcribes it, and saves the transcript.
+    If audio_path points to audio already extracted by the media ingest, the
+    extraction step is skipped. Videos without a voice track are not sent for
+    transcription. on_text(transcript_so_far) follows the streamed transcript.
+    Returns the transcript ("" when there is no speech), or None on failure.
     """
-    print("Starting audio extraction from video...")
     temp_audio_path = None
 
     try:
         if not os.path.exists(video_path):
             print(f"Error: Video file not found at {video_path}")
-            return
+            return None
 
         os.makedirs(post_dir, exist_ok=True)
 
-        with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as temp_audio_file:
-            temp_audio_path = temp_audio_file.name
+        if not audio_path and not probe_media(video_path).get("has_audio"):
+            print("Video has no audio track; skipping transcription")
+            return ""
+
+        if not audio_path:
+            print("Starting audio extraction from video...")
+            with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as temp_audio_file:
+                temp_audio_path = temp_audio_file.name
+            extract_audio_ffmpeg(video_path, temp_audio_path)
+            audio_path = temp_audio_path
 
-        extract_audio_ffmpeg(video_path, temp_audio_path)
+        speech = has_speech(audio_path)
+        # The PCM copy only serves speech detection
+        try:
+            os.remove(pcm_path_for(audio_path))
+        except OSError:
+            pass
+        if not speech:
+            print("No speech detected in the audio; skipping transcription")
+            return ""
 
-        transcript = transcribe_audio_genai(temp_audio_path)
+        transcript = transcribe_audio_genai(audio_path, on_text=on_text)
 
         if transcript:
             print("\n--- VIDEO TRANSCRIPT ---")
@@ -128,18 +159,21 @@ def transcribe_video(video_path, post_dir):
             with open(transcript_path, "w", encoding="utf-8") as f:
                 f.write(transcript)
             print(f"Transcript saved to {transcript_path}")
-        else:
-            print("\nDEBUG: No text could be extracted from the audio.\n")
+            return transcript
+        print("\nDEBUG: No text could be extracted from the audio.\n")
+        return None
 
     except Exception as e:
         print(f"An error occurred during audio processing: {e}")
         traceback.print_exc()
+        return None
     finally:
-        if temp_audio_path and os.path.exists(temp_audio_path):
-            try:
-                os.remove(temp_audio_path)
-            except Exception:
-                pass
+        if temp_audio_path:
+            for path in (temp_audio_path, pcm_path_for(temp_audio_path)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
 
 
 if __name__ == "__main__":
@@ -1,29 +1,91 @@
+import os
+from collections import OrderedDict
 from PIL import Image
 import io
 import base64
+from workers import native
 
+# Longest edge, in pixels, of images attached to Gemini prompts
+IMAGE_PAYLOAD_MAX_EDGE = int(os.getenv("IMAGE_PAYLOAD_MAX_EDGE", "1024"))
+# Encoding of prompt images: "jpeg" or "webp"
+IMAGE_PAYLOAD_FORMAT = os.getenv("IMAGE_PAYLOAD_FORMAT", "jpeg").lower()
+IMAGE_PAYLOAD_QUALITY = int(os.getenv("IMAGE_PAYLOAD_QUALITY", "85"))
+# Most frames attached to one prompt; above it, frames are picked evenly across the video
+IMAGE_PAYLOAD_MAX_FRAMES = int(os.getenv("IMAGE_PAYLOAD_MAX_FRAMES", "30"))
+# Memory kept for already encoded frames, so retries and reruns skip the encode
+IMAGE_PAYLOAD_CACHE_BYTES = int(os.getenv("IMAGE_PAYLOAD_CACHE_BYTES", str(64 * 1024 * 1024)))
 
-def process_image(image_path, max_size=1024):
-    """Process and resize image if needed"""
+_PAYLOAD_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+_payload_cache = OrderedDict()
+_payload_cache_bytes = 0
+_payload_cache_lock = native("threading").Lock()
+
+
+def _cache_payload(key, value):
+    global _payload_cache_bytes
+    with _payload_cache_lock:
+        if key in _payload_cache:
+            return
+        _payload_cache[key] = value
+        _payload_cache_bytes += len(value[1])
+        while _payload_cache and _payload_cache_bytes > IMAGE_PAYLOAD_CACHE_BYTES:
+            _, (_, data) = _payload_cache.popitem(last=False)
+            _payload_cache_bytes -= len(data)
+
+
+def encode_image_payload(image_path, max_edge=None, fmt=None, quality=None):
+    """
+    Downscales an image to max_edge and encodes it as JPEG or WebP for a prompt.
+    Returns (mime_type, bytes), or None if the image cannot be read. Results are
+    cached in memory by path, modification time and settings.
+    """
+    max_edge = max_edge or IMAGE_PAYLOAD_MAX_EDGE
+    fmt = (fmt or IMAGE_PAYLOAD_FORMAT).lower()
+    quality = quality or IMAGE_PAYLOAD_QUALITY
+    pil_format, mime_type = _PAYLOAD_FORMATS.get(fmt, _PAYLOAD_FORMATS["jpeg"])
     try:
+        stat = os.stat(image_path)
+        key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, max_edge, pil_format, quality)
+        with _payload_cache_lock:
+            cached = _payload_cache.get(key)
+            if cached is not None:
+                _payload_cache.move_to_end(key)
+                return cached
+
         with Image.open(image_path) as img:
-            # Convert to RGB if needed
+            # thumbnail() lets the decoder downscale JPEGs and keeps the aspect ratio
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
             if img.mode != 'RGB':
                 img = img.convert('RGB')
-            
-            # Resize if too large
-            if img.width > max_size or img.height > max_size:
-                ratio = max_size / max(img.width, img.height)
-                new_size = (int(img.width * ratio), int(img.height * ratio))
-                img = img.resize(new_size, Image.LANCZOS)
-            
-            # Save to bytes
             buffer = io.BytesIO()
-            img.save(buffer, format='JPEG', quality=85)
-            return base64.b64encode(buffer.getvalue()).decode('utf-8')
+            img.save(buffer, format=pil_format, quality=quality)
+        value = (mime_type, buffer.getvalue())
+        _cache_payload(key, value)
+        return value
     except Exception as e:
         print(f"Error processing image {image_path}: {str(e)}")
         return None
+
+
+def select_payload_frames(image_paths, max_frames=None):
+    """Keeps at most max_frames of the (time-ordered) paths, spread evenly across them."""
+    max_frames = max_frames or IMAGE_PAYLOAD_MAX_FRAMES
+    if len(image_paths) <= max_frames:
+        return list(image_paths)
+    step = len(image_paths) / max_frames
+    return [image_paths[int(i * step)] for i in range(max_frames)]
+
+
+def process_image(image_path, max_size=1024):
+    """Process and resize image if needed"""
+    encoded = encode_image_payload(image_path, max_edge=max_size, fmt="jpeg", quality=85)
+    if encoded is None:
+        return None
+    return base64.b64encode(encoded[1]).decode('utf-8')
 def parse_claude_response(content):
     print("\n=== Parsing Content Start ===")
     print(content)
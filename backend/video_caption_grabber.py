@@ -1,16 +1,25 @@
 import instaloader
 import os
-import glob
 import re
 import time
 import shutil
 from functools import lru_cache
 from dotenv import load_dotenv
-import tempfile
+from itertools import islice
 from pathlib import Path
 
+import requests
+
+from rate_limit import TokenBucket
+from session_pool import SessionPool, PooledSession, NoSessionAvailable, is_blocking_error
+from media_download import download_post_media
+from post_metadata import PostUnavailable, post_metadata, create_post_metadata_cache
+from workers import native, run_parallel
+
 load_dotenv()
 
+_threading = native("threading")
+
 INSTAGRAM_USERNAME = os.getenv("INSTAGRAM_USERNAME")
 INSTAGRAM_PASSWORD = os.getenv("INSTAGRAM_PASSWORD")
 INSTAGRAM_SESSIONID = "76199069886%3AA8wSSxD8DU1stJ%3A14%3AAYff686tQsmQckbX9l5nEescOKKbXey1IFlqxT0AaA"
@@ -27,12 +36,29 @@ SESSION_FILE = (
 LEGACY_SESSION_FILE = (
     SESSIONS_DIR /
     f"session-{INSTAGRAM_USERNAME}") if INSTAGRAM_USERNAME else None
+# Sessions a download is tried with before it fails, when Instagram blocks the first ones
+INSTAGRAM_SESSION_ATTEMPTS = int(os.getenv("INSTAGRAM_SESSION_ATTEMPTS", "2"))
 
+# Hashtag queries per second across every product search, and the burst allowed above it
+PRODUCT_SEARCH_RATE_PER_SECOND = float(os.getenv("PRODUCT_SEARCH_RATE_PER_SECOND", "1"))
+PRODUCT_SEARCH_BURST = int(os.getenv("PRODUCT_SEARCH_BURST", "4"))
+# Top posts of each hashtag considered as candidates
+PRODUCT_SEARCH_POSTS_PER_TAG = int(os.getenv("PRODUCT_SEARCH_POSTS_PER_TAG", "20"))
+# Candidate posts looked up at the same time
+PRODUCT_SEARCH_WORKERS = int(os.getenv("PRODUCT_SEARCH_WORKERS", "4"))
+# HTTP statuses from the CDN that mean cached media URLs went stale
+STALE_MEDIA_STATUSES = (403, 404, 410)
 
-@lru_cache(maxsize=None)
-def get_instaloader_session():
-    """Initializes and logs into a reusable Instaloader session."""
-    print("Initializing new Instaloader session...")
+_session_pool_lock = _threading.Lock()
+_queue = native("queue")
+_search_rate_limiter = TokenBucket(PRODUCT_SEARCH_RATE_PER_SECOND, PRODUCT_SEARCH_BURST)
+
+post_metadata_cache = create_post_metadata_cache(
+    os.path.join(os.getenv("TEMP_PROCESSING_DIR", "temp_processing"), "post_metadata.sqlite3"),
+    prefix="socialkart:meta")
+
+
+def _new_instaloader():
     L = instaloader.Instaloader(download_pictures=True,
                                 download_videos=True,
                                 download_video_thumbnails=False,
@@ -48,6 +74,14 @@ def get_instaloader_session():
         L.context._session.headers.update({"User-Agent": INSTAGRAM_USER_AGENT})
     except Exception:
         pass
+    return L
+
+
+@lru_cache(maxsize=None)
+def get_instaloader_session():
+    """Initializes and logs into a reusable Instaloader session."""
+    print("Initializing new Instaloader session...")
+    L = _new_instaloader()
 
     # 1) Load from our pinned session files
     for candidate in [SESSION_FILE, LEGACY_SESSION_FILE]:
@@ -104,87 +138,204 @@ def get_instaloader_session():
     )
 
 
-class ProductPostFinder:
-
-    def __init__(self):
-        self.L = instaloader.Instaloader()
-        self.L.download_video_thumbnails = False
-        self.L.download_geotags = False
-        self.L.download_comments = False
-        self.L.save_metadata = False
-        self.L.download_pictures = True
+@lru_cache(maxsize=None)
+def _build_session_pool():
+    sessions = []
+    try:
+        primary = get_instaloader_session()
+        sessions.append(PooledSession(primary.context.username or INSTAGRAM_USERNAME or "primary", primary))
+    except Exception as e:
+        print(f"Primary Instagram session unavailable: {e}")
 
-    def login(self, username, password):
+    for session_file in sorted(SESSIONS_DIR.glob("*.session")):
+        username = session_file.stem
+        if any(s.name == username for s in sessions):
+            continue
+        L = _new_instaloader()
         try:
-            self.L.login(username, password)
-            return True
+            L.load_session_from_file(username=username, filename=str(session_file))
+            if L.test_login() is None:
+                raise RuntimeError("Invalid session file")
         except Exception as e:
-            print(f"Login failed: {e}")
-            return False
+            print(f"Failed to load session from {session_file}: {e}")
+            continue
+        sessions.append(PooledSession(username, L))
+
+    print(f"Instagram session pool ready with {len(sessions)} session(s)")
+    return SessionPool(sessions)
+
+
+def get_session_pool():
+    """
+    Returns the pool of Instagram sessions downloads rotate through: the account
+    from get_instaloader_session() plus every other backend/.sessions/<username>.session.
+    """
+    # Worker threads may ask at the same time; log in only once
+    with _session_pool_lock:
+        return _build_session_pool()
+
+
+def reset_sessions():
+    """Drops the cached sessions so the next download logs in again (e.g. after a cookie update)."""
+    with _session_pool_lock:
+        get_instaloader_session.cache_clear()
+        _build_session_pool.cache_clear()
+
+
+def _is_unavailable_error(error):
+    """True for lookup errors that mean the post itself cannot be fetched."""
+    if isinstance(error, (instaloader.exceptions.QueryReturnedNotFoundException,
+                          instaloader.exceptions.PrivateProfileNotFollowedException)):
+        return True
+    # instaloader reports a missing or hidden post as a failed metadata fetch
+    return (isinstance(error, instaloader.exceptions.BadResponseException)
+            and "fetching post metadata failed" in str(error).lower())
+
+
+def _lookup_post(session, shortcode, refresh=False):
+    """
+    post_metadata() of a post, from post_metadata_cache unless refresh is set
+    or it is missing there. Returns (metadata, from_cache). Raises
+    PostUnavailable for posts that do not exist or cannot be seen, and
+    remembers them for POST_METADATA_NEGATIVE_TTL_SECONDS.
+    """
+    if not refresh:
+        metadata = post_metadata_cache.get(shortcode)
+        if metadata is not None:
+            return metadata, True
+
+    session.pace()
+    try:
+        post = instaloader.Post.from_shortcode(session.client.context, shortcode)
+        metadata = post_metadata(post)
+    except Exception as e:
+        # Rate limits and challenges say nothing about the post; only remember real misses
+        if not is_blocking_error(e) and _is_unavailable_error(e):
+            post_metadata_cache.put_unavailable(shortcode, e)
+            raise PostUnavailable(f"Post {shortcode} is unavailable: {e}") from e
+        raise
+    post_metadata_cache.put(shortcode, metadata)
+    return metadata, False
+
+
+def _lookup_pooled(shortcode, refresh=False):
+    """
+    _lookup_post with a session leased from the pool only for the lookup
+    itself. If Instagram throttles or challenges that account, the session
+    is quarantined and the lookup is retried with the next one.
+    """
+    if not refresh:
+        metadata = post_metadata_cache.get(shortcode)
+        if metadata is not None:
+            return metadata, True
+    pool = get_session_pool()
+    attempts = max(1, min(len(pool), INSTAGRAM_SESSION_ATTEMPTS))
+    for attempt in range(attempts):
+        try:
+            with pool.session() as session:
+                print(f"Using Instagram session {session.name}")
+                return _lookup_post(session, shortcode, refresh)
+        except Exception as e:
+            if attempt + 1 >= attempts or not is_blocking_error(e):
+                raise
+            print(f"Session blocked ({e}); retrying with another session")
 
-    def search_product_posts(self, product_name, max_posts=10):
-        found_posts = []
-        search_urls = self._generate_search_tags(product_name)
 
-        try:
-            for url in search_urls:
-                time.sleep(2)
-                try:
-                    response = self.L.context.get_json(url)
+def get_post_metadata(shortcode, refresh=False):
+    """post_metadata() of a post, looked up with a pooled session on a cache miss."""
+    return _lookup_pooled(shortcode, refresh)[0]
 
-                    if not response or 'data' not in response:
-                        continue
 
-                    posts = response.get('data', {}).get('hashtag', {}).get(
-                        'edge_hashtag_to_media', {}).get('edges', [])
-                    for post_data in posts:
-                        if len(found_posts) >= max_posts:
-                            break
-
-                        post = post_data.get('node')
-                        if not post:
-                            continue
-
-                        shortcode = post.get('shortcode')
-                        if not shortcode:
-                            continue
-
-                        try:
-                            full_post = instaloader.Post.from_shortcode(
-                                self.L.context, shortcode)
-                            if self._is_relevant_sponsored_post(
-                                    full_post, product_name):
-                                found_posts.append(full_post)
-                        except Exception as e:
-                            print(f"Error fetching post {shortcode}: {e}")
-                            continue
+class ProductPostFinder:
+    """Finds sponsored posts about a product; every Instagram query goes through the session pool."""
 
+    def search_product_posts(self, product_name, max_posts=10):
+        """
+        Searches the product's hashtags concurrently and returns up to
+        max_posts post_metadata() dicts of relevant sponsored posts. Hashtag
+        queries share one rate limiter; candidates are deduplicated across tags
+        and looked up by PRODUCT_SEARCH_WORKERS threads as the tags come in,
+        and the search stops as soon as max_posts are found.
+        """
+        tags = self._generate_search_tags(product_name)
+        found_posts = []
+        seen = set()
+        errors = []
+        lock = _threading.Lock()
+        enough = _threading.Event()
+        candidates = _queue.Queue()
+
+        def search_tag(tag):
+            if enough.is_set():
+                return
+            try:
+                shortcodes = self._tag_shortcodes(tag)
+            except Exception as e:
+                print(f"Error searching #{tag}: {e}")
+                with lock:
+                    errors.append(e)
+                return
+            for shortcode in shortcodes:
+                with lock:
+                    if shortcode in seen:
+                        continue
+                    seen.add(shortcode)
+                candidates.put(shortcode)
+
+        def check_candidates():
+            while True:
+                shortcode = candidates.get()
+                if shortcode is None or enough.is_set():
+                    return
+                try:
+                    post = get_post_metadata(shortcode)
                 except Exception as e:
-                    print(f"Error processing URL {url}: {e}")
-                    return "Feature under Development!"
-
-            return found_posts
+                    print(f"Error fetching post {shortcode}: {e}")
+                    continue
+                if self._is_relevant_sponsored_post(post, product_name):
+                    with lock:
+                        if len(found_posts) < max_posts:
+                            found_posts.append(post)
+                        if len(found_posts) >= max_posts:
+                            enough.set()
 
-        except Exception as e:
-            print(f"Error searching posts: {e}")
-            return "Feature under Development!"
+        checkers = [_threading.Thread(target=check_candidates, daemon=True) for _ in range(max(1, PRODUCT_SEARCH_WORKERS))]
+        for checker in checkers:
+            checker.start()
+        try:
+            run_parallel(search_tag, tags, len(tags))
+        finally:
+            for _ in checkers:
+                candidates.put(None)
+            for checker in checkers:
+                checker.join()
+
+        if not found_posts and len(errors) == len(tags):
+            raise errors[0]
+        return found_posts
+
+    def _tag_shortcodes(self, tag):
+        """Shortcodes of a hashtag's top posts, queried with a pooled session."""
+        # Wait for the shared limiter before leasing, so queued tags do not hold sessions
+        _search_rate_limiter.acquire()
+        with get_session_pool().session() as session:
+            session.pace()
+            hashtag = instaloader.Hashtag.from_name(session.client.context, tag)
+            return [post.shortcode for post in islice(hashtag.get_top_posts(), PRODUCT_SEARCH_POSTS_PER_TAG)]
 
     def _generate_search_tags(self, product_name):
         base_tag = re.sub(r'[^a-zA-Z0-9]', '', product_name.lower())
-
-        search_url_template = "https://www.instagram.com/explore/search/keyword/?q=%23{}"
         tags = [
             base_tag, f"{base_tag}review", f"{base_tag}product",
             f"sponsored{base_tag}", "productreview", "sponsoredpost", "ad",
             "sponsored"
         ]
-        search_urls = [search_url_template.format(tag) for tag in tags]
-        return search_urls
+        return [tag for tag in dict.fromkeys(tags) if tag]
 
     def _is_relevant_sponsored_post(self, post, product_name):
-        if not post.caption:
+        if not post["caption"]:
             return False
-        caption_lower = post.caption.lower()
+        caption_lower = post["caption"].lower()
         product_lower = product_name.lower()
         sponsored_indicators = [
             '#ad', '#sponsored', '#sponsoredpost', '#advertisement',
@@ -196,54 +347,52 @@ class ProductPostFinder:
         return is_sponsored and contains_product
 
 
-def grab_post(shortcode, request_dir):
+def grab_post(shortcode, request_dir, video_sink=None):
+    """
+    Downloads a post into request_dir. Only the metadata lookup uses an
+    Instagram session (leased from the pool and returned right after); the
+    media comes from the CDN. video_sink is passed on to download_post_media.
+    """
     print(f"Starting to grab post with shortcode: {shortcode}")
-    L = get_instaloader_session()
-    if not L:
-        raise Exception("Failed to initialize Instaloader session.")
-
     try:
-        post = instaloader.Post.from_shortcode(L.context, shortcode)
-
-        # All files will be placed inside the unique request_dir
-        L.dirname_pattern = request_dir
+        post, from_cache = _lookup_pooled(shortcode)
 
         os.makedirs(request_dir, exist_ok=True)
 
         # Persist caption explicitly to ensure correctness regardless of Instaloader sidecar behavior
-        try:
-            caption_text = post.caption or ""
-        except Exception:
-            caption_text = ""
         with open(os.path.join(request_dir, "caption.txt"),
                   "w",
                   encoding="utf-8") as cf:
-            cf.write(caption_text)
+            cf.write(post["caption"] or "")
 
         print(f"Downloading post {shortcode}...")
-        L.download_post(post, target=shortcode)
+        # The files come from Instagram's CDN, so no session is held meanwhile
+        try:
+            media_paths = download_post_media(post, request_dir, video_sink=video_sink)
+        except requests.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            if not from_cache or status not in STALE_MEDIA_STATUSES:
+                raise
+            # Signed media URLs in a cached entry can expire before the entry does
+            print(f"Cached media URLs for {shortcode} are stale ({status}); refreshing")
+            post_metadata_cache.delete(shortcode)
+            post, _ = _lookup_pooled(shortcode, refresh=True)
+            media_paths = download_post_media(post, request_dir, video_sink=video_sink)
         print(f"Post downloaded successfully into: {request_dir}")
 
         video_path = None
-        if post.is_video:
-            video_files = glob.glob(os.path.join(request_dir, "*.mp4"))
-            if video_files:
-                # We move the video to a predictable name inside the request_dir for later use
-                final_video_path = os.path.join(request_dir, "video.mp4")
-                os.replace(video_files[0], final_video_path)
-                video_path = final_video_path
-                print(f"Video file saved to {final_video_path}")
-
-        image_files = glob.glob(os.path.join(request_dir, "*.jpg"))
+        final_video_path = os.path.join(request_dir, "video.mp4")
+        if post["is_video"] and final_video_path in media_paths:
+            video_path = final_video_path
+            print(f"Video file saved to {final_video_path}")
+
+        image_files = [path for path in media_paths if path.endswith(".jpg")]
         print(
             f"Found {len(image_files)} image files to be used as fallback if video frames fail."
         )
-        # No need to move/copy images here anymore as they are not used if there's a video.
         # If it's an image post, they will be used by parse_content directly from request_dir.
 
-        # We already wrote caption.txt explicitly. Ignore any additional txt sidecars created by Instaloader.
-
-        post_info = {'is_video': post.is_video, 'video_path': video_path}
+        post_info = {'is_video': post["is_video"], 'video_path': video_path}
 
         print(f"Post info: {post_info}")
         return post_info
@@ -255,66 +404,14 @@ def grab_post(shortcode, request_dir):
         raise e
 
 
-def process_product_request(product_name, base_dir):
-    finder = ProductPostFinder()
-
-    # Using the cached global session for login
-    L = get_instaloader_session()
-    if not L:
-        return {"error": "Failed to login to Instagram"}
-
-    try:
-        posts = finder.search_product_posts(product_name)
-
-        if posts == "Feature under Development!":
-            return {"error": "Product search is currently under development."}
-
-        if not posts:
-            return {"error": "No relevant sponsored posts found"}
-
-        best_post = max(posts, key=lambda p: p.likes)
-
-        post_data = grab_post(best_post.shortcode, base_dir)
-
-        return {"success": True, "post_data": post_data}
-
-    except Exception as e:
-        return {"error": f"Error processing request: {e}"}
-
-
-def process_product_background(product_name, request_id, set_progress):
-    with tempfile.TemporaryDirectory() as temp_dir:
-        try:
-            set_progress(
-                request_id, {
-                    "progress": "0",
-                    "current_step": "Initializing product search...",
-                    "error": ""
-                })
-
-            set_progress(request_id, {
-                "progress": "20",
-                "current_step": "Searching for product posts..."
-            })
-
-            # We don't need username/password here as the session is cached
-            result = process_product_request(product_name, temp_dir)
-
-            if result.get("error"):
-                set_progress(request_id, {"error": result["error"]})
-            else:
-                # This endpoint doesn't generate a final result in the same way.
-                # It finds a post, downloads it, but what should be returned?
-                # For now, let's just mark it as complete.
-                # A more complete implementation would need to decide what to do with the downloaded post data.
-                set_progress(
-                    request_id, {
-                        "progress": "100",
-                        "current_step": "Processing complete!",
-                        "result_ready": "true"
-                    })
-                # We could also store the result data in Redis if needed.
-                # set_result(request_id, result)
-
-        except Exception as e:
-            set_progress(request_id, {"error": str(e), "progress": "0"})
+def find_best_product_post(product_name):
+    """
+    post_metadata() of the most liked relevant sponsored post for a product,
+    or None if the search finds none.
+    """
+    if not len(get_session_pool()):
+        raise NoSessionAvailable("Failed to login to Instagram")
+    posts = ProductPostFinder().search_product_posts(product_name)
+    if not posts:
+        return None
+    return max(posts, key=lambda p: p["likes"])
@@ -0,0 +1,91 @@
+import os
+
+import imageio_ffmpeg as iio_ffmpeg
+import numpy as np
+
+from media_ingest import AUDIO_SAMPLE_RATE, pcm_path_for
+from workers import native
+
+subprocess = native("subprocess")
+
+# Set to "0" to always send the audio for transcription
+SPEECH_DETECTION_ENABLED = os.getenv("SPEECH_DETECTION_ENABLED", "1") == "1"
+# Seconds of speech-like audio needed before the transcription call is made
+SPEECH_MIN_SECONDS = float(os.getenv("SPEECH_MIN_SECONDS", "0.5"))
+# Frames whose non-steady speech-band energy is quieter than this (dBFS) never count as speech
+SPEECH_ABSOLUTE_FLOOR_DB = float(os.getenv("SPEECH_ABSOLUTE_FLOOR_DB", "-55"))
+# Speech rises and falls with syllables; within a one-second window its
+# level spans at least this many dB, unlike noise or sustained sounds
+SPEECH_MIN_MODULATION_DB = float(os.getenv("SPEECH_MIN_MODULATION_DB", "12"))
+
+FRAME_SECONDS = 0.03
+WINDOW_FRAMES = 33  # ~1 s
+SPEECH_BAND_HZ = (300, 3400)
+
+
+def read_pcm(audio_path, sample_rate=AUDIO_SAMPLE_RATE):
+    """
+    Mono float32 samples in [-1, 1] at sample_rate. Reads the raw PCM copy the
+    audio extraction wrote beside audio_path; other files are decoded with ffmpeg.
+    """
+    pcm_path = pcm_path_for(audio_path)
+    if sample_rate == AUDIO_SAMPLE_RATE and os.path.isfile(pcm_path):
+        return np.fromfile(pcm_path, dtype=np.int16).astype(np.float32) / 32768.0
+    cmd = [
+        iio_ffmpeg.get_ffmpeg_exe(), "-nostdin", "-hide_banner", "-loglevel", "error",
+        "-i", audio_path, "-vn", "-ac", "1", "-ar", str(sample_rate), "-f", "s16le", "pipe:1",
+    ]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to decode audio: {proc.stderr.decode(errors='ignore').strip()}")
+    return np.frombuffer(proc.stdout, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+def speech_seconds(samples, sample_rate=AUDIO_SAMPLE_RATE):
+    """
+    Estimates how many seconds of samples sound like speech. Within each
+    one-second window the steady part of every 300-3400 Hz spectrum bin (music
+    beds, hum) is treated as background; a frame counts when what rises above
+    that background is loud enough and swings in level the way syllables do.
+    """
+    frame_size = int(sample_rate * FRAME_SECONDS)
+    frame_count = len(samples) // frame_size
+    if frame_count == 0:
+        return 0.0
+
+    window_fn = np.hanning(frame_size)
+    frames = samples[:frame_count * frame_size].reshape(frame_count, frame_size)
+    freqs = np.fft.rfftfreq(frame_size, 1.0 / sample_rate)
+    band = (freqs >= SPEECH_BAND_HZ[0]) & (freqs <= SPEECH_BAND_HZ[1])
+    # Normalised so a full-scale sine in the band is about 0 dB
+    power = np.abs(np.fft.rfft(frames * window_fn, axis=1))[:, band] ** 2 / (frame_size * window_fn.sum() / 4)
+
+    speech = np.zeros(frame_count, dtype=bool)
+    window_frames = min(WINDOW_FRAMES, frame_count)
+    for start in range(0, frame_count - window_frames + 1, max(1, window_frames // 2)):
+        window_power = power[start:start + window_frames]
+        background = np.percentile(window_power, 20, axis=0)
+        foreground = np.clip(window_power - 2 * background, 0, None).sum(axis=1)
+        foreground_db = 10 * np.log10(foreground + 1e-12)
+        active = foreground_db > SPEECH_ABSOLUTE_FLOOR_DB
+        if active.mean() < 0.2:
+            continue
+        if np.percentile(foreground_db, 90) - np.percentile(foreground_db, 10) >= SPEECH_MIN_MODULATION_DB:
+            speech[start:start + window_frames] |= active
+    return float(speech.sum() * FRAME_SECONDS)
+
+
+def has_speech(audio_path):
+    """
+    Fast local check run before paying for a transcription call. Errs on the
+    side of transcribing: if the audio cannot be analysed, it reports speech.
+    """
+    if not SPEECH_DETECTION_ENABLED:
+        return True
+    try:
+        seconds = speech_seconds(read_pcm(audio_path))
+    except Exception as e:
+        print(f"Speech detection failed, transcribing anyway: {e}")
+        return True
+    print(f"Detected {seconds:.1f}s of speech-like audio")
+    return seconds >= SPEECH_MIN_SECONDS
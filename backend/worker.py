@@ -0,0 +1,99 @@
+import os
+import sys
+import socket
+import argparse
+import threading
+import multiprocessing
+
+from job_queue import JOB_BACKEND, get_job_backend, job_event
+from pipeline import PostJob
+from product_jobs import ProductJob, get_product_job_store
+
+
+def run_job(backend, job):
+    """
+    Runs one queued job. Post jobs relay their events through the backend's
+    pub/sub channel. Product jobs ("type": "product") search here and write to
+    the product job store; their post is handed to the web process, which
+    runs it like a socket request so both share one run.
+    """
+    job_id = job["job_id"]
+    if job.get("type") == "product":
+        def process_post(product_job, shortcode):
+            # The web process runs the post, joining any run of it already in progress
+            backend.publish(job_event(job, "product_post", {"shortcode": shortcode, "product_name": job["product_name"]}))
+
+        ProductJob(job_id, job["product_name"], get_product_job_store(), process_post=process_post).run()
+        return
+
+    def emit(event, payload):
+        backend.publish(job_event(job, event, payload))
+
+    PostJob(
+        job["shortcode"],
+        job_id,
+        job["request_dir"],
+        emit,
+        is_canceled=lambda: backend.is_canceled(job_id),
+    ).run()
+
+
+def run_worker(backend, worker_id, stop_event=None):
+    """
+    Processes jobs one at a time until stop_event is set. Jobs this worker_id
+    held when it last died are put back on the queue first.
+    """
+    requeued = backend.requeue_stale(worker_id)
+    if requeued:
+        print(f"[{worker_id}] Requeued {requeued} unfinished job(s)")
+    print(f"[{worker_id}] Waiting for jobs...")
+    while stop_event is None or not stop_event.is_set():
+        job = backend.reserve(worker_id, timeout=1.0)
+        if job is None:
+            continue
+        print(f"[{worker_id}] Picked up job {job['job_id']} ({job.get('shortcode') or job.get('product_name')})")
+        try:
+            run_job(backend, job)
+        except Exception as e:
+            print(f"[{worker_id}] Job {job['job_id']} failed: {e}")
+        finally:
+            backend.ack(worker_id, job)
+
+
+def start_local_workers(backend, count):
+    """Starts `count` worker threads inside the current process (used with the memory backend)."""
+    threads = []
+    for index in range(count):
+        thread = threading.Thread(target=run_worker, args=(backend, f"local:{index}"), daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+def _worker_process(worker_id):
+    run_worker(get_job_backend(), worker_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run SocialKart pipeline workers.")
+    parser.add_argument("--processes", type=int, default=int(os.getenv("WORKER_PROCESSES", "2")),
+                        help="number of worker processes on this node")
+    parser.add_argument("--name", default=socket.gethostname(),
+                        help="node name; worker ids must stay stable across restarts for requeueing")
+    args = parser.parse_args()
+
+    if JOB_BACKEND != "redis":
+        print("Set JOB_BACKEND=redis to run standalone workers.")
+        sys.exit(1)
+
+    processes = []
+    for index in range(args.processes):
+        process = multiprocessing.Process(target=_worker_process, args=(f"{args.name}:{index}",))
+        process.start()
+        processes.append(process)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+try:
+    from eventlet import patcher, tpool
+except ImportError:
+    patcher = None
+    tpool = None
+
+# How many posts are processed at the same time; further jobs wait in a FIFO queue
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", "4"))
+# OS threads available to CPU-bound stages (ONNX inference, PIL, frame decoding)
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(os.cpu_count() or 4)))
+
+if tpool is not None:
+    # Must happen before the first tpool.execute() spins up the pool
+    tpool.set_num_threads(max(CPU_WORKERS, MAX_CONCURRENT_JOBS * 2))
+
+
+def native(module_name):
+    """
+    Returns the unpatched stdlib module. The app runs under eventlet.monkey_patch(),
+    which turns threading/queue/subprocess into green versions that never run in parallel.
+    """
+    if patcher is not None:
+        return patcher.original(module_name)
+    return __import__(module_name)
+
+
+def _hub_is_green():
+    return patcher is not None and patcher.is_monkey_patched("thread")
+
+
+def run_blocking(fn, *args, **kwargs):
+    """
+    Runs fn in a real OS thread and returns its result. Under eventlet only the
+    calling green thread waits, so the hub keeps serving socket events while
+    ONNX, PIL or a blocking wait runs. Without eventlet fn is simply called.
+    """
+    if _hub_is_green():
+        return tpool.execute(fn, *args, **kwargs)
+    return fn(*args, **kwargs)
+
+
+def run_blocking_streamed(fn, on_update, poll_interval=0.05):
+    """
+    Like run_blocking, for work that reports intermediate results: fn(publish)
+    runs in a real OS thread and every publish(item) it makes is delivered to
+    on_update(item) in the calling thread, in order, while fn is still running.
+    """
+    if not _hub_is_green():
+        return fn(on_update)
+
+    updates = native("queue").Queue()
+    finished = native("threading").Event()
+    outcome = {}
+
+    def target():
+        try:
+            outcome["value"] = fn(updates.put)
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            finished.set()
+
+    native("threading").Thread(target=target, daemon=True).start()
+    while True:
+        done = finished.is_set()
+        while not updates.empty():
+            on_update(updates.get_nowait())
+        if done:
+            break
+        # Green sleep: the hub keeps serving while the worker thread runs
+        time.sleep(poll_interval)
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome.get("value")
+
+
+def run_parallel(fn, items, max_workers):
+    """
+    Calls fn(item) for every item on up to max_workers real OS threads and
+    returns the results in item order. The first exception is re-raised once
+    all threads have stopped; items not yet started are skipped after it.
+    Meant for blocking I/O inside a worker thread (e.g. several downloads).
+    """
+    items = list(items)
+    if not items:
+        return []
+    _threading = native("threading")
+    results = [None] * len(items)
+    errors = []
+    next_index = iter(range(len(items)))
+    lock = _threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                index = None if errors else next(next_index, None)
+            if index is None:
+                return
+            try:
+                results[index] = fn(items[index])
+            except BaseException as e:
+                with lock:
+                    errors.append(e)
+
+    threads = [_threading.Thread(target=worker, daemon=True) for _ in range(max(1, min(max_workers, len(items))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+class JobSlots:
+    """
+    Admission control for pipeline jobs: at most `limit` jobs run at once and
+    the rest wait in arrival order.
+    """
+
+    def __init__(self, limit):
+        self.limit = max(1, limit)
+        self._lock = threading.Condition()
+        self._running = 0
+        self._waiting = deque()
+
+    def queued(self):
+        with self._lock:
+            return len(self._waiting)
+
+    @contextmanager
+    def slot(self, on_queued=None):
+        """
+        Holds a job slot for the duration of the with-block. If the job has to
+        wait, on_queued(position) is called once with its 1-based queue position.
+        """
+        ticket = object()
+        with self._lock:
+            self._waiting.append(ticket)
+            position = len(self._waiting)
+            must_wait = self._running >= self.limit or self._waiting[0] is not ticket
+        if must_wait and on_queued is not None:
+            on_queued(position)
+        with self._lock:
+            while self._running >= self.limit or self._waiting[0] is not ticket:
+                self._lock.wait()
+            self._waiting.popleft()
+            self._running += 1
+            self._lock.notify_all()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._lock.notify_all()
+
+
+job_slots = JobSlots(MAX_CONCURRENT_JOBS)
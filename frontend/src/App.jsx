@@ -215,7 +215,7 @@ function ServiceStatusBanner() {
       </motion.div>
   );
 }
-function Home({ handleProcess, loading, progress, progressText, results, handleClear, caption }) {
+function Home({ handleProcess, loading, progress, progressText, results, handleClear, caption, transcript, partialListing }) {
   return (
     <div className="space-y-8">
       {/* Service Status Banner */}
@@ -253,6 +253,30 @@ function Home({ handleProcess, loading, progress, progressText, results, handleC
                 <p className="text-gray-700 text-sm whitespace-pre-wrap">{caption}</p>
               </div>
             )}
+            {transcript && (
+              <div className="mt-4 p-3 bg-gray-50 border border-gray-200 rounded-lg">
+                <p className="text-xs uppercase tracking-wide text-gray-500 mb-1">Audio Transcript</p>
+                <p className="text-gray-700 text-sm whitespace-pre-wrap">{transcript}</p>
+              </div>
+            )}
+            {partialListing && (
+              <div className="mt-4 p-3 bg-blue-50 border border-blue-200 rounded-lg">
+                <p className="text-xs uppercase tracking-wide text-blue-500 mb-1">Draft Listing</p>
+                {partialListing.product_name && (
+                  <p className="text-gray-800 font-semibold">{partialListing.product_name}</p>
+                )}
+                {partialListing.description && (
+                  <p className="text-gray-700 text-sm whitespace-pre-wrap mt-1">{partialListing.description}</p>
+                )}
+                {Array.isArray(partialListing.key_features) && partialListing.key_features.length > 0 && (
+                  <ul className="list-disc list-inside text-gray-700 text-sm mt-2">
+                    {partialListing.key_features.map((feature, index) => (
+                      <li key={index}>{String(feature)}</li>
+                    ))}
+                  </ul>
+                )}
+              </div>
+            )}
           </motion.div>
         )}
 
@@ -363,6 +387,8 @@ function AppContent() {
   const [progress, setProgress] = useState(0);
   const [progressText, setProgressText] = useState("");
   const [caption, setCaption] = useState("");
+  const [transcript, setTranscript] = useState("");
+  const [partialListing, setPartialListing] = useState(null);
   const cleanupTimerRef = useRef(null);
 
   // Load backend URL from public/config.json and init socket
@@ -496,7 +522,20 @@ function AppContent() {
         }
     });
 
+    socket.on('transcript_update', (data) => {
+        if (data && typeof data.transcript === 'string') {
+          setTranscript(data.transcript);
+        }
+    });
+
+    socket.on('partial_result', (data) => {
+        if (data && data.fields) {
+          setPartialListing(data.fields);
+        }
+    });
+
     socket.on('result', (data) => {
+        setPartialListing(null);
         const merged = { ...data, backendUrl };
         setResults(merged);
         setProgress(100);
@@ -520,6 +559,7 @@ function AppContent() {
     });
 
     socket.on('error', (data) => {
+        setPartialListing(null);
         setResults({ error: data.error });
         setLoading(false);
         setProgress(0);
@@ -531,6 +571,8 @@ function AppContent() {
         socket.off('result');
         socket.off('error');
         socket.off('caption_update');
+        socket.off('partial_result');
+        socket.off('transcript_update');
         clearTimeout(cleanupTimerRef.current); // Clean up timer on component unmount
     };
   }, [backendUrl]);
@@ -539,6 +581,8 @@ function AppContent() {
     clearTimeout(cleanupTimerRef.current);
     setLoading(true);
     setResults(null);
+    setTranscript("");
+    setPartialListing(null);
     localStorage.removeItem('lastRequestId');
     localStorage.removeItem('expirationTimestamp');
     setProgress(0);
@@ -569,6 +613,8 @@ function AppContent() {
                   results={results}
                   handleClear={clearCurrentResults}
                   caption={caption}
+                  transcript={transcript}
+                  partialListing={partialListing}
                 />
               }
             />